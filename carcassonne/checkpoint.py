@@ -0,0 +1,169 @@
+# Imports {{{
+import gzip
+from io import BytesIO
+import os
+import pickle
+import threading
+from uuid import uuid4
+# }}}
+
+# Logging {{{
+import logging
+log = logging.getLogger(__name__)
+# }}}
+
+# Constants {{{
+MANIFEST_FILENAME = "manifest.pickle.gz"
+PIECE_SUFFIX = ".pickle.gz"
+# }}}
+
+# Classes {{{
+class CheckpointWriter: # {{{
+    # A checkpoint is a directory holding a manifest and one file for each of
+    # the large pieces of a system (its corners, sides, and so on).  The
+    # manifest holds the rest of the state together with the names of the
+    # files of the pieces.
+    #
+    # Pieces are replaced rather than modified, so a piece that is the same
+    # object as when it was last written is not written again;  for the same
+    # reason the pieces can be pickled and compressed in a background thread
+    # while the sweep continues.  The manifest replaces the old one atomically
+    # once all of the pieces that it names have been written, and only then
+    # are the files of the pieces that it no longer names removed, so the
+    # directory always holds a complete checkpoint.
+    def __init__(self,path,compresslevel=1): # {{{
+        self.path = path
+        self.compresslevel = compresslevel
+        self.number_of_writes = 0
+        self.written_pieces = {}
+        self.thread = None
+        self.error = None
+    # }}}
+    def isBusy(self): # {{{
+        return self.thread is not None and self.thread.is_alive()
+    # }}}
+    def wait(self): # {{{
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+    # }}}
+    def write(self,system): # {{{
+        # Returns False without writing anything if the previous checkpoint
+        # is still being written, so that the sweep never waits for it.
+        if self.isBusy():
+            log.debug("Skipping checkpoint as the previous one is still being written.")
+            return False
+        self.wait()
+        os.makedirs(self.path,exist_ok=True)
+        self.number_of_writes += 1
+        pieces = system.formCheckpointPieces()
+        # The state has to be pickled now as (unlike the pieces) it is
+        # modified in place as the sweep continues.
+        state = dumpWithSystem(system.formCheckpointState(),system)
+        filenames = {}
+        pieces_to_write = []
+        for name, piece in pieces.items():
+            written = self.written_pieces.get(name)
+            if written is not None and written[0] is piece:
+                filenames[name] = written[1]
+            else:
+                # The names are unique so that a new writer on the directory
+                # of an earlier run never overwrites a piece that the
+                # manifest there still names.
+                filenames[name] = "{}-{}{}".format(name,uuid4().hex,PIECE_SUFFIX)
+                pieces_to_write.append((filenames[name],piece))
+            self.written_pieces[name] = (piece,filenames[name])
+        manifest = {
+            "class": type(system),
+            "pieces": filenames,
+            "state": state,
+        }
+        log.debug("Writing checkpoint #{} with {} of {} pieces changed.".format(self.number_of_writes,len(pieces_to_write),len(pieces)))
+        self.thread = threading.Thread(target=self._writeInBackground,args=(pieces_to_write,manifest))
+        self.thread.start()
+        return True
+    # }}}
+    def _writeAtomically(self,filename,obj): # {{{
+        path = os.path.join(self.path,filename)
+        temporary_path = path + ".tmp"
+        with open(temporary_path,"wb") as f:
+            f.write(gzip.compress(pickle.dumps(obj,pickle.HIGHEST_PROTOCOL),self.compresslevel))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path,path)
+    # }}}
+    def _writeInBackground(self,pieces_to_write,manifest): # {{{
+        try:
+            for filename, piece in pieces_to_write:
+                self._writeAtomically(filename,piece)
+            self._writeAtomically(MANIFEST_FILENAME,manifest)
+            referenced_filenames = set(manifest["pieces"].values())
+            for filename in os.listdir(self.path):
+                if filename.endswith(PIECE_SUFFIX) and filename != MANIFEST_FILENAME and filename not in referenced_filenames:
+                    os.remove(os.path.join(self.path,filename))
+        except Exception as error:
+            # Pieces that might not have been written must be written again.
+            self.written_pieces = {}
+            self.error = error
+    # }}}
+# }}}
+class SystemPickler(pickle.Pickler): # {{{
+    # The state of a system refers to the system itself (the policies are
+    # bound to it), which is stored as a reference to be filled in with the
+    # system that is being resumed.
+    def __init__(self,file,system): # {{{
+        pickle.Pickler.__init__(self,file,pickle.HIGHEST_PROTOCOL)
+        self.system = system
+    # }}}
+    def persistent_id(self,obj): # {{{
+        if obj is self.system:
+            return "system"
+    # }}}
+# }}}
+class SystemUnpickler(pickle.Unpickler): # {{{
+    def __init__(self,file,system): # {{{
+        pickle.Unpickler.__init__(self,file)
+        self.system = system
+    # }}}
+    def persistent_load(self,pid): # {{{
+        if pid == "system":
+            return self.system
+        raise pickle.UnpicklingError("unknown persistent reference {}".format(pid))
+    # }}}
+# }}}
+# }}}
+
+# Functions {{{
+def dumpWithSystem(obj,system): # {{{
+    f = BytesIO()
+    SystemPickler(f,system).dump(obj)
+    return f.getvalue()
+# }}}
+def loadWithSystem(data,system): # {{{
+    return SystemUnpickler(BytesIO(data),system).load()
+# }}}
+def readCheckpoint(path): # {{{
+    def load(filename):
+        with gzip.open(os.path.join(path,filename),"rb") as f:
+            return pickle.load(f)
+    manifest = load(MANIFEST_FILENAME)
+    pieces = {name: load(filename) for name, filename in manifest["pieces"].items()}
+    return manifest["class"], pieces, manifest["state"]
+# }}}
+# }}}
+
+# Exports {{{
+__all__ = [
+    "CheckpointWriter",
+    "SystemPickler",
+    "SystemUnpickler",
+
+    "dumpWithSystem",
+    "loadWithSystem",
+    "readCheckpoint",
+]
+# }}}
@@ -1,15 +1,15 @@
 # Imports {{{
-from numpy import complex128, dot
+from numpy import diag_indices_from, dot, result_type
 from numpy.linalg import norm
-from scipy.sparse.linalg import LinearOperator, gmres
+from scipy.linalg import cho_factor, cho_solve
 
 from .data import NDArrayData
-from .utils import Join, crand, prependDataContractor, unitize
+from .utils import Join, crand, prependPlannedDataContractor, unitize
 # }}}
 
 # Functions {{{
 # def computeCompressor(L,R,new_dimension) {{{
-@prependDataContractor(
+@prependPlannedDataContractor(
     # 0 = L, 1 = MLD, 2 = MRU, 3 = MRD, 4 = R
     [
         Join(0,2,1,0), # L -- MLD
@@ -23,7 +23,7 @@ from .utils import Join, crand, prependDataContractor, unitize
         [(0,1),(2,0)],
     ]
 )
-def computeProductCompressor(formMatrix,L,R,new_dimension):
+def computeProductCompressor(formMatrix,L,R,new_dimension,initial=None,tolerance=1e-8,maximum_number_of_iterations=4):
     if L.shape[1] != L.shape[2]:
         raise ValueError("left inward dimensions do not match (given " + str(L.shape) + ")")
     if R.shape[0] != R.shape[1]:
@@ -31,17 +31,31 @@ def computeProductCompressor(formMatrix,L,R,new_dimension):
     if L.shape[1] != R.shape[1]:
         raise ValueError("left and right shapes are incompatible (given " + str(L.shape) + " and " + str(R.shape) + ")")
     old_dimension = L.shape[1]
+    dtype = result_type(L.dtype,R.dtype)
     b = L.contractWith(R,(1,2,3),(0,1,2)).toArray().ravel()
-    compressor = NDArrayData.newRandom(old_dimension,new_dimension).unitize()
-    for _ in range(4):
+    # A compressor from an earlier call (e.g., from the last sweep) is a
+    # better starting point than a random one, provided that it still fits.
+    if initial is not None and initial.shape == (new_dimension,old_dimension):
+        compressor = initial.transpose()
+    else:
+        compressor = NDArrayData.newRandom(old_dimension,new_dimension,dtype=dtype).unitize()
+    for _ in range(maximum_number_of_iterations):
         A = formMatrix(L,compressor.conj(),compressor.transpose().conj(),compressor.transpose(),R).toArray()
+        # The normal equations are small, so they are solved directly by a
+        # Cholesky factorization.  A is often (nearly) rank-deficient, so a
+        # small shift is added to keep the nearly singular directions from
+        # blowing up;  otherwise unitizing the solution would make them as
+        # large as the others.
         At = A.transpose().conj()
-        x, info = gmres(
-            LinearOperator((old_dimension*new_dimension,)*2,lambda v: dot(At,dot(A,v)),dtype=complex128),
-            dot(At,b)
-        )
-        assert info == 0
+        AtA = dot(At,A)
+        AtA[diag_indices_from(AtA)] += max(AtA.diagonal().real.max(),1e-300)*1e-10
+        x = cho_solve(cho_factor(AtA),dot(At,b))
+        old_projector = dot(compressor.toArray(),compressor.toArray().transpose().conj())
         compressor = NDArrayData(x.reshape(old_dimension,new_dimension)).unitize()
+        # The compressor is only meaningful up to a unitary transformation of
+        # the new space, so convergence is measured using the projector.
+        if norm(dot(compressor.toArray(),compressor.toArray().transpose().conj())-old_projector) < tolerance:
+            break
     return compressor.transpose()
 # }}}
 # }}}
@@ -2,10 +2,10 @@
 from copy import copy
 from functools import partial, reduce
 from math import ceil
-from numpy import allclose, any, array, complex128, diag, dot, identity, isnan, multiply, ndarray, ones, prod, save, sqrt, tensordot, zeros
-from scipy.linalg import norm, qr, svd
+from numpy import allclose, any, array, complex128, complexfloating, diag, dot, einsum, float64, identity, iscomplexobj, isnan, issubdtype, matmul, multiply, ndarray, ones, prod, result_type, save, sqrt, tensordot, vdot, zeros
+from scipy.linalg import get_blas_funcs, norm, qr, svd
 
-from ..utils import crand, dropAt, randomComplexSample, unitize
+from ..utils import dropAt, randomComplexSample, randomSample, unitize
 # }}}
 
 # Exception classes {{{
@@ -29,8 +29,12 @@ class Data: # {{{
 # Classes {{{
 class NDArrayData(Data): # {{{
   # Class construction methods {{{
-    def __init__(self,_arr): # {{{
-        self._arr = _arr
+    def __init__(self,_arr,conjugated=False): # {{{
+        # When conjugated is set the data is the complex conjugate of _data;
+        # the conjugate is only formed (once) when _arr is first accessed,
+        # and operations that can work with the unconjugated data do so.
+        self._data = _arr
+        self._conjugated = conjugated
     # }}}
     @classmethod # newCollected {{{
     def newCollected(cls,datas):
@@ -45,7 +49,7 @@ class NDArrayData(Data): # {{{
         if new_dimension == old_dimension:
             return (cls.newIdentity(new_dimension),)*2
         else:
-            matrix = cls.newRandom(new_dimension,old_dimension).qr(mode='economic')[0]
+            matrix = cls.newRandom(new_dimension,old_dimension,dtype=dtype or complex128).qr(mode='economic')[0]
             return matrix, matrix.conj()
     # }}}
     @classmethod # newFilled {{{
@@ -65,8 +69,8 @@ class NDArrayData(Data): # {{{
         return cls(reduce(multiply.outer,factors))
     # }}}
     @classmethod # newRandom {{{
-    def newRandom(cls,*shape):
-        return cls(randomComplexSample(shape))
+    def newRandom(cls,*shape,dtype=complex128):
+        return cls(randomSample(shape,dtype))
     # }}}
     @classmethod # newRandomHermitian {{{
     def newRandomHermitian(cls,*shape):
@@ -94,7 +98,7 @@ class NDArrayData(Data): # {{{
         return NDArrayData(self._arr + other._arr)
     # }}}
     def __copy__(self): # {{{
-        return NDArrayData(copy(self._arr))
+        return NDArrayData(copy(self._data),self._conjugated)
     # }}}
     def __iadd__(self,other): # {{{
         self._arr += other._arr
@@ -105,7 +109,7 @@ class NDArrayData(Data): # {{{
         return self
     # }}}
     def __getitem__(self,index): # {{{
-        return NDArrayData(self._arr[index])
+        return NDArrayData(self._data[index],self._conjugated)
     # }}}
     def __neg__(self): # {{{
         return NDArrayData(-self._arr)
@@ -146,17 +150,106 @@ class NDArrayData(Data): # {{{
         return self.conj().join(1,0)
     # }}}
     def absorbMatrixAt(self,axis,matrix): # {{{
-        return matrix.contractWith(self,(1,),axis).join(*tuple(range(1,axis+1)) + (0,) + tuple(range(axis+1,self.ndim)))
+        # The matrix is applied to each slice along the axes before the given
+        # one, which leaves the new axis where it belongs;  unlike the generic
+        # version there is then no transposition of the result, which would
+        # otherwise cost a copy when the result is next used.  When the
+        # trailing axes are too small for the slices to be worth multiplying
+        # separately the generic version is used instead.
+        shape = self.shape
+        pre = prod(shape[:axis],dtype=int)
+        post = prod(shape[axis+1:],dtype=int)
+        new_shape = shape[:axis] + (matrix.shape[0],) + shape[axis+1:]
+        if post == 1:
+            return NDArrayData(dot(self._arr.reshape(pre,shape[axis]),matrix._arr.transpose()).reshape(new_shape))
+        elif post >= 16:
+            return NDArrayData(matmul(matrix._arr,self._arr.reshape(pre,shape[axis],post)).reshape(new_shape))
+        else:
+            return matrix.contractWith(self,(1,),axis).join(*tuple(range(1,axis+1)) + (0,) + tuple(range(axis+1,self.ndim)))
     # }}}
     def allcloseTo(self,other,rtol=1e-05,atol=1e-08): # {{{
         return allclose(self._arr,other._arr,rtol=rtol,atol=atol)
     # }}}
-    def conj(self): # {{{
-        return self.__class__(self._arr.conj())
+    def astype(self,dtype): # {{{
+        # Casting to a real type keeps the real part, as the imaginary part is
+        # expected to vanish whenever a real type has been chosen.
+        if iscomplexobj(self._arr) and not issubdtype(dtype,complexfloating):
+            return NDArrayData(self._arr.real.astype(dtype))
+        return NDArrayData(self._arr.astype(dtype,copy=False))
     # }}}
-    def contractWith(self,other,self_axes,other_axes): # {{{
+    def conj(self): # {{{
+        return self.__class__(self._data,not self._conjugated)
+    # }}}
+    def contractWith(self,other,self_axes,other_axes,out=None,accumulate=False): # {{{
+        if out is not None:
+            # The result is written into (or, when accumulating, added to)
+            # the given tensor, which must have the shape of the result;  it
+            # is multiplied directly into the memory of out when out is a
+            # contiguous array of the type of the result, and otherwise it is
+            # formed and then copied (or added) into out.
+            self_axes = [self_axes] if isinstance(self_axes,int) else list(self_axes)
+            other_axes = [other_axes] if isinstance(other_axes,int) else list(other_axes)
+            out_arr = out._arr
+            if out_arr.flags.c_contiguous and out_arr.dtype == result_type(self.dtype,other.dtype):
+                self_free_axes = [axis for axis in range(self.ndim) if axis not in self_axes]
+                other_free_axes = [axis for axis in range(other.ndim) if axis not in other_axes]
+                contracted_size = prod([self.shape[axis] for axis in self_axes],dtype=int)
+                self_matrix = self._arr.transpose(self_free_axes+self_axes).reshape(-1,contracted_size)
+                other_matrix = other._arr.transpose(other_axes+other_free_axes).reshape(contracted_size,-1)
+                out_matrix = out_arr.reshape(self_matrix.shape[0],other_matrix.shape[1])
+                if accumulate:
+                    # The transposed product is formed so that the Fortran
+                    # ordered matrix that BLAS updates in place is out itself.
+                    gemm = get_blas_funcs("gemm",(self_matrix,other_matrix,out_matrix))
+                    gemm(1,other_matrix.transpose(),self_matrix.transpose(),beta=1,c=out_matrix.transpose(),overwrite_c=True)
+                else:
+                    dot(self_matrix,other_matrix,out=out_matrix)
+            elif accumulate:
+                out_arr += tensordot(self._arr,other._arr,(self_axes,other_axes))
+            else:
+                out_arr[...] = tensordot(self._arr,other._arr,(self_axes,other_axes))
+            return out
+        if self._conjugated or getattr(other,"_conjugated",False):
+            self_axes = [self_axes] if isinstance(self_axes,int) else list(self_axes)
+            other_axes = [other_axes] if isinstance(other_axes,int) else list(other_axes)
+            if self._conjugated and other._conjugated:
+                return NDArrayData(tensordot(self._data,other._data,(self_axes,other_axes)),True)
+            # Exactly one of the two is lazily conjugated.  A contraction over
+            # all axes in order is an inner product, which needs no conjugate
+            # at all;  otherwise conj(A).B = conj(A.conj(B)) is used whenever
+            # conjugating B and the result is cheaper than conjugating A.
+            if self_axes == other_axes == list(range(self.ndim)) and self.shape == other.shape:
+                if self._conjugated:
+                    return NDArrayData(array(vdot(self._data,other._arr)))
+                else:
+                    return NDArrayData(array(vdot(other._data,self._arr)))
+            contracted_size = prod([self.shape[axis] for axis in self_axes],dtype=int)
+            result_size = self.size()*other.size()//max(contracted_size,1)**2
+            if self._conjugated and other.size() + result_size < self.size():
+                return NDArrayData(tensordot(self._data,other._arr.conj(),(self_axes,other_axes)),True)
+            if other._conjugated and self.size() + result_size < other.size():
+                return NDArrayData(tensordot(self._arr.conj(),other._data,(self_axes,other_axes)),True)
         return NDArrayData(tensordot(self._arr,other._arr,(self_axes,other_axes)))
     # }}}
+    def contractBatchWith(self,other,self_axes,other_axes): # {{{
+        # Both tensors have a leading batch axis that is kept as the leading
+        # axis of the result;  otherwise this is the same as contractWith.
+        self_axes = list(self_axes)
+        other_axes = list(other_axes)
+        self_free_axes = [axis for axis in range(1,self.ndim) if axis not in self_axes]
+        other_free_axes = [axis for axis in range(1,other.ndim) if axis not in other_axes]
+        batch_size = self.shape[0]
+        self_free_shape = tuple(self.shape[axis] for axis in self_free_axes)
+        other_free_shape = tuple(other.shape[axis] for axis in other_free_axes)
+        contracted_size = prod([self.shape[axis] for axis in self_axes],dtype=int)
+        return NDArrayData(matmul(
+            self._arr.transpose([0]+self_free_axes+self_axes).reshape(batch_size,prod(self_free_shape,dtype=int),contracted_size),
+            other._arr.transpose([0]+other_axes+other_free_axes).reshape(batch_size,contracted_size,prod(other_free_shape,dtype=int)),
+        ).reshape((batch_size,)+self_free_shape+other_free_shape))
+    # }}}
+    def contractNetworkWith(self,others,subscripts,path): # {{{
+        return NDArrayData(einsum(subscripts,self._arr,*(other._arr for other in others),optimize=path))
+    # }}}
     def contractWithAlongAll(self,other): # {{{
         assert self.ndim == other.ndim
         return self.contractWith(other,range(self.ndim),range(self.ndim))
@@ -193,7 +286,7 @@ class NDArrayData(Data): # {{{
     def dropUnitAxis(self,axis): # {{{
         if self.shape[axis] != 1:
             raise ValueError("Axis {} has non-unit dimension {}.".format(axis,self.shape[axis]))
-        return NDArrayData(self._arr.reshape(dropAt(self.shape,axis)))
+        return NDArrayData(self._data.reshape(dropAt(self.shape,axis)),self._conjugated)
     # }}}
     def extractScalar(self): # {{{
         if self.ndim != 0:
@@ -217,7 +310,7 @@ class NDArrayData(Data): # {{{
             if new_dimension < old_dimension:
                 raise ValueError("new dimension for axis {} is less than the old one ({} < {})".format(axis,new_dimension,old_dimension))
             new_shape[axis] = new_dimension
-        new_arr = crand(*new_shape)
+        new_arr = randomSample(new_shape,result_type(self.dtype,float64))
         old_indices = tuple(slice(0,d) for d in old_shape)
         new_arr[old_indices] = self._arr
         return NDArrayData(new_arr)
@@ -230,7 +323,7 @@ class NDArrayData(Data): # {{{
             if new_dimension < old_dimension:
                 raise ValueError("new dimension for axis {} is less than the old one ({} < {})".format(axis,new_dimension,old_dimension))
             new_shape[axis] = new_dimension
-        new_arr = zeros(new_shape,dtype=complex128)
+        new_arr = zeros(new_shape,dtype=result_type(self.dtype,float64))
         old_indices = tuple(slice(0,d) for d in old_shape)
         new_arr[old_indices] = self._arr
         return NDArrayData(new_arr)
@@ -244,21 +337,28 @@ class NDArrayData(Data): # {{{
             print(self.norm(),other.norm(),ndiff,ndiff/(self.norm()+other.norm()))
         return ndiff <= atol or ndiff/(self.norm()+other.norm())/2 <= rtol
     # }}}
+    def isReal(self): # {{{
+        return not iscomplexobj(self._arr) or not any(self._arr.imag)
+    # }}}
     def join(self,*groups): # {{{
+        # The transposition is only a view, but the reshape copies the data
+        # whenever a group merges axes that are not adjacent in memory after
+        # the transposition;  no permutation is kept pending for a later
+        # contraction to absorb, so such a join always costs a copy.
         groups = [[group] if isinstance(group,int) else group for group in groups]
-        _arr = self._arr.transpose([index for group in groups for index in group])
+        _arr = self._data.transpose([index for group in groups for index in group])
         shape = []
         index = 0
         for group in groups:
             shape.append(prod(_arr.shape[index:index+len(group)]))
             index += len(group)
-        return NDArrayData(_arr.reshape(shape))
+        return NDArrayData(_arr.reshape(shape),self._conjugated)
     # }}}
     def matvecWith(self,v): # {{{
         return v.absorbMatrixAt(0,self)
     # }}}
     def norm(self): # {{{
-        return norm(self._arr)
+        return norm(self._data)
     # }}}
     def normalizeAxis(self,axis,sqrt_svals=False,dont_recip_under=1e-14): # {{{
         if self.shape[axis] == 1:
@@ -316,7 +416,7 @@ class NDArrayData(Data): # {{{
         return NDArrayData(q), NDArrayData(r)
     # }}}
     def ravel(self): # {{{
-        return NDArrayData(self._arr.ravel())
+        return NDArrayData(self._data.ravel(),self._conjugated)
     # }}}
     def reverseLastAxis(self): # {{{
         return NDArrayData(self._arr[...,::-1])
@@ -325,7 +425,7 @@ class NDArrayData(Data): # {{{
         return prod(self.shape)
     # }}}
     def split(self,*splits): # {{{
-        return NDArrayData(self._arr.reshape(splits))
+        return NDArrayData(self._data.reshape(splits),self._conjugated)
     # }}}
     def splitAt(self,index,*split): # {{{
         splits = [size for size in self._arr.shape]
@@ -345,16 +445,27 @@ class NDArrayData(Data): # {{{
         return tuple(NDArrayData(x) for x in svd(self._arr,full_matrices=full_matrices))
     # }}}
     def transpose(self,*args): # {{{
-        return NDArrayData(self._arr.transpose(*args))
+        return NDArrayData(self._data.transpose(*args),self._conjugated)
     # }}}
     def unitize(self): # {{{
         return NDArrayData(unitize(self.toArray()))
     # }}}
   # }}}
   # Properties {{{
-    dtype = property(fget = lambda self: self._arr.dtype)
-    ndim = property(fget = lambda self: self._arr.ndim)
-    shape = property(fget = lambda self: self._arr.shape)
+    def _getArr(self): # {{{
+        if self._conjugated:
+            self._data = self._data.conj()
+            self._conjugated = False
+        return self._data
+    # }}}
+    def _setArr(self,_arr): # {{{
+        self._data = _arr
+        self._conjugated = False
+    # }}}
+    _arr = property(fget = _getArr, fset = _setArr)
+    dtype = property(fget = lambda self: self._data.dtype)
+    ndim = property(fget = lambda self: self._data.ndim)
+    shape = property(fget = lambda self: self._data.shape)
   # }}}
   # Constants {{{
 NDArrayData.I = NDArrayData(array([[1,0],[0,1]],dtype=complex128))
@@ -20,6 +20,14 @@ class CostTracker(Data): # {{{
         cost = self.cost + other.cost + prod(shape,dtype=int)*prod([x for i,x in enumerate(self.shape) if i in self_axes],dtype=int)
         return CostTracker(shape,cost)
     # }}}
+    def contractBatchWith(self,other,self_axes,other_axes): # {{{
+        result = CostTracker(self.shape[1:],self.cost).contractWith(CostTracker(other.shape[1:],other.cost),[axis-1 for axis in self_axes],[axis-1 for axis in other_axes])
+        return CostTracker(tuple(self.shape[:1])+result.shape,self.cost+other.cost+self.shape[0]*(result.cost-self.cost-other.cost))
+    # }}}
+    def contractNetworkWith(self,others,subscripts,path): # {{{
+        shape, cost, _ = simulateContractionPath([self]+list(others),subscripts,path)
+        return CostTracker(shape,cost)
+    # }}}
     def extractScalar(self): # {{{
         assert len(self.shape) == 0
         return self
@@ -32,17 +40,123 @@ class CostTracker(Data): # {{{
             )
     # }}}
 # }}}
+class MemoryLedger: # {{{
+    def __init__(self): # {{{
+        self.live = 0
+        self.peak = 0
+        self.intermediate_sizes = []
+    # }}}
+    def __repr__(self): # {{{
+        return "MemoryLedger(live={},peak={},intermediate_sizes={})".format(self.live,self.peak,self.intermediate_sizes)
+    # }}}
+    def allocate(self,size): # {{{
+        self.live += size
+        if self.live > self.peak:
+            self.peak = self.live
+    # }}}
+    def free(self,size): # {{{
+        self.live -= size
+    # }}}
+# }}}
+class MemoryTracker(CostTracker): # {{{
+    # Each tracker holds its size in the ledger until it is garbage collected,
+    # so the del statements emitted by formDataContractor release memory at
+    # the same points that they would for real data.
+    def __init__(self,shape,cost=0,ledger=None,base=None): # {{{
+        CostTracker.__init__(self,shape,cost)
+        if ledger is None:
+            ledger = MemoryLedger()
+        self.ledger = ledger
+        self.base = base
+        if base is None:
+            self.allocated = prod(shape,dtype=int)
+            ledger.allocate(self.allocated)
+        else:
+            self.allocated = 0
+    # }}}
+    def __del__(self): # {{{
+        self.ledger.free(self.allocated)
+    # }}}
+    def __repr__(self): # {{{
+        return "MemoryTracker({},{})".format(self.shape,self.cost)
+    # }}}
+    def contractWith(self,other,self_axes,other_axes): # {{{
+        result = CostTracker.contractWith(self,other,self_axes,other_axes)
+        self.ledger.intermediate_sizes.append(prod(result.shape,dtype=int))
+        return MemoryTracker(result.shape,result.cost,self.ledger)
+    # }}}
+    def contractBatchWith(self,other,self_axes,other_axes): # {{{
+        result = CostTracker.contractBatchWith(self,other,self_axes,other_axes)
+        self.ledger.intermediate_sizes.append(prod(result.shape,dtype=int))
+        return MemoryTracker(result.shape,result.cost,self.ledger)
+    # }}}
+    def contractNetworkWith(self,others,subscripts,path): # {{{
+        shape, cost, steps = simulateContractionPath([self]+list(others),subscripts,path)
+        for size, consumed_sizes in steps:
+            self.ledger.intermediate_sizes.append(size)
+            self.ledger.allocate(size)
+            for consumed_size in consumed_sizes:
+                self.ledger.free(consumed_size)
+        # The last intermediate is handed over to the result.
+        self.ledger.free(steps[-1][0])
+        return MemoryTracker(shape,cost,self.ledger)
+    # }}}
+    def join(self,*groups): # {{{
+        result = CostTracker.join(self,*groups)
+        groups = [[group] if isinstance(group,int) else group for group in groups]
+        if [index for group in groups for index in group] == list(range(self.ndim)):
+            # Merging adjacent axes without permuting them does not copy the data.
+            return MemoryTracker(result.shape,result.cost,self.ledger,self)
+        self.ledger.intermediate_sizes.append(prod(result.shape,dtype=int))
+        return MemoryTracker(result.shape,result.cost,self.ledger)
+    # }}}
+# }}}
 # }}}
 
 # Functions {{{
 def computeCostOfContracting(contractor,*tensors): # {{{
     return contractor(*(CostTracker(tensor.shape) if not isinstance(tensor,tuple) else CostTracker(tensor) for tensor in tensors)).cost
 # }}}
+def simulateContractionPath(tensors,subscripts,path): # {{{
+    input_subscripts, output_subscript = subscripts.split("->")
+    dimensions = {}
+    for tensor, labels in zip(tensors,input_subscripts.split(",")):
+        dimensions.update(zip(labels,tensor.shape))
+    cost = sum(tensor.cost for tensor in tensors)
+    # Each operand is (labels, size if it is an intermediate or else 0).
+    operands = [(labels,0) for labels in input_subscripts.split(",")]
+    steps = []
+    for step in path[1:]:
+        step_operands = [operands[i] for i in step]
+        for i in sorted(step,reverse=True):
+            del operands[i]
+        remaining_labels = set("".join(labels for labels, _ in operands) + output_subscript)
+        step_labels = set("".join(labels for labels, _ in step_operands))
+        labels = "".join(sorted(label for label in step_labels if label in remaining_labels))
+        if len(step) > 1:
+            cost += prod([dimensions[label] for label in step_labels],dtype=int)
+        size = prod([dimensions[label] for label in labels],dtype=int)
+        steps.append((size,[step_size for _, step_size in step_operands if step_size]))
+        operands.append((labels,size))
+    return tuple(dimensions[label] for label in output_subscript), cost, steps
+# }}}
+def computeMemoryUsageOfContracting(contractor,*tensors): # {{{
+    ledger = MemoryLedger()
+    contractor(*(MemoryTracker(tensor.shape if not isinstance(tensor,tuple) else tensor,0,ledger) for tensor in tensors))
+    return ledger
+# }}}
+def computePeakMemoryOfContracting(contractor,*tensors): # {{{
+    return computeMemoryUsageOfContracting(contractor,*tensors).peak
+# }}}
 # }}}
 
 # Exports {{{
 __all__ = [
     "CostTracker",
+    "MemoryLedger",
+    "MemoryTracker",
 
     "computeCostOfContracting",
+    "computeMemoryUsageOfContracting",
+    "computePeakMemoryOfContracting",
 ] # }}}
@@ -1,5 +1,8 @@
 # Imports {{{
 from numpy.linalg import norm
+from time import time
+
+from .checkpoint import CheckpointWriter
 from .utils import O
 # }}}
 
@@ -10,6 +13,8 @@ log = logging.getLogger(__name__)
 
 # Base classes {{{
 class Policy: # {{{
+    # Whether the policy (and its state) is saved in checkpoints of the system.
+    checkpointed = True
     def createBindingToSystem(self,system):
         return self.Proxy(self,system)
 # }}}
@@ -19,6 +24,10 @@ class Proxy: # {{{
         self.system = system
     # }}}
     def __getattr__(self,name): # {{{
+        # When a proxy is unpickled its attributes are looked up before they
+        # have been restored, so forward might not be there yet.
+        if name == "forward":
+            raise AttributeError(name)
         return getattr(self.forward,name)
     # }}}
 # }}}
@@ -73,6 +82,45 @@ class OneDirectionIncrementBandwidthIncreasePolicy(BandwidthIncreasePolicy): # {
 # }}}
 # }}}
 
+# Checkpoint policies {{{
+class CheckpointPolicy(Policy): # {{{
+    Proxy = ApplyProxy
+    checkpointed = False
+    def __init__(self,path,compresslevel=1):
+        self.path = path
+        self.compresslevel = compresslevel
+    def createBindingToSystem(self,system):
+        proxy = Policy.createBindingToSystem(self,system)
+        proxy.writer = CheckpointWriter(self.path,self.compresslevel)
+        return proxy
+# }}}
+class IterationCountCheckpointPolicy(CheckpointPolicy): # {{{
+    def __init__(self,path,number_of_iterations,compresslevel=1):
+        CheckpointPolicy.__init__(self,path,compresslevel)
+        self.number_of_iterations = number_of_iterations
+    def createBindingToSystem(self,system):
+        proxy = CheckpointPolicy.createBindingToSystem(self,system)
+        proxy.number_of_iterations_since_checkpoint = 0
+        return proxy
+    def apply(self):
+        self.number_of_iterations_since_checkpoint += 1
+        if self.number_of_iterations_since_checkpoint >= self.number_of_iterations and self.writer.write(self.system):
+            self.number_of_iterations_since_checkpoint = 0
+# }}}
+class TimeIntervalCheckpointPolicy(CheckpointPolicy): # {{{
+    def __init__(self,path,interval,compresslevel=1):
+        CheckpointPolicy.__init__(self,path,compresslevel)
+        self.interval = interval
+    def createBindingToSystem(self,system):
+        proxy = CheckpointPolicy.createBindingToSystem(self,system)
+        proxy.time_of_checkpoint = time()
+        return proxy
+    def apply(self):
+        if time() - self.time_of_checkpoint >= self.interval and self.writer.write(self.system):
+            self.time_of_checkpoint = time()
+# }}}
+# }}}
+
 # Compression policies {{{
 class CompressionPolicy(Policy): # {{{
     Proxy = ApplyProxy
@@ -125,11 +173,13 @@ class PeriodicyThresholdConvergencePolicy(ConvergencePolicy): # {{{
             raise ValueError("at least one direction must be specified")
         self.directions = directions
     def converged(self):
+        # The factorizations are cached by the system, which reuses them
+        # when it next contracts the center.
         state_center_data = self.system.state_center_data
         difference = 0
         for direction in self.directions:
-            normalized_data = state_center_data.normalizeAxis(direction)[0]
-            denormalizer = state_center_data.normalizeAxis(O(direction))[-1]
+            normalized_data = self.system.normalizeStateCenterAxis(direction)[0]
+            denormalizer = self.system.normalizeStateCenterAxis(O(direction))[-1]
             difference += (state_center_data-normalized_data.absorbMatrixAt(direction,denormalizer)).norm()
         return difference < self.threshold
     def reset(self):
@@ -233,9 +283,35 @@ class RelativeStateDifferenceThresholdConvergencePolicy(ConvergencePolicy): # {{
 # }}}
 # }}}
 
+# Precision policies {{{
+class PrecisionPolicy(Policy): # {{{
+    Proxy = ApplyProxy
+# }}}
+class SinglePrecisionUntilConvergedPrecisionPolicy(PrecisionPolicy): # {{{
+    def __init__(self,convergence_policy):
+        self.convergence_policy = convergence_policy
+    def createBindingToSystem(self,system):
+        proxy = PrecisionPolicy.createBindingToSystem(self,system)
+        proxy.convergence_policy = self.convergence_policy.createBindingToSystem(system)
+        proxy.switched = False
+        return proxy
+    def apply(self):
+        if self.switched:
+            return
+        self.convergence_policy.update()
+        if self.convergence_policy.converged():
+            log.info("Switching to double precision.")
+            self.system.setPrecision(False)
+            self.switched = True
+        else:
+            self.system.setPrecision(True)
+# }}}
+# }}}
+
 # Hook Policy {{{
 class HookPolicy(Policy):
     Proxy = ApplyProxy
+    checkpointed = False
     def __init__(self,callback):
         self.callback = callback
     def apply(self):
@@ -257,6 +333,10 @@ __all__ = [
     "AlternatingDirectionsIncrementBandwidthIncreasePolicy",
     "OneDirectionIncrementBandwidthIncreasePolicy",
 
+    "CheckpointPolicy",
+    "IterationCountCheckpointPolicy",
+    "TimeIntervalCheckpointPolicy",
+
     "CompressionPolicy",
     "ConstantStateCompressionPolicy",
 
@@ -270,5 +350,8 @@ __all__ = [
     "RelativeOneSiteExpectationDifferenceThresholdConvergencePolicy",
     "RelativeStateDifferenceThresholdConvergencePolicy",
 
+    "PrecisionPolicy",
+    "SinglePrecisionUntilConvergedPrecisionPolicy",
+
     "HookPolicy",
 ]
@@ -1,6 +1,8 @@
 # Imports {{{
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from functools import partial
+import itertools
+from numpy import complex128, float64, result_type
 
 from .utils import L,R,O, buildTensor
 # }}}
@@ -208,6 +210,66 @@ class TwoSiteOperatorCompressed: # {{{
 # }}}
 # }}}
 
+# Containers {{{
+class StackedSparseTensor: # {{{
+    # A sparse tensor whose blocks all have the same shape and are stored in a
+    # single tensor, the stack, whose leading axis is indexed by the slot of
+    # each tag.  It supports the read-only part of the dictionary interface so
+    # that it can be used wherever a sparse tensor is expected, while the
+    # sparse operations in this module act on the whole stack at once.
+    __slots__ = ["slots","stack","tags"]
+    def __init__(self,tags,stack): # {{{
+        self.tags = list(tags)
+        self.slots = {tag: slot for slot, tag in enumerate(self.tags)}
+        self.stack = stack
+        if len(self.tags) != stack.shape[0]:
+            raise ValueError("the number of tags ({}) does not match the number of stacked blocks ({})".format(len(self.tags),stack.shape[0]))
+    # }}}
+    @classmethod # newFromSparse {{{
+    def newFromSparse(cls,sparse):
+        if isinstance(sparse,cls):
+            return sparse
+        if len(sparse) == 0:
+            raise ValueError("an empty sparse tensor cannot be stacked")
+        tags = list(sparse.keys())
+        return cls(tags,type(sparse[tags[0]]).newCollected([sparse[tag] for tag in tags]))
+    # }}}
+    def __contains__(self,tag): # {{{
+        return tag in self.slots
+    # }}}
+    def __getitem__(self,tag): # {{{
+        return self.stack[self.slots[tag]]
+    # }}}
+    def __iter__(self): # {{{
+        return iter(self.tags)
+    # }}}
+    def __len__(self): # {{{
+        return len(self.tags)
+    # }}}
+    def __repr__(self): # {{{
+        return "StackedSparseTensor({},{})".format(self.tags,self.stack)
+    # }}}
+    def get(self,tag,default=None): # {{{
+        return self[tag] if tag in self.slots else default
+    # }}}
+    def items(self): # {{{
+        return [(tag,self.stack[slot]) for slot, tag in enumerate(self.tags)]
+    # }}}
+    def keys(self): # {{{
+        return self.slots.keys()
+    # }}}
+    def select(self,tags): # {{{
+        return self.stack[[self.slots[tag] for tag in tags]]
+    # }}}
+    def toSparse(self): # {{{
+        return dict(self.items())
+    # }}}
+    def values(self): # {{{
+        return [self.stack[slot] for slot in range(len(self.tags))]
+    # }}}
+# }}}
+# }}}
+
 # Directions {{{
 LEFT = 0
 RIGHT = 1
@@ -221,28 +283,122 @@ def addStandardCompleteAndIdentityTerms(terms,dense): # {{{
     terms[Identity,Complete] = lambda x,y: (Complete(),dense)
 # }}}
 def contractSparseTensors(dense_contractors,tensor_1,tensor_2): # {{{
+    # Rather than visiting every pair of tags, the tags are grouped by type so
+    # that only the pairs of types with a dense contractor are visited;
+    # furthermore, operator tags only ever match tags of the same operator,
+    # so when both types carry an operator id only pairs with equal ids are
+    # visited.
+    #
+    # When the first tensor is stacked, the matching pairs are instead
+    # gathered into one batch per dense contractor, and then each batch is
+    # contracted at once (see contractSparseTensorsInBatches).
+    groups_1 = groupSparseTensorByTagTypeAndId(tensor_1)
+    groups_2 = groupSparseTensorByTagTypeAndId(tensor_2)
+    stacked = isinstance(tensor_1,StackedSparseTensor)
+    batches = defaultdict(list)
     result_tensor = {}
-    for tag_1, data_1 in tensor_1.items():
-        tag_1_type = type(tag_1)
-        for tag_2, data_2 in tensor_2.items():
-            tag_2_type = type(tag_2)
-            if (tag_1_type,tag_2_type) in dense_contractors:
-                handler = dense_contractors[tag_1_type,tag_2_type](tag_1,tag_2)
-                if handler is not None:
-                    result_tag, contractDenseTensors = handler
-                    if result_tag is not None:
-                        result_data = contractDenseTensors(data_1,data_2)
-                        if result_tag in result_tensor:
-                            result_tensor[result_tag] += result_data
-                        else:
-                            result_tensor[result_tag]  = result_data
+    for (tag_1_type,tag_2_type), formHandler in dense_contractors.items():
+        if tag_1_type not in groups_1 or tag_2_type not in groups_2:
+            continue
+        groups_by_id_1 = groups_1[tag_1_type]
+        groups_by_id_2 = groups_2[tag_2_type]
+        if hasattr(tag_1_type,"id") and hasattr(tag_2_type,"id"):
+            pairs = (
+                (item_1,item_2)
+                for id, items_1 in groups_by_id_1.items()
+                if id in groups_by_id_2
+                for item_1 in items_1
+                for item_2 in groups_by_id_2[id]
+            )
+        else:
+            pairs = itertools.product(
+                itertools.chain.from_iterable(groups_by_id_1.values()),
+                itertools.chain.from_iterable(groups_by_id_2.values()),
+            )
+        for (tag_1, data_1), (tag_2, data_2) in pairs:
+            handler = formHandler(tag_1,tag_2)
+            if handler is not None:
+                result_tag, contractDenseTensors = handler
+                if result_tag is None:
+                    continue
+                if stacked:
+                    batches[contractDenseTensors].append((tag_1,tag_2,result_tag))
+                else:
+                    result_data = contractDenseTensors(data_1,data_2)
+                    if result_tag in result_tensor:
+                        result_tensor[result_tag] += result_data
+                    else:
+                        result_tensor[result_tag]  = result_data
+    if stacked:
+        return contractSparseTensorsInBatches(batches,tensor_1,tensor_2)
     return result_tensor
 # }}}
+def contractSparseTensorsInBatches(batches,tensor_1,tensor_2): # {{{
+    # Each batch maps a dense contractor to the (tag_1,tag_2,result_tag)
+    # triples that it is to be applied to.  If the contractor has batched
+    # versions (see formBatchableDataContractor) then all of the triples with
+    # a result tag of their own are contracted at once, and the triples that
+    # share a result tag are contracted and summed at once (when possible);
+    # otherwise the contractor is applied to each pair of blocks.
+    if not batches:
+        return {}
+    result_slots = {}
+    results = []
+    for contractDenseTensors, triples in batches.items():
+        triples_by_result_tag = defaultdict(list)
+        for triple in triples:
+            triples_by_result_tag[triple[2]].append(triple)
+        for result_tag in triples_by_result_tag:
+            result_slots.setdefault(result_tag,len(result_slots))
+        if not hasattr(contractDenseTensors,"batched"):
+            for tag_1, tag_2, result_tag in triples:
+                results.append((contractDenseTensors(tensor_1[tag_1],tensor_2[tag_2]),result_slots[result_tag]))
+            continue
+        unshared_triples = [result_triples[0] for result_triples in triples_by_result_tag.values() if len(result_triples) == 1]
+        if unshared_triples:
+            tags_1, tags_2, result_tags = zip(*unshared_triples)
+            results.append((
+                contractDenseTensors.batched(selectFromSparse(tensor_1,tags_1),selectFromSparse(tensor_2,tags_2)),
+                [result_slots[result_tag] for result_tag in result_tags]
+            ))
+        for result_tag, shared_triples in triples_by_result_tag.items():
+            if len(shared_triples) == 1:
+                continue
+            if hasattr(contractDenseTensors,"batched_sum"):
+                tags_1, tags_2, _ = zip(*shared_triples)
+                results.append((
+                    contractDenseTensors.batched_sum(selectFromSparse(tensor_1,tags_1),selectFromSparse(tensor_2,tags_2)),
+                    result_slots[result_tag]
+                ))
+            else:
+                for tag_1, tag_2, _ in shared_triples:
+                    results.append((contractDenseTensors(tensor_1[tag_1],tensor_2[tag_2]),result_slots[result_tag]))
+    first_result_data, first_result_slots = results[0]
+    block_shape = tuple(first_result_data.shape[isinstance(first_result_slots,list):])
+    result_stack = type(first_result_data).newZeros(
+        (len(result_slots),)+block_shape,
+        dtype=result_type(*(result_data.dtype for result_data, _ in results))
+    )
+    for result_data, slots in results:
+        result_stack[slots] += result_data
+    return StackedSparseTensor(sorted(result_slots,key=result_slots.get),result_stack)
+# }}}
 def directSumListsOfSparse(list1,list2): # {{{
     return [directSumSparse(sparse1,sparse2) for (sparse1,sparse2) in zip(list1,list2)]
 # }}}
 def directSumSparse(sparse1,sparse2): # {{{
     sparses = (sparse1,sparse2)
+    if all(isinstance(sparse,StackedSparseTensor) for sparse in sparses):
+        # Line up the blocks of both tensors and then sum all of them at once.
+        tags = list(sparse1.keys() | sparse2.keys())
+        stacks = []
+        for sparse in sparses:
+            if all(tag in sparse for tag in tags):
+                stacks.append(sparse.select(tags))
+            else:
+                zeros = sparse[Identity()].newZeros(sparse[Identity()].shape,dtype=sparse.stack.dtype)
+                stacks.append(type(sparse.stack).newCollected([sparse.get(tag,zeros) for tag in tags]))
+        return StackedSparseTensor(tags,stacks[0].directSumWith(stacks[1],0))
     zeroses = tuple(sparse[Identity()].newZeros(sparse[Identity()].shape,dtype=sparse[Identity()].dtype) for sparse in sparses)
     result = {}
     for tag in sparse1.keys() | sparse2.keys():
@@ -262,6 +418,20 @@ def getInformationFromOperatorCenter(operator_center): # {{{
     else:
         raise ValueError("operator tensor has no term from which to extract the physical dimension")
 # }}}
+def groupSparseTensorByTagTypeAndId(tensor): # {{{
+    groups = defaultdict(lambda: defaultdict(list))
+    for tag, data in tensor.items():
+        groups[type(tag)][getattr(tag,"id",None)].append((tag,data))
+    return groups
+# }}}
+def inferDtypeOfOperatorCenter(operator_center): # {{{
+    # Real operators (such as the Ising and XXZ models) are often stored with
+    # a complex type, so this looks at the values rather than the types.
+    if all(data is None or data.isReal() for data in operator_center.values()):
+        return float64
+    else:
+        return complex128
+# }}}
 def makeMPO(I,Os=[],OOs=[]): # {{{
     size = 2 + len(OOs)
     last = size - 1
@@ -338,8 +508,16 @@ def makeSparseOperator(Os=[],OO_UDs=[],OO_LRs=[]): # {{{
     return operator
 # }}}
 def mapOverSparseData(f,sparse): # {{{
+    if isinstance(sparse,StackedSparseTensor):
+        return StackedSparseTensor(sparse.tags,type(sparse.stack).newCollected([f(data) for data in sparse.values()]))
     return {tag: f(data) for tag, data in sparse.items()}
 # }}}
+def selectFromSparse(sparse,tags): # {{{
+    if isinstance(sparse,StackedSparseTensor):
+        return sparse.select(tags)
+    else:
+        return type(sparse[tags[0]]).newCollected([sparse[tag] for tag in tags])
+# }}}
 def stripAllButIdentityFrom(sparse): # {{{
     return {Identity():sparse[Identity()]}
 # }}}
@@ -353,15 +531,21 @@ __all__ = [
     "TwoSiteOperator",
     "TwoSiteOperatorCompressed",
 
+    "StackedSparseTensor",
+
     "addStandardCompleteAndIdentityTerms",
     "contractSparseTensors",
+    "contractSparseTensorsInBatches",
     "directSumListsOfSparse",
     "directSumSparse",
     "formSparseContractor",
     "getInformationFromOperatorCenter",
+    "groupSparseTensorByTagTypeAndId",
+    "inferDtypeOfOperatorCenter",
     "makeMPO",
     "makeSimpleSparseOperator",
     "mapOverSparseData",
+    "selectFromSparse",
     "stripAllButIdentityFrom",
 ]
 # }}}
@@ -5,12 +5,21 @@ from scipy.linalg import eigh, svd
 
 from .base import *
 from ..tensors._1d import *
-from ..utils import buildProductTensor, computeCompressorForMatrixTimesItsDagger, computeAbsoluteLimitingLinearCoefficient, computeNewDimension, crand, dropAt, relaxOver, normalize, normalizeAndDenormalize
+from ..utils import buildProductTensor, changePrecisionOf, computeCompressorForMatrixTimesItsDagger, computeAbsoluteLimitingLinearCoefficient, computeNewDimension, crand, dropAt, normalize, normalizeAndDenormalize
 # }}}
 
 # Classes {{{
 class System(BaseSystem): # {{{
   # Class methods {{{
+    @classmethod # newFromCheckpointPieces {{{
+    def newFromCheckpointPieces(cls,pieces):
+        system = cls.__new__(cls)
+        BaseSystem.__init__(system)
+        for name in ["right_operator_boundary","left_operator_boundary","right_environment","left_environment","operator_center_data","eigensolver_subspace"]:
+            setattr(system,name,pieces[name])
+        system.setStateCenter(pieces["state_center_data"])
+        return system
+    # }}}
     @classmethod # newRandom {{{
     def newRandom(cls,operator_dimension,state_dimension,physical_dimension):
         return cls(
@@ -51,13 +60,53 @@ class System(BaseSystem): # {{{
     def computeExpectation(self): # {{{
         return self.computeScalarUsingMultiplier(self.formExpectationMultiplier()).real
     # }}}
+    def computeExpectations(self,Os=[],OOs=[]): # {{{
+        # The expectations are taken from reduced density matrices, which are
+        # formed once from the channels of the environments that hold just
+        # the normalization (selected by the operator boundaries).  Each pair
+        # in OOs is (left,right), as in makeMPO;  its right operator acts on
+        # the site that contractTowards(0) would absorb into the right
+        # environment.  The identity is evaluated together with the operators
+        # in order to obtain the normalization.
+        left_environment = self.left_operator_boundary.contractWith(self.left_environment,(0,),(0,))
+        right_environment = self.right_operator_boundary.contractWith(self.right_environment,(0,),(0,))
+        physical_dimension = self.state_center_data.shape[2]
+        expectations = []
+        if Os:
+            density_matrix = \
+                self.state_center_data_conj.contractWith(
+                    right_environment.contractWith(self.state_center_data,(0,),(0,)).contractWith(left_environment,(1,),(0,)),
+                    (0,1),
+                    (0,2)
+                )
+            values = NDArrayData(array(list(Os)+[identity(physical_dimension)])).contractWith(density_matrix,(1,2),(0,1)).toArray()
+            expectations.extend(values[:-1]/values[-1])
+        if OOs:
+            tensor_to_contract, _, matrix_to_absorb = self.normalizeStateCenterAxis(1)
+            state_center_data = self.normalizeStateCenterAxis(0)[0].absorbMatrixAt(0,matrix_to_absorb)
+            density_matrix = \
+                state_center_data.conj().contractWith(
+                    right_environment
+                        .contractWith(tensor_to_contract,(0,),(0,))
+                        .contractWith(tensor_to_contract.conj(),(0,),(0,))
+                        .contractWith(state_center_data,(0,),(0,))
+                        .contractWith(left_environment,(3,),(0,)),
+                    (0,1),
+                    (1,4)
+                )
+            products = [multiply.outer(O_L,O_R) for (O_L,O_R) in OOs]
+            products.append(multiply.outer(identity(physical_dimension),identity(physical_dimension)))
+            values = NDArrayData(array(products)).contractWith(density_matrix,(1,2,3,4),(0,3,2,1)).toArray()
+            expectations.extend(values[:-1]/values[-1])
+        return expectations
+    # }}}
     def computeOneSiteExpectation(self): # {{{
         assert self.left_environment.size() >= 2
         assert self.left_operator_boundary.size() >= 2
         right_O_environment_shape = self.right_environment.shape
         right_N_environment_shape = (self.state_center_data.shape[0],)*2
         right_N_environment_size = prod(right_N_environment_shape)
-        normalized_state_center_data = self.state_center_data.normalizeAxis(1)[0]
+        normalized_state_center_data = self.normalizeStateCenterAxis(1)[0]
         normalized_state_center_data_conj = normalized_state_center_data.conj()
         return \
             computeAbsoluteLimitingLinearCoefficient(
@@ -87,13 +136,6 @@ class System(BaseSystem): # {{{
                     ).join(0,(1,2)).toArray(),
             )
     # }}}
-    def computeEstimatedOneSiteExpectation(self,direction=0): # {{{
-        system = copy(self)
-        exp1 = system.computeExpectation()
-        system.contractTowards(direction)
-        exp2 = system.computeExpectation()
-        return exp2-exp1
-    # }}}
     def computeScalarUsingMultiplier(self,multiply): # {{{
         return self.state_center_data_conj.ravel().contractWith(multiply(self.state_center_data).ravel(),(0,),(0,)).extractScalar()
     # }}}
@@ -128,9 +170,11 @@ class System(BaseSystem): # {{{
             )
     # }}}
     def contractTowards(self,direction): # {{{
-        tensor_to_contract, _, matrix_to_absorb = self.state_center_data.normalizeAxis(1-direction)
+        tensor_to_contract, _, matrix_to_absorb = self.normalizeStateCenterAxis(1-direction)
         self.contractUnnormalizedTowards(direction,tensor_to_contract)
-        self.setStateCenter(self.state_center_data.normalizeAxis(direction)[0].absorbMatrixAt(direction,matrix_to_absorb))
+        normalized_state_center_data, normalizer, _ = self.normalizeStateCenterAxis(direction)
+        self.setStateCenter(normalized_state_center_data.absorbMatrixAt(direction,matrix_to_absorb))
+        self._transformEigensolverSubspace(direction,matrix_to_absorb.contractWith(normalizer,(1,),(0,)))
     # }}}
     def contractNormalizedTowards(self,direction,state_center_data=None): # {{{
         if state_center_data is None:
@@ -152,6 +196,12 @@ class System(BaseSystem): # {{{
         else:
             raise ValueError("Direction must be 0 for right or 1 for left, not {}.".format(direction))
     # }}}
+    def formCheckpointPieces(self): # {{{
+        return {
+            name: getattr(self,name)
+            for name in ["right_operator_boundary","left_operator_boundary","right_environment","left_environment","operator_center_data","state_center_data","eigensolver_subspace"]
+        }
+    # }}}
     def formExpectationMatrix(self): # {{{
         return self.formExpectationMultiplier().formMatrix()
     # }}}
@@ -169,22 +219,29 @@ class System(BaseSystem): # {{{
         return self._increaseBandwidth(0,by,to,do_as_much_as_possible,enlargeners)
     # }}}
     def minimizeExpectation(self): # {{{
-        self.setStateCenter(relaxOver(
-            initial=self.state_center_data,
-            expectation_multiplier=self.formExpectationMultiplier(),
-            maximum_number_of_multiplications=100
-        ))
+        self._relaxStateCenter(self.formExpectationMultiplier())
     # }}}
     def minimizeExpectationUsingFullEigensolver(self): # {{{
         matrix = self.formExpectationMultiplier().formMatrix().toArray()
         evals, evecs = eigh(matrix)
         self.setStateCenter(NDArrayData(evecs[:,0].reshape(self.state_center_data.shape)))
     # }}}
+    def setPrecision(self,single): # {{{
+        if self.state_center_data.dtype == changePrecisionOf(self.state_center_data.dtype,single):
+            return
+        def cast(data):
+            return data.astype(changePrecisionOf(data.dtype,single))
+        for name in ["right_operator_boundary","left_operator_boundary","right_environment","left_environment","operator_center_data"]:
+            setattr(self,name,cast(getattr(self,name)))
+        self.setStateCenter(cast(self.state_center_data),cast(self.state_center_data_conj))
+        self.eigensolver_subspace = [cast(vector) for vector in self.eigensolver_subspace]
+    # }}}
     def setStateCenter(self,state_center_data,state_center_data_conj=None): # {{{
         self.state_center_data = state_center_data
         if state_center_data_conj is None:
             state_center_data_conj = state_center_data.conj()
         self.state_center_data_conj = state_center_data_conj
+        self._state_center_normalizations = (None,{})
     # }}}
   # }}}
 # }}}
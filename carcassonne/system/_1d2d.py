@@ -198,6 +198,13 @@ class System(BaseSystem): # {{{
 
         self.copy2Dto1D()
     # }}}
+    def normalizeStateCenterAxis(self,axis): # {{{
+        return self._2d.normalizeStateCenterAxis(axis)
+    # }}}
+    def setPrecision(self,single): # {{{
+        self._1d.setPrecision(single)
+        self._2d.setPrecision(single)
+    # }}}
     state_center_data = property(lambda self: self.checkStates("when fetching state"))
 # }}}
 # }}}
@@ -1,6 +1,6 @@
 # Imports {{{
 from copy import copy
-from numpy import array, complex128, dot, prod, sqrt, zeros
+from numpy import array, complex128, complexfloating, dot, issubdtype, prod, result_type, sqrt, zeros
 from numpy.linalg import cond
 from scipy.linalg import eigh
 from random import randint
@@ -9,21 +9,25 @@ from scipy.sparse.linalg import LinearOperator, eigs, eigsh
 from .base import BaseSystem
 from ..compression import computeProductCompressor
 from ..data import NDArrayData
-from ..sparse import Identity, OneSiteOperator, TwoSiteOperator, TwoSiteOperatorCompressed, directSumListsOfSparse, directSumSparse, makeSimpleSparseOperator, makeSparseOperator, mapOverSparseData, stripAllButIdentityFrom
+from ..sparse import Identity, OneSiteOperator, StackedSparseTensor, TwoSiteOperator, TwoSiteOperatorCompressed, directSumListsOfSparse, directSumSparse, inferDtypeOfOperatorCenter, makeSimpleSparseOperator, makeSparseOperator, mapOverSparseData, stripAllButIdentityFrom
 from ..tensors._2d.dense import formNormalizationMultiplier, formNormalizationSubmatrix
-from ..tensors._2d.sparse import absorbSparseSideIntoCornerFromLeft, absorbSparseSideIntoCornerFromRight, absorbSparseCenterSOSIntoSide, formExpectationAndNormalizationMultipliers
-from ..utils import InvariantViolatedError, Multiplier, computeCompressor, computeCompressorForMatrixTimesItsDagger, computeNewDimension, dropAt, relaxOver, L, O, R
+from ..tensors._2d.sparse import absorbSparseSideIntoCornerFromLeft, absorbSparseSideIntoCornerFromRight, absorbSparseCenterSOSIntoSide, formExpectationStage1, formExpectationStage2, formExpectationStage3
+from ..utils import InvariantViolatedError, Multiplier, NormalizationSolver, changePrecisionOf, computeCompressor, computeCompressorForMatrixTimesItsDagger, computeNewDimension, dropAt, L, O, R
 # }}}
 
 # Classes {{{
 class System(BaseSystem): # {{{
+    _checkpointed_attributes = BaseSystem._checkpointed_attributes + (
+        "just_increased_bandwidth",
+        "state_compressors",
+    )
   # Class methods {{{
     @classmethod # newEnlargener {{{
     def newEnlargener(cls,O,bandwidth_dimensions):
         system = cls(
             tuple({Identity():NDArrayData.newTrivial((1,)*6)} for _ in range(4)),
             tuple({Identity():NDArrayData.newTrivial((1,)*6)+(d,)*2} for d in bandwidth_dimensions),
-            NDArrayData.newRandom(*tuple(bandwidth_dimensions)+tuple(O.shape[:1])),
+            NDArrayData.newRandom(*tuple(bandwidth_dimensions)+tuple(O.shape[:1]),dtype=O.dtype),
             {Identity():O.newIdentity(O.shape[0]),OneSiteOperator(None):O}
         )
         system.assertDimensionsAreConsistent()
@@ -32,31 +36,42 @@ class System(BaseSystem): # {{{
             system.contractUnnormalizedTowards(direction)
         return system
     # }}}
+    @classmethod # newFromCheckpointPieces {{{
+    def newFromCheckpointPieces(cls,pieces):
+        system = cls(
+            [pieces["corner{}".format(corner_id)] for corner_id in range(4)],
+            [pieces["side{}".format(side_id)] for side_id in range(4)],
+            pieces["state_center_data"],
+            pieces["operator_center_tensor"],
+        )
+        system.eigensolver_subspace = pieces["eigensolver_subspace"]
+        return system
+    # }}}
     @classmethod # newRandom {{{
-    def newRandom(cls,makeOperator=None,DataClass=NDArrayData,maximum_dimension=2,O=None):
+    def newRandom(cls,makeOperator=None,DataClass=NDArrayData,maximum_dimension=2,O=None,dtype=complex128):
         assert not (makeOperator is not None and O is not None)
         randomDimension = lambda: randint(1,maximum_dimension)
         randomDimensions = lambda n: tuple(randomDimension() for _ in range(n))
         spoke_sizes = randomDimensions(2)*2
         sides_dimensions = [randomDimension() for _ in range(4)]
-        sides_data = tuple(DataClass.newRandom(*((sides_dimensions[i],)*2+(1,))*2+(spoke_sizes[i],)*2) for i in range(4))
+        sides_data = tuple(DataClass.newRandom(*((sides_dimensions[i],)*2+(1,))*2+(spoke_sizes[i],)*2,dtype=dtype) for i in range(4))
         for side_data in sides_data:
             side_data += side_data.join(1,0,2,4,3,5,7,6).conj()
-        corners_data = tuple(DataClass.newRandom(*(sides_data[L(i)].shape[3],)*2+(1,)+(sides_data[i].shape[0],)*2+(1,)) for i in range(4))
+        corners_data = tuple(DataClass.newRandom(*(sides_data[L(i)].shape[3],)*2+(1,)+(sides_data[i].shape[0],)*2+(1,),dtype=dtype) for i in range(4))
         for corner_data in corners_data:
             corner_data += corner_data.join(1,0,2,4,3,5).conj()
         if O is not None:
             physical_dimension = O.shape[0]
         else:
             physical_dimension = max(2,randomDimension())
-        state_center_data = DataClass.newRandom(*spoke_sizes + (physical_dimension,))
+        state_center_data = DataClass.newRandom(*spoke_sizes + (physical_dimension,),dtype=dtype)
         if O is None:
             if makeOperator is None:
-                O = DataClass.newRandom(physical_dimension,physical_dimension)
+                O = DataClass.newRandom(physical_dimension,physical_dimension,dtype=dtype)
                 O += O.join(1,0).conj()
             else:
                 O = makeOperator(physical_dimension)
-        operator_center_tensor = {Identity():DataClass.newIdentity(physical_dimension),OneSiteOperator(None):O}
+        operator_center_tensor = {Identity():DataClass.newIdentity(physical_dimension,dtype=dtype),OneSiteOperator(None):O}
         system = cls(
             tuple({Identity():corner_data} for corner_data in corners_data),
             tuple({Identity():side_data} for side_data in sides_data),
@@ -69,7 +84,14 @@ class System(BaseSystem): # {{{
         return system
     # }}}
     @classmethod # newTrivial {{{
-    def newTrivial(cls,operator_center_tensor,DataClass=NDArrayData):
+    def newTrivial(cls,operator_center_tensor,DataClass=NDArrayData,dtype=None):
+        # Unless a type is given, real arithmetic is used when the operator
+        # is real.
+        if dtype is None:
+            dtype = inferDtypeOfOperatorCenter(operator_center_tensor)
+        elif not issubdtype(dtype,complexfloating) and issubdtype(inferDtypeOfOperatorCenter(operator_center_tensor),complexfloating):
+            raise ValueError("The operator tensor is not real, so real arithmetic (with type {}) cannot be used.".format(dtype))
+        operator_center_tensor = {tag: data if data is None else data.astype(dtype) for tag, data in operator_center_tensor.items()}
         physical_dimension = None
         for data in operator_center_tensor.values():
             if data is not None:
@@ -78,19 +100,19 @@ class System(BaseSystem): # {{{
         if physical_dimension is None:
             raise ValueError("Operator tensor must have at least one non-identity component.")
         return cls(
-            tuple({Identity():DataClass.newTrivial((1,)*6,dtype=complex128)} for _ in range(4)),
-            tuple({Identity():DataClass.newTrivial((1,)*8,dtype=complex128)} for _ in range(4)),
-            DataClass.newFilled((1,1,1,1,physical_dimension),1.0/sqrt(physical_dimension),dtype=complex128),
+            tuple({Identity():DataClass.newTrivial((1,)*6,dtype=dtype)} for _ in range(4)),
+            tuple({Identity():DataClass.newTrivial((1,)*8,dtype=dtype)} for _ in range(4)),
+            DataClass.newFilled((1,1,1,1,physical_dimension),1.0/sqrt(physical_dimension),dtype=dtype),
             operator_center_tensor,
         )
     # }}}
     @classmethod # newTrivialWithSimpleSparseOperator {{{
-    def newTrivialWithSimpleSparseOperator(cls,O=None,OO_UD=None,OO_LR=None):
-        return cls.newTrivial(makeSimpleSparseOperator(O=O,OO_UD=OO_UD,OO_LR=OO_LR))
+    def newTrivialWithSimpleSparseOperator(cls,O=None,OO_UD=None,OO_LR=None,dtype=None):
+        return cls.newTrivial(makeSimpleSparseOperator(O=O,OO_UD=OO_UD,OO_LR=OO_LR),dtype=dtype)
     # }}}
     @classmethod # newTrivialWithSparseOperator {{{
-    def newTrivialWithSparseOperator(cls,Os=[],OO_UDs=[],OO_LRs=[]):
-        return cls.newTrivial(makeSparseOperator(Os=Os,OO_UDs=OO_UDs,OO_LRs=OO_LRs))
+    def newTrivialWithSparseOperator(cls,Os=[],OO_UDs=[],OO_LRs=[],dtype=None):
+        return cls.newTrivial(makeSparseOperator(Os=Os,OO_UDs=OO_UDs,OO_LRs=OO_LRs),dtype=dtype)
     # }}}
   # }}}
   # Instance methods {{{
@@ -105,6 +127,20 @@ class System(BaseSystem): # {{{
         else:
             self.state_center_data_conj = state_center_data_conj
         self.just_increased_bandwidth = False
+        self.normalization_solver = NormalizationSolver()
+        # The stage 1 and stage 2 environments are cached together with the
+        # corners and sides (respectively stage 1 environments) that they
+        # were formed from;  a cached environment is dirty when any of these
+        # is no longer the object currently in the system.
+        self.stage1_cache = [None]*4
+        self.stage2_cache = [None]*2
+        # Likewise the multipliers formed from the stage 2 environments and
+        # the operator center, which lets an expectation computed right after
+        # an optimization reuse the multipliers of the optimization.
+        self.stage3_cache = None
+        # The last state compressor computed for each corner and direction is
+        # kept to warm-start the next one.
+        self.state_compressors = {}
     # }}}
     def __add__(self,other): # {{{
         return System(
@@ -120,7 +156,7 @@ class System(BaseSystem): # {{{
         self.state_center_data.directSumWith(other.state_center_data,4)
     # }}}
     def __copy__(self): # {{{
-        return \
+        system = \
             System(
                 copy(self.corners),
                 copy(self.sides),
@@ -128,6 +164,12 @@ class System(BaseSystem): # {{{
                 copy(self.operator_center_tensor),
                 self.state_center_data_conj,
             )
+        system.eigensolver = self.eigensolver
+        system.eigensolver_subspace = self.eigensolver_subspace
+        system.stage1_cache = copy(self.stage1_cache)
+        system.stage2_cache = copy(self.stage2_cache)
+        system.state_compressors = copy(self.state_compressors)
+        return system
     # }}}
     def assertDimensionsAreConsistent(self): # {{{
         assert self.state_center_data.shape == self.state_center_data_conj.shape
@@ -199,7 +241,8 @@ class System(BaseSystem): # {{{
     def compressCornerStateTowardsLeft(self,corner_id,new_dimension): # {{{
         side_data_joined = self.sides[L(corner_id)][Identity()].join((0,1,2,6,7),3,4,5)
         corner_data_joined = self.corners[corner_id][Identity()].join(0,1,2,(3,4,5))
-        compressor = computeProductCompressor(side_data_joined,corner_data_joined,new_dimension)
+        compressor = computeProductCompressor(side_data_joined,corner_data_joined,new_dimension,initial=self.state_compressors.get((corner_id,0)))
+        self.state_compressors[corner_id,0] = compressor
         self.sides[L(corner_id)] = mapOverSparseData(lambda data: (data
             ).absorbMatrixAt(3,compressor
             ).absorbMatrixAt(4,compressor.conj())
@@ -214,7 +257,8 @@ class System(BaseSystem): # {{{
     def compressCornerStateTowardsRight(self,corner_id,new_dimension): # {{{
         corner_data_joined = self.corners[corner_id][Identity()].join((0,1,2),3,4,5)
         side_data_joined = self.sides[corner_id][Identity()].join(0,1,2,(3,4,5,6,7))
-        compressor = computeProductCompressor(corner_data_joined,side_data_joined,new_dimension)
+        compressor = computeProductCompressor(corner_data_joined,side_data_joined,new_dimension,initial=self.state_compressors.get((corner_id,1)))
+        self.state_compressors[corner_id,1] = compressor
         self.corners[corner_id] = mapOverSparseData(lambda data: (data
             ).absorbMatrixAt(3,compressor
             ).absorbMatrixAt(4,compressor.conj())
@@ -228,138 +272,99 @@ class System(BaseSystem): # {{{
     # }}}
     def compressCornerTwoSiteOperatorTowards(self,corner_id,direction,new_dimension,normalize=False): # {{{
         axis = 3*direction+2
+        side_id = sideFromCorner(corner_id,direction)
+        side_axis = 3*(1-direction)+2
         # Gather the terms {{{
         new_corner = {}
-        sparse_data = []
+        corner_terms = []
         sparse_position_map = {}
-        old_compressed_data = None
-        next_index = 0
+        old_corner_compressed_data = None
         for tag, data in self.corners[corner_id].items():
             if isinstance(tag,TwoSiteOperator) and tag.direction == direction:
                 assert tag.position not in sparse_position_map
-                sparse_position_map[tag.position] = next_index
-                next_index += 1
-                sparse_data.append(data)
+                sparse_position_map[tag.position] = len(corner_terms)
+                corner_terms.append(data)
             elif isinstance(tag,TwoSiteOperatorCompressed) and tag.direction == direction:
-                assert old_compressed_data is None
-                old_compressed_data = data
+                assert old_corner_compressed_data is None
+                old_corner_compressed_data = data
             else:
                 new_corner[tag] = data
-        old_compressed_data_exists = old_compressed_data is not None
-        # }}}
-        # Compute the old dimension {{{
-        old_dimension = len(sparse_data)
-        if old_compressed_data_exists:
-            old_dimension += old_compressed_data.shape[axis]
-        if old_dimension == 0:
+        if not corner_terms and old_corner_compressed_data is None:
             return
-        # }}}
-        # Compute the first submatrix {{{
-        slice1 = slice(0,len(sparse_data))
-        collected_data = array([data.toArray().ravel() for data in sparse_data])
-        matrix1 = dot(collected_data.conj(),collected_data.transpose())
-        # }}}
-        # Compute the second submatrix {{{
-        slice2 = slice(len(sparse_data),old_dimension)
-        if old_compressed_data_exists:
-            data2 = old_compressed_data.fold(axis)
-            data1 = data2.conj()
-            matrix2 = data1.contractWith(data2,(1,),(1,)).toArray()
-            del data1
-            del data2
-        else:
-            matrix2 = zeros((0,0),dtype=complex128)
-        # }}}
-        # Compute the compressors  {{{
-        def multiply(in_v):
-            out_v = 0*in_v
-            out_v[slice1] = dot(matrix1,in_v[slice1])
-            out_v[slice2] = dot(matrix2,in_v[slice2])
-            return out_v
-        def formMatrix():
-            matrix = zeros((old_dimension,old_dimension),dtype=complex128)
-            matrix[slice1,slice1] = matrix1
-            matrix[slice2,slice2] = matrix2
-            return matrix
-        corner_multiplier, side_multiplier_conj = \
-            computeCompressor(
-                old_dimension,
-                new_dimension,
-                Multiplier(
-                    (old_dimension,)*2,
-                    multiply,
-                    matrix1.shape[0]*matrix1.shape[1]+matrix2.shape[0]*matrix2.shape[1],
-                    formMatrix,
-                    0,
-                ),
-                complex128,
-                normalize
-            )
-        corner_multiplier = NDArrayData(corner_multiplier)
-        side_multiplier = NDArrayData(side_multiplier_conj.conj())
-        del matrix1
-        del matrix2
-        del multiply
-        del formMatrix
-        # }}}
-        # Compute the new corner {{{
-        collected_data_shape = list(self.corners[corner_id][Identity()].shape)
-        del collected_data_shape[axis]
-        collected_data_shape.insert(0,old_dimension)
-        collected_data_transposition = list(range(1,6))
-        collected_data_transposition.insert(axis,0)
-        compressed_collected_data = \
-            NDArrayData(collected_data.reshape(collected_data_shape)).absorbMatrixAt(0,corner_multiplier[:,slice1]).transpose(collected_data_transposition)
-
-        if old_compressed_data_exists:
-            new_compressed_data = old_compressed_data.absorbMatrixAt(axis,corner_multiplier[:,slice2])
-            new_compressed_data += compressed_collected_data
-        else:
-            new_compressed_data = compressed_collected_data
-
-        new_corner[TwoSiteOperatorCompressed(direction)] = new_compressed_data
-        self.corners[corner_id] = new_corner
-        del collected_data
-        # }}}
-        # Compute the new side {{{
-        side_id = sideFromCorner(corner_id,direction)
-        direction = 1-direction
-        axis = 3*direction+2
-        collected_data = [None]*len(sparse_data)
-        old_compressed_data = None
         new_side = {}
+        side_terms = [None]*len(corner_terms)
+        old_side_compressed_data = None
         for tag, data in self.sides[side_id].items():
-            if isinstance(tag,TwoSiteOperator) and tag.direction == direction:
-                collected_data[sparse_position_map[tag.position]] = data
-            elif isinstance(tag,TwoSiteOperatorCompressed) and tag.direction == direction:
-                assert old_compressed_data_exists
-                assert old_compressed_data is None
-                old_compressed_data = data
+            if isinstance(tag,TwoSiteOperator) and tag.direction == 1-direction:
+                side_terms[sparse_position_map[tag.position]] = data
+            elif isinstance(tag,TwoSiteOperatorCompressed) and tag.direction == 1-direction:
+                assert old_corner_compressed_data is not None
+                assert old_side_compressed_data is None
+                old_side_compressed_data = data
             else:
                 new_side[tag] = data
-        assert None not in collected_data
-        if old_compressed_data_exists:
-            assert old_compressed_data is not None
-        if collected_data:
-            collected_data = collected_data[0].newCollected(collected_data).dropUnitAxis(axis+1)
-        else:
-            assert old_compressed_data_exists
-            collected_data_shape = list(self.sides[side_id][Identity()].shape)
-            del collected_data_shape[axis]
-            collected_data_shape.insert(0,0)
-            collected_data = old_compressed_data.newZeros(collected_data_shape,dtype=complex128)
-        collected_data_transposition = list(range(1,8))
-        collected_data_transposition.insert(axis,0)
-        compressed_collected_data = \
-            collected_data.absorbMatrixAt(0,side_multiplier[:,slice1]).transpose(collected_data_transposition)
-        if old_compressed_data_exists:
-            new_compressed_data = old_compressed_data.absorbMatrixAt(axis,side_multiplier[:,slice2])
-            new_compressed_data += compressed_collected_data
+        assert None not in side_terms
+        assert (old_corner_compressed_data is None) == (old_side_compressed_data is None)
+        # }}}
+        dtype = result_type(*[data.dtype for data in corner_terms] + ([old_corner_compressed_data.dtype] if old_corner_compressed_data is not None else []))
+        other_axes = dropAt(range(6),axis)
+        # The compressed block is updated with one pushed-out term at a time,
+        # so neither the stacked terms nor their overlaps are ever formed.  The
+        # columns of the block are orthogonal after each update, so its overlap
+        # matrix is carried along in the basis of the compressor rather than
+        # being formed again;  for each term only its overlaps with the at
+        # most new_dimension columns of the block are computed.
+        corner_data = old_corner_compressed_data
+        side_data = old_side_compressed_data
+        if corner_data is None:
+            overlap = zeros((0,0),dtype=dtype)
         else:
-            new_compressed_data = compressed_collected_data
-        new_side[TwoSiteOperatorCompressed(direction)] = new_compressed_data
+            overlap = corner_data.conj().contractWith(corner_data,other_axes,other_axes).toArray()
+        def compress(overlap,new_dimension,normalize,corner_terms,side_terms):
+            # The columns of the overlap are ordered as the new terms followed
+            # by the columns of the block, as in accumulateCompressedTerms.
+            old_dimension = overlap.shape[0]
+            multiply = lambda v: dot(overlap,v)
+            compressor, inverse_compressor_conj = \
+                computeCompressor(
+                    old_dimension,
+                    min(new_dimension,old_dimension),
+                    Multiplier(
+                        (old_dimension,)*2,
+                        multiply,
+                        old_dimension**2,
+                        lambda: overlap,
+                        0,
+                        multiplyColumns=multiply,
+                    ),
+                    dtype,
+                    normalize
+                )
+            return (
+                accumulateCompressedTerms(corner_data,corner_terms,NDArrayData(compressor),axis),
+                accumulateCompressedTerms(side_data,side_terms,NDArrayData(inverse_compressor_conj.conj()),side_axis),
+                dot(compressor.conj(),dot(overlap,compressor.transpose())),
+            )
+        for corner_term, side_term in zip(corner_terms,side_terms):
+            dimension = overlap.shape[0]
+            term_overlap = zeros((dimension+1,)*2,dtype=dtype)
+            term_overlap[0,0] = corner_term.norm()**2
+            if corner_data is not None:
+                cross_overlap = corner_data.conj().contractWith(corner_term,other_axes,other_axes).toArray().ravel()
+                term_overlap[1:,0] = cross_overlap
+                term_overlap[0,1:] = cross_overlap.conj()
+                term_overlap[1:,1:] = overlap
+            if abs(term_overlap.trace()) < 1e-15:
+                # Nothing is left to compress;  the term is zero.
+                continue
+            corner_data, side_data, overlap = compress(term_overlap,new_dimension,False,[corner_term],[side_term])
+        if corner_data is not None and normalize:
+            corner_data, side_data, overlap = compress(overlap,new_dimension,normalize,[],[])
+        if corner_data is not None:
+            new_corner[TwoSiteOperatorCompressed(direction)] = corner_data
+            new_side[TwoSiteOperatorCompressed(1-direction)] = side_data
+        self.corners[corner_id] = new_corner
         self.sides[side_id] = new_side
-        # }}}
     # }}}
     def computeCenterSiteExpectation(self): # {{{
         return self.computeExpectation()-self.computeExpectationWithoutCenter()
@@ -367,6 +372,51 @@ class System(BaseSystem): # {{{
     def computeExpectation(self,operator_center_tensor=None): # {{{
         return self.computeExpectationAndNormalization(operator_center_tensor)[0]
     # }}}
+    def computeExpectations(self,Os=[],OO_UDs=[],OO_LRs=[]): # {{{
+        # The operators are given as for makeSparseOperator, and the
+        # expectations are returned in the same order.  They are evaluated
+        # against the environment stripped of all but the normalization:  the
+        # one-site operators all at once using the reduced density matrix of
+        # the center, and the pairs after contracting the center once in the
+        # direction of their bond, which leaves only the final stage to be
+        # formed for each pair.
+        stripped_self = self.stripExpectationEnvironment()
+        expectations = []
+        if Os:
+            density_matrix = \
+                stripped_self.state_center_data_conj.contractWith(
+                    stripped_self.formNormalizationMultiplier()(stripped_self.state_center_data),
+                    range(4),
+                    range(4)
+                )
+            values = \
+                type(Os[0]).newCollected(list(Os)+[Os[0].newIdentity(Os[0].shape[0])]) \
+                .contractWith(density_matrix,(1,2),(0,1)) \
+                .toArray()
+            expectations.extend(values[:-1]/values[-1])
+        for direction, OOs in ((1,OO_UDs),(0,OO_LRs)):
+            if not OOs:
+                continue
+            system = copy(stripped_self)
+            system.operator_center_tensor.update(
+                (tag, value)
+                for tag, value in makeSparseOperator(**{"OO_UDs" if direction == 1 else "OO_LRs": OOs}).items()
+                if tag is not Identity()
+            )
+            system.contractTowards(direction)
+            normalization = None
+            for id in range(len(OOs)):
+                multiplyExpectation, multiplyNormalization = \
+                    system.formExpectationAndNormalizationMultipliers({
+                        tag: system.operator_center_tensor[tag]
+                        for tag in (TwoSiteOperator(id,direction,0),TwoSiteOperator(id,direction+2,0))
+                    })
+                if normalization is None:
+                    normalization = system.computeScalarUsingMultiplier(multiplyNormalization)
+                expectations.append(system.computeScalarUsingMultiplier(multiplyExpectation)/normalization)
+            del system
+        return expectations
+    # }}}
     def computeExpectationWithoutCenter(self): # {{{
         return self.computeExpectationAndNormalizationWithoutCenter()[0]
     # }}}
@@ -394,35 +444,32 @@ class System(BaseSystem): # {{{
         return cond(self.formNormalizationMatrix().toArray())
     # }}}
     def computeOneSiteExpectation(self): # {{{
-        expectation = 0
+        # The terms are evaluated against the environment stripped of all but
+        # the normalization, which is formed once:  all of the one-site terms
+        # together at the center, and then the bond terms of each direction
+        # together after contracting the center just once in that direction.
         stripped_self = self.stripExpectationEnvironment()
-
+        one_site_operator_center_tensor = copy(stripped_self.operator_center_tensor)
+        bond_operator_center_tensors = ({},{})
         for tag, value in self.operator_center_tensor.items():
             if isinstance(tag,OneSiteOperator):
-                system = copy(stripped_self)
-                system.operator_center_tensor[tag] = value
-                expectation += system.computeExpectation()
-                del system
+                one_site_operator_center_tensor[tag] = value
+            elif isinstance(tag,TwoSiteOperator) and tag.position == 0 and tag.direction in (0,1):
+                other_tag = tag.withNewDirectionAndPosition(tag.direction+2,0)
+                bond_operator_center_tensors[tag.direction][tag] = value
+                bond_operator_center_tensors[tag.direction][other_tag] = self.operator_center_tensor[other_tag]
 
-            if isinstance(tag,TwoSiteOperator):
-                if tag.position != 0:
-                    continue
-                if tag.direction == 0:
-                    other_tag = tag.withNewDirectionAndPosition(2,0)
-                    system = copy(stripped_self)
-                    system.operator_center_tensor[tag] = value
-                    system.operator_center_tensor[other_tag] = self.operator_center_tensor[other_tag]
-                    system.contractTowards(0)
-                    expectation += system.computeExpectation()
-                    del system
-                if tag.direction == 1:
-                    other_tag = tag.withNewDirectionAndPosition(3,0)
-                    system = copy(stripped_self)
-                    system.operator_center_tensor[tag] = value
-                    system.operator_center_tensor[other_tag] = self.operator_center_tensor[other_tag]
-                    system.contractTowards(1)
-                    expectation += system.computeExpectation()
-                    del system
+        expectation = 0
+        if len(one_site_operator_center_tensor) > len(stripped_self.operator_center_tensor):
+            expectation += stripped_self.computeExpectation(one_site_operator_center_tensor)
+        for direction, bond_operator_center_tensor in enumerate(bond_operator_center_tensors):
+            if not bond_operator_center_tensor:
+                continue
+            system = copy(stripped_self)
+            system.operator_center_tensor.update(bond_operator_center_tensor)
+            system.contractTowards(direction)
+            expectation += system.computeExpectation()
+            del system
 
         return expectation
     # }}}
@@ -433,9 +480,11 @@ class System(BaseSystem): # {{{
         return self.computeScalarUsingMultiplier(self.formExpectationMultipliers())
     # }}}
     def contractTowards(self,direction): # {{{
-        tensor_to_contract, _, matrix_to_absorb = self.state_center_data.normalizeAxis(O(direction))
+        tensor_to_contract, _, matrix_to_absorb = self.normalizeStateCenterAxis(O(direction))
         self.contractUnnormalizedTowards(direction,tensor_to_contract)
-        self.setStateCenter(self.state_center_data.normalizeAxis(direction)[0].absorbMatrixAt(direction,matrix_to_absorb))
+        normalized_state_center_data, normalizer, _ = self.normalizeStateCenterAxis(direction)
+        self.setStateCenter(normalized_state_center_data.absorbMatrixAt(direction,matrix_to_absorb))
+        self._transformEigensolverSubspace(direction,matrix_to_absorb.contractWith(normalizer,(1,),(0,)))
     # }}}
     def contractNormalizedTowards(self,direction,state_center_data): # {{{
         self.contractUnnormalizedTowards(direction,state_center_data.normalizeAxis(O(direction))[0])
@@ -453,9 +502,45 @@ class System(BaseSystem): # {{{
             raise InvariantViolatedError("Contracting the current center would blow up the condition number of the normalization matrix;  optimize it or replace it first.")
     # }}}
     def formExpectationAndNormalizationMultipliers(self,operator_center_tensor=None): # {{{
-        if operator_center_tensor is None:
-            operator_center_tensor = self.operator_center_tensor
-        return formExpectationAndNormalizationMultipliers(self.corners,self.sides,operator_center_tensor)
+        stage2_0 = self.formExpectationStage2(0)
+        stage2_1 = self.formExpectationStage2(1)
+        if operator_center_tensor is not None:
+            return formExpectationStage3(stage2_0,stage2_1,operator_center_tensor)
+        # The operator center is a dictionary that may be changed in place, so
+        # the cache is keyed on its entries rather than on the dictionary;
+        # the data are held by the key and compared by identity.
+        operator_center_items = tuple(self.operator_center_tensor.items())
+        cached = self.stage3_cache
+        if cached is None or cached[0] is not stage2_0 or cached[1] is not stage2_1 or not sameItems(cached[2],operator_center_items):
+            cached = self.stage3_cache = (stage2_0,stage2_1,operator_center_items,formExpectationStage3(stage2_0,stage2_1,self.operator_center_tensor))
+        return cached[3]
+    # }}}
+    def formExpectationStage1(self,corner_id): # {{{
+        corner = self.corners[corner_id]
+        side = self.sides[corner_id]
+        cached = self.stage1_cache[corner_id]
+        if cached is None or cached[0] is not corner or cached[1] is not side:
+            cached = self.stage1_cache[corner_id] = (corner,side,formExpectationStage1(corner,side))
+        return cached[2]
+    # }}}
+    def formExpectationStage2(self,half): # {{{
+        right = self.formExpectationStage1(2*half)
+        left = self.formExpectationStage1(2*half+1)
+        cached = self.stage2_cache[half]
+        if cached is None or cached[0] is not right or cached[1] is not left:
+            cached = self.stage2_cache[half] = (right,left,formExpectationStage2(right,left))
+        return cached[2]
+    # }}}
+    def formCheckpointPieces(self): # {{{
+        pieces = {
+            "eigensolver_subspace": self.eigensolver_subspace,
+            "operator_center_tensor": self.operator_center_tensor,
+            "state_center_data": self.state_center_data,
+        }
+        for i in range(4):
+            pieces["corner{}".format(i)] = self.corners[i]
+            pieces["side{}".format(i)] = self.sides[i]
+        return pieces
     # }}}
     def formExpectationMatrix(self): # {{{
         return self.formExpectationMultiplier().formMatrix()
@@ -487,13 +572,11 @@ class System(BaseSystem): # {{{
         self.normalize()
     # }}}
     def minimizeExpectation(self): # {{{
-        self.setStateCenter(
-            relaxOver(
-                self.state_center_data,
-                *self.formExpectationAndNormalizationMultipliers(),
-                maximum_number_of_multiplications=100
-            )
-        )
+        # Every change to a corner or side replaces it, so the normalization
+        # solver can tell whether its factorization is still valid by
+        # checking whether it was given the same objects as before.
+        self.normalization_solver.dependOn(self.corners + self.sides)
+        self._relaxStateCenter(*self.formExpectationAndNormalizationMultipliers(),normalization_solver=self.normalization_solver)
     # }}}
     def minimizeExpectationUsingFullEigensolver(self): # {{{
         matrix = self.formExpectationMultiplier().formMatrix().toArray()
@@ -511,6 +594,7 @@ class System(BaseSystem): # {{{
         normalizer_for_center, denormalizer_for_side_axis1 = self.state_center_data.normalizeAxis(direction,True)
         self.state_center_data = self.state_center_data.absorbMatrixAt(direction,normalizer_for_center)
         self.state_center_data_conj = self.state_center_data.conj()
+        self._state_center_normalizations = (None,{})
         denormalizer_for_side_axis2 = denormalizer_for_side_axis1.conj()
         self.sides[direction] = {
             tag: side_data.absorbMatrixAt(6,denormalizer_for_side_axis1).absorbMatrixAt(7,denormalizer_for_side_axis2)
@@ -546,6 +630,23 @@ class System(BaseSystem): # {{{
         }
         self.state_center_data = self.state_center_data.absorbMatrixAt(side_id,denormalizer_for_center)
         self.state_center_data_conj = self.state_center_data.conj()
+        self._state_center_normalizations = (None,{})
+    # }}}
+    def setPrecision(self,single): # {{{
+        if self.state_center_data.dtype == changePrecisionOf(self.state_center_data.dtype,single):
+            return
+        def cast(data):
+            return None if data is None else data.astype(changePrecisionOf(data.dtype,single))
+        self.corners = [mapOverSparseData(cast,corner) for corner in self.corners]
+        self.sides = [mapOverSparseData(cast,side) for side in self.sides]
+        self.operator_center_tensor = mapOverSparseData(cast,self.operator_center_tensor)
+        # The state is not passed through setStateCenter as that would
+        # forget that the bandwidth has just been increased.
+        self.state_center_data = cast(self.state_center_data)
+        self.state_center_data_conj = cast(self.state_center_data_conj)
+        self._state_center_normalizations = (None,{})
+        self.eigensolver_subspace = [cast(vector) for vector in self.eigensolver_subspace]
+        self.state_compressors = {key: cast(compressor) for key, compressor in self.state_compressors.items()}
     # }}}
     def setStateCenter(self,state_center_data,state_center_data_conj=None): # {{{
         self.state_center_data = state_center_data
@@ -554,6 +655,13 @@ class System(BaseSystem): # {{{
         else:
             self.state_center_data_conj = state_center_data_conj
         self.just_increased_bandwidth = False
+        self._state_center_normalizations = (None,{})
+    # }}}
+    def stackEnvironment(self): # {{{
+        # Store each corner and side in a single stacked tensor so that the
+        # contractions of their blocks are performed in batches.
+        self.corners = [StackedSparseTensor.newFromSparse(corner) for corner in self.corners]
+        self.sides = [StackedSparseTensor.newFromSparse(side) for side in self.sides]
     # }}}
     def stripExpectationEnvironment(self): # {{{
         return \
@@ -570,6 +678,32 @@ class System(BaseSystem): # {{{
 # }}}
 
 # Functions {{{
+def accumulateCompressedTerms(old_compressed_data,terms,multiplier,axis,chunk_size=16): # {{{
+    # The columns of the multiplier are ordered as the terms followed by the
+    # old compressed axis;  each term has unit dimension along the axis.
+    number_of_terms = len(terms)
+    new_dimension = multiplier.shape[0]
+    multiplier = multiplier.toArray()
+    compressed_data = None
+    if number_of_terms > 0:
+        shape = dropAt(terms[0].shape,axis)
+        compressed_terms = zeros((new_dimension,prod(shape,dtype=int)),dtype=result_type(multiplier.dtype,*[term.dtype for term in terms]))
+        for start in range(0,number_of_terms,chunk_size):
+            compressed_terms += dot(multiplier[:,start:start+chunk_size],array([term.toArray().ravel() for term in terms[start:start+chunk_size]]))
+        transposition = list(range(1,len(shape)+1))
+        transposition.insert(axis,0)
+        compressed_data = NDArrayData(compressed_terms.reshape((new_dimension,)+tuple(shape))).transpose(transposition)
+    if old_compressed_data is not None:
+        compressed_old_data = old_compressed_data.absorbMatrixAt(axis,NDArrayData(multiplier[:,number_of_terms:]))
+        if compressed_data is None:
+            compressed_data = compressed_old_data
+        else:
+            compressed_data += compressed_old_data
+    return compressed_data
+# }}}
+def sameItems(items1,items2): # {{{
+    return len(items1) == len(items2) and all(tag1 == tag2 and data1 is data2 for (tag1,data1), (tag2,data2) in zip(items1,items2))
+# }}}
 def sideFromCorner(corner_id,direction): # {{{
     return (corner_id+1-direction)%4
 # }}}
@@ -579,6 +713,7 @@ def sideFromCorner(corner_id,direction): # {{{
 __all__ = [
     "System",
 
+    "accumulateCompressedTerms",
     "sideFromCorner",
 ]
 # }}}
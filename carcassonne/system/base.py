@@ -1,8 +1,11 @@
 # Imports {{{
 from copy import copy
+from numpy import dot, finfo, isfinite
+from numpy.linalg import norm
 
+from ..checkpoint import loadWithSystem, readCheckpoint
 from ..data import NDArrayData
-from ..utils import O, RelaxFailed, computeCompressorForMatrixTimesItsDagger, computeNewDimension, dropAt
+from ..utils import LanczosEigensolver, O, RelaxFailed, computeCompressorForMatrixTimesItsDagger, computeNewDimension, data_contractor_plan_cache, dropAt, relaxOver
 # }}}
 
 # Logging {{{
@@ -11,6 +14,30 @@ log = logging.getLogger(__name__)
 # }}}
 
 class BaseSystem: # {{{
+    # The attributes besides the pieces (see formCheckpointPieces) that are
+    # saved in a checkpoint.
+    _checkpointed_attributes = (
+        "eigensolver",
+        "iteration_number_for_sweep",
+        "number_of_iterations",
+        "number_of_sweeps",
+    )
+  # Class methods {{{
+    @classmethod # resume {{{
+    def resume(cls,path):
+        system_class, pieces, state = readCheckpoint(path)
+        if not issubclass(system_class,cls):
+            raise ValueError("The checkpoint at {} is of a {}, not of a {}.".format(path,system_class.__name__,cls.__name__))
+        system = system_class.newFromCheckpointPieces(pieces)
+        state = loadWithSystem(state,system)
+        for name, value in state["attributes"].items():
+            setattr(system,name,value)
+        system._policies.update(state["policies"])
+        # The run continues the sweep during which the checkpoint was written.
+        system._resuming = "number_of_sweeps" in state["attributes"]
+        return system
+    # }}}
+  # }}}
   # Internal instance methods {{{
     def _applyPolicy(self,policy_name,optional=False): # {{{
         for policy in self._getPolicy(policy_name,optional):
@@ -40,39 +67,149 @@ class BaseSystem: # {{{
         for policy in self._getPolicy(policy_name,optional):
             policy.update()
     # }}}
+    def _continueSweepUntilConverged(self): # {{{
+        sweep_number = self.number_of_sweeps
+        while not self._hasConverged("sweep convergence"):
+            self._applyPolicy("contraction")
+            self._applyPolicy("state compression",optional=True)
+            self._applyPolicy("operator compression",optional=True)
+            self.iteration_number_for_sweep += 1
+            self.number_of_iterations += 1
+            log.info("Iteration #{} of sweep #{}".format(self.iteration_number_for_sweep,sweep_number))
+            try:
+                self._applyPolicy("pre-optimization hook",optional=True)
+                self._applyPolicy("precision",optional=True)
+                self.minimizeExpectation()
+                self._applyPolicy("post-optimization hook",optional=True)
+                self._updatePolicy("sweep convergence")
+            except RelaxFailed:
+                pass
+            self._applyPolicy("checkpoint",optional=True)
+    # }}}
+    def _relaxStateCenter(self,*multipliers,**keywords): # {{{
+        # The Ritz vectors left over from the last optimization are used to
+        # warm-start this one, provided that the center has not changed shape
+        # in the meantime.  In single precision the default tolerance cannot
+        # be reached, so it is loosened to something that can.
+        keywords.setdefault("tolerance",max(1e-7,100*finfo(self.state_center_data.dtype).eps))
+        state_center_data, self.eigensolver_subspace = \
+            relaxOver(
+                self.state_center_data,
+                *multipliers,
+                maximum_number_of_multiplications=100,
+                eigensolver=self.eigensolver,
+                initial_subspace=[vector for vector in self.eigensolver_subspace if vector.shape == self.state_center_data.shape],
+                return_subspace=True,
+                **keywords
+            )
+        self.setStateCenter(state_center_data)
+    # }}}
+    def _transformEigensolverSubspace(self,axis,matrix): # {{{
+        # The matrix includes the inverse singular values of the normalizer,
+        # so the vectors are orthonormalized after the transformation to keep
+        # them from growing without bound from one contraction to the next;
+        # those that have become non-finite or nearly dependent are dropped.
+        subspace = []
+        for vector in self.eigensolver_subspace:
+            if vector.shape[axis] != matrix.shape[1]:
+                continue
+            vector = vector.absorbMatrixAt(axis,matrix)
+            DataClass, shape = type(vector), vector.shape
+            vector = vector.toArray().ravel()
+            if not isfinite(vector).all():
+                continue
+            original_norm = norm(vector)
+            for other in subspace:
+                vector = vector - dot(other.conj(),vector)*other
+            vector_norm = norm(vector)
+            if vector_norm <= 1e-8*original_norm:
+                continue
+            subspace.append(vector/vector_norm)
+        self.eigensolver_subspace = [DataClass(vector.reshape(shape)) for vector in subspace]
+    # }}}
   # }}}
   # Public instance methods {{{
     def __init__(self): # {{{
         self._policies = {name:None for name in [
             "bandwidth increase",
+            "checkpoint",
             "contraction",
             "operator compression",
             "run convergence",
             "post-contraction hook",
             "pre-optimization hook",
             "post-optimization hook",
+            "precision",
             "state compression",
             "sweep convergence",
         ]}
+        self.eigensolver = LanczosEigensolver()
+        self.eigensolver_subspace = []
+        self._state_center_normalizations = (None,{})
+        self._resuming = False
     # }}}
     def computeEstimatedOneSiteExpectation(self,direction=0): # {{{
+        # The expectation before the contraction is computed by this system
+        # rather than by the copy, so that the environments that it caches
+        # (usually already formed by the last optimization) are used and
+        # kept;  the copy starts from the same caches, so only what the
+        # contraction touches is formed again for the second expectation.
+        exp1 = self.computeExpectation()
         system = copy(self)
-        exp1 = system.computeExpectation()
         system.contractTowards(direction)
         exp2 = system.computeExpectation()
         return exp2-exp1
     # }}}
+    def formCheckpointState(self): # {{{
+        # Everything but the pieces, which are kept separately so that they
+        # only need to be written when they have changed.  Hooks and the
+        # checkpoint policy itself refer to things outside of the system, so
+        # they are not saved and have to be set again after resuming.
+        return {
+            "attributes": {
+                name: getattr(self,name)
+                for name in self._checkpointed_attributes
+                if hasattr(self,name)
+            },
+            "policies": {
+                name: policy
+                for name, policy in self._policies.items()
+                if policy is not None and policy.checkpointed
+            },
+        }
+    # }}}
+    def normalizeStateCenterAxis(self,axis): # {{{
+        # The factorizations of the center are kept until the center is
+        # replaced, so that a convergence check made after an optimization
+        # and the contraction that follows it share them.  Replacing the
+        # center through setStateCenter drops them at once so that they do
+        # not hold on to memory;  the identity check catches a center that
+        # was replaced in some other way.
+        state_center_data, normalizations = self._state_center_normalizations
+        if state_center_data is not self.state_center_data:
+            normalizations = {}
+            self._state_center_normalizations = (self.state_center_data,normalizations)
+        if axis not in normalizations:
+            normalizations[axis] = self.state_center_data.normalizeAxis(axis)
+        return normalizations[axis]
+    # }}}
     def runUntilConverged(self): # {{{
-        log.info("Beginning run.")
-        self.number_of_sweeps = 0
-        self.number_of_iterations = 0
-        self.sweepUntilConverged()
+        if self._resuming:
+            self._resuming = False
+            log.info("Resuming run at iteration #{} of sweep #{}.".format(self.iteration_number_for_sweep,self.number_of_sweeps))
+            self._continueSweepUntilConverged()
+        else:
+            log.info("Beginning run.")
+            self.number_of_sweeps = 0
+            self.number_of_iterations = 0
+            self.sweepUntilConverged()
         self._updatePolicy("run convergence")
         while not self._hasConverged("run convergence"):
             self._applyPolicy("bandwidth increase")
             self.sweepUntilConverged()
             self._updatePolicy("run convergence")
         log.info("Finished run with {} total sweeps and {} total iterations.".format(self.number_of_sweeps,self.number_of_iterations))
+        log.debug("Contraction plans: {} cache hits and {} cache misses.".format(data_contractor_plan_cache.hits,data_contractor_plan_cache.misses))
     # }}}
     def setPolicy(self,policy_name,policy): # {{{
         policies = self._policies
@@ -91,23 +228,12 @@ class BaseSystem: # {{{
         self.iteration_number_for_sweep = 1
         log.info("Iteration #{} of sweep #{}".format(self.iteration_number_for_sweep,sweep_number))
         self._applyPolicy("pre-optimization hook",optional=True)
+        self._applyPolicy("precision",optional=True)
         self.minimizeExpectation()
         self._applyPolicy("post-optimization hook",optional=True)
         self._updatePolicy("sweep convergence")
-        while not self._hasConverged("sweep convergence"):
-            self._applyPolicy("contraction")
-            self._applyPolicy("state compression",optional=True)
-            self._applyPolicy("operator compression",optional=True)
-            self.iteration_number_for_sweep += 1
-            self.number_of_iterations += 1
-            log.info("Iteration #{} of sweep #{}".format(self.iteration_number_for_sweep,sweep_number))
-            try:
-                self._applyPolicy("pre-optimization hook",optional=True)
-                self.minimizeExpectation()
-                self._applyPolicy("post-optimization hook",optional=True)
-                self._updatePolicy("sweep convergence")
-            except RelaxFailed:
-                pass
+        self._applyPolicy("checkpoint",optional=True)
+        self._continueSweepUntilConverged()
     # }}}
   # }}}
   # Protected instance methods {{{
@@ -136,11 +262,11 @@ class BaseSystem: # {{{
             else:
                 raise ValueError("New dimension must be less than the physical dimension times the old dimension ({} > {}*{}).".format(new_dimension,physical_dimension,old_dimension))
 
-        neighbor_0 = state_center_data.normalizeAxis(O_axis)[0]
-        neighbor_1 = state_center_data.normalizeAxis(axis)[0]
+        neighbor_0 = self.normalizeStateCenterAxis(O_axis)[0]
+        neighbor_1 = self.normalizeStateCenterAxis(axis)[0]
 
         if enlargeners is None:
-            enlargener_A, enlargener_B = state_center_data.newEnlargener(old_dimension,new_dimension)
+            enlargener_A, enlargener_B = state_center_data.newEnlargener(old_dimension,new_dimension,state_center_data.dtype)
         else:
             enlargener_A, enlargener_B = enlargeners
         state_center_data = state_center_data.absorbMatrixAt(axis,enlargener_A)
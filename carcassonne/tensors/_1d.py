@@ -4,12 +4,12 @@ from numpy import prod
 
 from ..data import NDArrayData
 from ..data.cost_tracker import computeCostOfContracting
-from ..utils import Join, Multiplier, formDataContractor, prependDataContractor
+from ..utils import Join, Multiplier, PlannedDataContractor, prependPlannedDataContractor
 # }}}
 
 # Functions {{{
 # def absorbCenterOSSIntoLeftEnvironment(L,O,S,S*) {{{
-absorbCenterOSSIntoLeftEnvironment = formDataContractor(
+absorbCenterOSSIntoLeftEnvironment = PlannedDataContractor(
     [
         Join(0,0,1,1),
         Join(0,1,2,1),
@@ -23,7 +23,7 @@ absorbCenterOSSIntoLeftEnvironment = formDataContractor(
     ]
 ) # }}}
 # def absorbCenterOSSIntoRightEnvironment(R,O,S,S*) {{{
-absorbCenterOSSIntoRightEnvironment = formDataContractor(
+absorbCenterOSSIntoRightEnvironment = PlannedDataContractor(
     [
         Join(0,0,1,0),
         Join(0,1,2,0),
@@ -37,7 +37,7 @@ absorbCenterOSSIntoRightEnvironment = formDataContractor(
     ]
 ) # }}}
 # def absorbCenterSSIntoLeftEnvironment(L,S,S*) {{{
-absorbCenterSSIntoLeftEnvironment = formDataContractor(
+absorbCenterSSIntoLeftEnvironment = PlannedDataContractor(
     [
         Join(0,0,1,1),
         Join(0,1,2,1),
@@ -48,7 +48,7 @@ absorbCenterSSIntoLeftEnvironment = formDataContractor(
     ]
 ) # }}}
 # def absorbCenterSSIntoRightEnvironment(R,S,S*) {{{
-absorbCenterSSIntoRightEnvironment = formDataContractor(
+absorbCenterSSIntoRightEnvironment = PlannedDataContractor(
     [
         Join(0,0,1,0),
         Join(0,1,2,0),
@@ -59,7 +59,7 @@ absorbCenterSSIntoRightEnvironment = formDataContractor(
     ]
 ) # }}}
 # def formExpectationMultiplier(R,L,O,S) {{{
-@prependDataContractor(
+@prependPlannedDataContractor(
     [
         Join(0,0,2,0),
         Join(1,0,2,1),
@@ -68,7 +68,7 @@ absorbCenterSSIntoRightEnvironment = formDataContractor(
         [(0,1),(1,1),(2,3)],
     ]
 )
-@prependDataContractor(
+@prependPlannedDataContractor(
     [
         Join(0,0,2,0),
         Join(0,1,3,0),
@@ -90,6 +90,11 @@ def formExpectationMultiplier(multiply,formMatrix,R,L,O):
             computeCostOfContracting(multiply,R,L,O,S_shape),
             partial(formMatrix,R,L,O),
             computeCostOfContracting(formMatrix,R,L,O),
+            partial(formExpectationDiagonal,R,L,O),
+            computeCostOfContracting(formExpectationDiagonal,R,L,O),
         )
 # }}}
+def formExpectationDiagonal(R,L,O): # {{{
+    return R.contractNetworkWith([L,O],"aii,bjj,abkk->ijk",["einsum_path",(0,2),(0,1)])
+# }}}
 # }}}
@@ -3,41 +3,43 @@ from functools import partial
 from numpy import prod
 
 from ...data.cost_tracker import CostTracker, computeCostOfContracting
-from ...utils import Join, Multiplier, formDataContractor, prepend, prependDataContractor, L, R, O
+from ...utils import Join, Multiplier, PlannedDataContractor, formBatchableDataContractor, formDataContractor, prepend, prependDataContractor, prependPlannedDataContractor, L, R, O
 # }}}
 
 # Functions {{{
 # def absorbDenseSideIntoCornerFromLeft(corner,side) # {{{
-absorbDenseSideIntoCornerFromLeft = formDataContractor(
+absorbDenseSideIntoCornerFromLeft = formBatchableDataContractor(
     [Join(0,range(3),1,range(3,6))],
     [[(1,i)] for i in range(3)] + [[(0,3+i),(1,6+i)] for i in range(2)] + [[(0,5)]]
 )
 # }}}
 # def absorbDenseSideIntoCornerFromRight(corner,side) # {{{
-absorbDenseSideIntoCornerFromRight = formDataContractor(
+absorbDenseSideIntoCornerFromRight = formBatchableDataContractor(
     [Join(0,range(3,6),1,range(3))],
     [[(0,i),(1,6+i)] for i in range(2)] + [[(0,2)]] + [[(1,i)] for i in range(3,6)]
 )
 # }}}
 # def absorbDenseCenterSSIntoSide(direction,side,center,center_conj=None) # {{{
-@prepend([formDataContractor(
+def formAbsorbCenterSSIntoSideNetwork(i):
     # 0 = side, 1 = center, 2 = center*
-    [
-        Join(0,6,1,i),
-        Join(0,7,2,i),
-        Join(1,4,2,4),
-    ],
-    [
-        [(0,0),(1,L(i))],
-        [(0,1),(2,L(i))],
-        [(0,2)],
-        [(0,3),(1,R(i))],
-        [(0,4),(2,R(i))],
-        [(0,5)],
-        [(1,O(i))],
-        [(2,O(i))],
-    ]
-) for i in range(4)])
+    return (
+        [
+            Join(0,6,1,i),
+            Join(0,7,2,i),
+            Join(1,4,2,4),
+        ],
+        [
+            [(0,0),(1,L(i))],
+            [(0,1),(2,L(i))],
+            [(0,2)],
+            [(0,3),(1,R(i))],
+            [(0,4),(2,R(i))],
+            [(0,5)],
+            [(1,O(i))],
+            [(2,O(i))],
+        ]
+    )
+@prepend([PlannedDataContractor(*formAbsorbCenterSSIntoSideNetwork(i)) for i in range(4)])
 def absorbDenseCenterSSIntoSide(contractors,direction,side,center,center_conj=None):
     if center_conj is None:
         center_conj = center.conj()
@@ -48,26 +50,40 @@ def absorbDenseCenterSSIntoSide(contractors,direction,side,center,center_conj=No
         center_conj,
       )
 # }}}
+# def absorbBatchedDenseCenterSSIntoSide(direction,sides,center,center_conj=None) # {{{
+@prepend([formDataContractor(*formAbsorbCenterSSIntoSideNetwork(i),batched_tensors=(0,)) for i in range(4)])
+def absorbBatchedDenseCenterSSIntoSide(contractors,direction,sides,center,center_conj=None):
+    if center_conj is None:
+        center_conj = center.conj()
+    return \
+      contractors[direction](
+        sides,
+        center,
+        center_conj,
+      )
+# }}}
 # def absorbDenseCenterSOSIntoSide(side,center,center_conj=None) {{{
-@prepend([formDataContractor(
+def formAbsorbCenterSOSIntoSideNetwork(i):
     # 0 = side, 1 = state, 2 = state*, 3 = operator
-    [
-        Join(3,0,2,4),
-        Join(3,1,1,4),
-        Join(0,6,1,i),
-        Join(0,7,2,i),
-    ],
-    [
-        [(0,0),(1,L(i))],
-        [(0,1),(2,L(i))],
-        [(0,2)],
-        [(0,3),(1,R(i))],
-        [(0,4),(2,R(i))],
-        [(0,5)],
-        [(1,O(i))],
-        [(2,O(i))],
-    ]
-) for i in range(4)])
+    return (
+        [
+            Join(3,0,2,4),
+            Join(3,1,1,4),
+            Join(0,6,1,i),
+            Join(0,7,2,i),
+        ],
+        [
+            [(0,0),(1,L(i))],
+            [(0,1),(2,L(i))],
+            [(0,2)],
+            [(0,3),(1,R(i))],
+            [(0,4),(2,R(i))],
+            [(0,5)],
+            [(1,O(i))],
+            [(2,O(i))],
+        ]
+    )
+@prepend([PlannedDataContractor(*formAbsorbCenterSOSIntoSideNetwork(i)) for i in range(4)])
 def absorbDenseCenterSOSIntoSide(contractors,direction,side,state_center_data,operator_center_data,state_center_data_conj=None):
     if state_center_data_conj is None:
         state_center_data_conj = state_center_data.conj()
@@ -79,6 +95,22 @@ def absorbDenseCenterSOSIntoSide(contractors,direction,side,state_center_data,op
             operator_center_data,
         )
 # }}}
+# def absorbBatchedDenseCenterSOSIntoSide(direction,sides,state_center_data,operator_center_datas,state_center_data_conj=None,sum_over_batch=False) {{{
+@prepend([
+    [formDataContractor(*formAbsorbCenterSOSIntoSideNetwork(i),batched_tensors=(0,3),sum_over_batch=sum_over_batch) for sum_over_batch in (False,True)]
+    for i in range(4)
+])
+def absorbBatchedDenseCenterSOSIntoSide(contractors,direction,sides,state_center_data,operator_center_datas,state_center_data_conj=None,sum_over_batch=False):
+    if state_center_data_conj is None:
+        state_center_data_conj = state_center_data.conj()
+    return \
+        contractors[direction][sum_over_batch](
+            sides,
+            state_center_data,
+            state_center_data_conj,
+            operator_center_datas,
+        )
+# }}}
 def formNormalizationMultiplier(corners,sides,center_identity): # {{{
     return formNormalizationStage3(
         formNormalizationStage2(
@@ -93,13 +125,13 @@ def formNormalizationMultiplier(corners,sides,center_identity): # {{{
     )
 # }}}
 # def formNormalizationStage1(corner,side) {{{
-formNormalizationStage1 = formDataContractor(
+formNormalizationStage1 = formBatchableDataContractor(
     [Join(0,range(3,6),1,range(3))],
     [[(0,i) for i in range(3)]] + [[(1,i) for i in range(3,6)]] + [[(1,i)] for i in range(6,8)]
 )
 # }}}
 # def formNormalizationStage2(stage1_0,stage1_1) {{{
-formNormalizationStage2 = formDataContractor(
+formNormalizationStage2 = formBatchableDataContractor(
     [Join(0,0,1,1)],
     [
         [(1,0)],
@@ -112,7 +144,7 @@ formNormalizationStage2 = formDataContractor(
 )
 # }}}
 # def formNormalizationStage3(stage2_0,stage2_1) {{{
-@prependDataContractor(
+@prependPlannedDataContractor(
     [
         Join(0,[3,4],2,[0,1]),
         Join(1,[3,4],2,[2,3]),
@@ -139,11 +171,11 @@ def formNormalizationStage3(contractor,stage2_0,stage2_1,center_identity):
                 stage2_1_joined
             ),
             computeCostOfContracting(contractor,stage2_0_joined,stage2_1_joined,dummy_state_center_data),
-            *formDenseStage3_formMatrix_and_cost(stage2_0,stage2_1,center_identity)
+            *(formDenseStage3_formMatrix_and_cost(stage2_0,stage2_1,center_identity)+formDenseStage3_formDiagonal_and_cost(stage2_0,stage2_1,center_identity))
         )
 # }}}
 # def formDenseStage3_multiply_and_cost(stage2_0,stage2_1,site_operator) {{{
-@prependDataContractor(
+@prependPlannedDataContractor(
     [
         Join(2,1,3,4),
         Join(0,[3,4],3,[0,1]),
@@ -193,12 +225,97 @@ def formDenseStage3_formMatrix_and_cost(contractor,stage2_0,stage2_1,site_operat
         computeCostOfContracting(contractor,stage2_0,stage2_1,site_operator)
     )
 # }}}
+def formDenseStage3_formDiagonal_and_cost(stage2_0,stage2_1,site_operator): # {{{
+    def formDiagonal(stage2_0,stage2_1,site_operator):
+        return stage2_0.contractNetworkWith([stage2_1,site_operator],"pqabab,qpcdcd,ee->abcde",["einsum_path",(0,1),(0,1)])
+    return (
+        partial(formDiagonal,stage2_0,stage2_1,site_operator),
+        computeCostOfContracting(formDiagonal,stage2_0,stage2_1,site_operator)
+    )
+# }}}
 def formDenseStage3(stage2_0,stage2_1,site_operator): # {{{
     return \
         Multiplier(*
             ((prod(stage2_0.shape[-2:]+stage2_1.shape[-2:]+(site_operator.shape[0],)),)*2,)+
             formDenseStage3_multiply_and_cost(stage2_0,stage2_1,site_operator)+ 
-            formDenseStage3_formMatrix_and_cost(stage2_0,stage2_1,site_operator)
+            formDenseStage3_formMatrix_and_cost(stage2_0,stage2_1,site_operator)+
+            formDenseStage3_formDiagonal_and_cost(stage2_0,stage2_1,site_operator)
+        )
+# }}}
+# def formBatchedDenseStage3_multiply_and_cost(stage2_0s,stage2_1,site_operators) {{{
+@prependPlannedDataContractor(
+    [
+        Join(0,0,2,0),
+        Join(0,[1,2],1,[1,0]),
+        Join(0,[3,4],3,[0,1]),
+        Join(1,[2,3],3,[2,3]),
+        Join(2,2,3,4),
+    ],
+    [
+        [(0,5)],
+        [(0,6)],
+        [(1,4)],
+        [(1,5)],
+        [(2,1)],
+    ]
+)
+def formBatchedDenseStage3_multiply_and_cost(contractor,stage2_0s,stage2_1,site_operators):
+    state_shape = stage2_0s.shape[3:5] + stage2_1.shape[2:4] + (site_operators.shape[2],)
+    return (
+        partial(
+            contractor,
+            stage2_0s,
+            stage2_1,
+            site_operators,
+            workspace={},
+        ),
+        computeCostOfContracting(contractor,stage2_0s,stage2_1,site_operators,state_shape)
+    )
+# }}}
+# def formBatchedDenseStage3_formMatrix_and_cost(stage2_0s,stage2_1,site_operators) {{{
+@prependPlannedDataContractor(
+    [
+        Join(0,0,2,0),
+        Join(0,[1,2],1,[1,0]),
+    ],
+    [
+        [(0,5),(0,6),(1,4),(1,5),(2,1)],
+        [(0,3),(0,4),(1,2),(1,3),(2,2)],
+    ]
+)
+def formBatchedDenseStage3_formMatrix_and_cost(contractor,stage2_0s,stage2_1,site_operators):
+    return (
+        partial(
+            contractor,
+            stage2_0s,
+            stage2_1,
+            site_operators,
+        ),
+        computeCostOfContracting(contractor,stage2_0s,stage2_1,site_operators)
+    )
+# }}}
+def formBatchedDenseStage3_formDiagonal_and_cost(stage2_0s,stage2_1,site_operators): # {{{
+    def formDiagonal(stage2_0s,stage2_1,site_operators):
+        return stage2_0s.contractNetworkWith([stage2_1,site_operators],"kpqabab,qpcdcd,kee->abcde",["einsum_path",(0,2),(0,1)])
+    return (
+        partial(formDiagonal,stage2_0s,stage2_1,site_operators),
+        computeCostOfContracting(formDiagonal,stage2_0s,stage2_1,site_operators)
+    )
+# }}}
+def formBatchedDenseStage3(stage2_1,terms): # {{{
+    # Each term is a site operator together with all of the stage2_0 blocks
+    # that it is paired with;  the blocks for the same operator are summed,
+    # and then the operators and sums are stacked along a new leading axis so
+    # that stage2_1 only has to be contracted with the center once.
+    DataClass = type(stage2_1)
+    stage2_0s = DataClass.newCollected([sum(stage2_0_datas[1:],stage2_0_datas[0]) for _, stage2_0_datas in terms])
+    site_operators = DataClass.newCollected([site_operator for site_operator, _ in terms])
+    return \
+        Multiplier(*
+            ((prod(stage2_0s.shape[3:5]+stage2_1.shape[2:4]+(site_operators.shape[2],)),)*2,)+
+            formBatchedDenseStage3_multiply_and_cost(stage2_0s,stage2_1,site_operators)+
+            formBatchedDenseStage3_formMatrix_and_cost(stage2_0s,stage2_1,site_operators)+
+            formBatchedDenseStage3_formDiagonal_and_cost(stage2_0s,stage2_1,site_operators)
         )
 # }}}
 # def formNormalizationSubmatrix + friends {{{
@@ -227,11 +344,18 @@ def formNormalizationSubmatrix(contractor,corners,sides):
 
 # Exports {{{
 __all__ = [
+    "absorbBatchedDenseCenterSSIntoSide",
+    "absorbBatchedDenseCenterSOSIntoSide",
     "absorbDenseSideIntoCornerFromLeft",
     "absorbDenseSideIntoCornerFromRight",
     "absorbDenseCenterSSIntoSide",
     "absorbDenseCenterSOSIntoSide",
+    "formBatchedDenseStage3",
+    "formBatchedDenseStage3_formDiagonal_and_cost",
+    "formBatchedDenseStage3_formMatrix_and_cost",
+    "formBatchedDenseStage3_multiply_and_cost",
     "formDenseStage3",
+    "formDenseStage3_formDiagonal_and_cost",
     "formDenseStage3_formMatrix_and_cost",
     "formDenseStage3_multiply_and_cost",
     "formNormalizationMultiplier",
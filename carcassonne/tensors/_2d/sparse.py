@@ -1,7 +1,8 @@
 # Imports {{{
+from collections import defaultdict
 from functools import partial
 import itertools
-from numpy import complex128, prod
+from numpy import prod, result_type
 
 from .dense import *
 from ...sparse import Identity, Complete, OneSiteOperator, TwoSiteOperator, TwoSiteOperatorCompressed, addStandardCompleteAndIdentityTerms, contractSparseTensors, formSparseContractor, getInformationFromOperatorCenter
@@ -40,6 +41,10 @@ def absorbSparseCenterSOSIntoSide(direction,side,state_center_data,operator_cent
         return absorbDenseCenterSSIntoSide(direction,side_data,state_center_data,state_center_data_conj)
     def contractSOS(side_data,operator_center_data_data):
         return absorbDenseCenterSOSIntoSide(direction,side_data,state_center_data,operator_center_data_data,state_center_data_conj)
+    # These are used when the side is stacked.
+    contractSS.batched = lambda side_datas, _: absorbBatchedDenseCenterSSIntoSide(direction,side_datas,state_center_data,state_center_data_conj)
+    contractSOS.batched = lambda side_datas, operator_center_datas: absorbBatchedDenseCenterSOSIntoSide(direction,side_datas,state_center_data,operator_center_datas,state_center_data_conj)
+    contractSOS.batched_sum = lambda side_datas, operator_center_datas: absorbBatchedDenseCenterSOSIntoSide(direction,side_datas,state_center_data,operator_center_datas,state_center_data_conj,sum_over_batch=True)
     terms = {
         # Complete/Identity terms
         (Identity,Identity): lambda s,c: (Identity(),contractSS),
@@ -113,23 +118,31 @@ def formExpectationStage3(stage2_0,stage2_1,operator_center): # {{{
         (TwoSiteOperatorCompressed,TwoSiteOperatorCompressed,Identity): lambda x,y,z: x.matchesForStage3(y),
     }
 
-    multipliers = []
+    # Gather the terms, batching together those that share a stage2_1 block
+    batches = defaultdict(lambda: defaultdict(list))
 
     tensors = (stage2_0,stage2_1,operator_center)
     for tags in itertools.product(*tensors):
         types = tuple(map(type,tags))
         if not rules.get(types,lambda x,y,z: False)(*tags):
             continue
-        if tags[-1] == Identity():
-            formStage3 = formNormalizationStage3
-        else:
-            formStage3 = formDenseStage3
-        multipliers.append(formStage3(*(tensor[tag] for tensor, tag in zip(tensors,tags))))
-        
+        stage2_0_data = stage2_0[tags[0]]
+        batches[tags[1],stage2_0_data.shape][tags[2]].append(stage2_0_data)
+
+    multipliers = [
+        formBatchedDenseStage3(
+            stage2_1[stage2_1_tag],
+            [(operator_center[operator_tag],stage2_0_datas) for operator_tag, stage2_0_datas in batch.items()]
+        )
+        for (stage2_1_tag, _), batch in batches.items()
+    ]
+
     def multiplyExpectation(center):
+        # Each multiplier adds its contribution directly into the result and
+        # keeps the buffers for its intermediate results between calls.
         result = center.newZeros(center.shape,dtype=center.dtype)
         for multiplier in multipliers:
-            result += multiplier(center)
+            multiplier.multiply(center,out=result,accumulate=True)
         return result
 
     bandwidth_dimensions = (
@@ -139,13 +152,19 @@ def formExpectationStage3(stage2_0,stage2_1,operator_center): # {{{
         stage2_1[Identity()].shape[3],
     )
     bandwidth_dimension = prod(bandwidth_dimensions)
-    physical_dimension, dtype, DataClass = getInformationFromOperatorCenter(operator_center)
+    physical_dimension, _, DataClass = getInformationFromOperatorCenter(operator_center)
+    dtype = result_type(stage2_0[Identity()].dtype,stage2_1[Identity()].dtype,*(data.dtype for data in operator_center.values() if data is not None))
     dimension = bandwidth_dimension*physical_dimension
     def formExpectationMatrix():
-        matrix = DataClass.newZeros((dimension,dimension),dtype=complex128)
+        matrix = DataClass.newZeros((dimension,dimension),dtype=dtype)
         for multiplier in multipliers:
             matrix += multiplier.formMatrix()
         return matrix
+    def formExpectationDiagonal():
+        diagonal = DataClass.newZeros(bandwidth_dimensions+(physical_dimension,),dtype=dtype)
+        for multiplier in multipliers:
+            diagonal += multiplier.formDiagonal()
+        return diagonal
 
     normalization_multiplier = formNormalizationStage3(stage2_0[Identity()],stage2_1[Identity()],DataClass.newIdentity(physical_dimension))
 
@@ -155,6 +174,8 @@ def formExpectationStage3(stage2_0,stage2_1,operator_center): # {{{
         sum((multiplier.cost_of_multiply for multiplier in multipliers),0),
         formExpectationMatrix,
         sum((multiplier.cost_of_formMatrix for multiplier in multipliers),0),
+        formExpectationDiagonal,
+        sum((multiplier.cost_of_formDiagonal for multiplier in multipliers),0),
     )
 
     return expectation_multiplier, normalization_multiplier
@@ -0,0 +1,110 @@
+# Imports {{{
+import os
+from tempfile import TemporaryDirectory
+
+from . import *
+from ..checkpoint import *
+from ..policies import *
+from ..system import _1d, _2d
+# }}}
+
+class TestCheckpoint(TestCase): # {{{
+    @with_checker(number_of_calls=10) # test_resume_1d {{{
+    def test_resume_1d(self,
+        operator_dimension=irange(1,3),
+        state_dimension=irange(1,3),
+        physical_dimension=irange(2,3),
+    ):
+        system = _1d.System.newRandom(operator_dimension,state_dimension,physical_dimension)
+        system.contractTowards(0)
+        with TemporaryDirectory() as path:
+            writer = CheckpointWriter(path)
+            self.assertTrue(writer.write(system))
+            writer.wait()
+            resumed_system = _1d.System.resume(path)
+        self.assertAlmostEqual(resumed_system.computeExpectation(),system.computeExpectation())
+        self.assertDataAlmostEqual(resumed_system.state_center_data,system.state_center_data)
+    # }}}
+    @with_checker(number_of_calls=10) # test_resume_2d {{{
+    def test_resume_2d(self,directions=[irange(0,3)]):
+        system = _2d.System.newTrivialWithSimpleSparseOperator(O=NDArrayData.Z,OO_UD=(NDArrayData.X,NDArrayData.X),OO_LR=(NDArrayData.X,NDArrayData.X))
+        system.setPolicy("sweep convergence",RelativeOneSiteExpectationDifferenceThresholdConvergencePolicy(1e-7))
+        system.setPolicy("contraction",RepeatPatternContractionPolicy([0,2,1,3]))
+        system.setPolicy("post-optimization hook",HookPolicy(lambda system: None))
+        system.number_of_sweeps = 1
+        system.number_of_iterations = len(directions)
+        system.iteration_number_for_sweep = len(directions)+1
+        for direction in directions:
+            system.minimizeExpectation()
+            system._updatePolicy("sweep convergence")
+            system.contractTowards(direction)
+        system.minimizeExpectation()
+        system._updatePolicy("sweep convergence")
+        with TemporaryDirectory() as path:
+            writer = CheckpointWriter(path)
+            self.assertTrue(writer.write(system))
+            writer.wait()
+            resumed_system = _2d.System.resume(path)
+        self.assertAlmostEqual(resumed_system.computeExpectation(),system.computeExpectation())
+        self.assertEqual(resumed_system.number_of_iterations,system.number_of_iterations)
+        self.assertEqual(resumed_system.iteration_number_for_sweep,system.iteration_number_for_sweep)
+        self.assertEqual(len(resumed_system.eigensolver_subspace),len(system.eigensolver_subspace))
+        policy = resumed_system._policies["sweep convergence"]
+        self.assertIs(policy.system,resumed_system)
+        self.assertEqual(policy.current,system._policies["sweep convergence"].current)
+        self.assertIs(resumed_system._policies["post-optimization hook"],None)
+        self.assertTrue(resumed_system._resuming)
+    # }}}
+    @with_checker(number_of_calls=10) # test_only_changed_pieces_are_written {{{
+    def test_only_changed_pieces_are_written(self,direction=irange(0,3)):
+        system = _2d.System.newRandom()
+        with TemporaryDirectory() as path:
+            writer = CheckpointWriter(path)
+            writer.write(system)
+            writer.wait()
+            old_filenames = dict((name,filename) for name, (_, filename) in writer.written_pieces.items())
+            system.contractTowards(direction)
+            writer.write(system)
+            writer.wait()
+            new_filenames = dict((name,filename) for name, (_, filename) in writer.written_pieces.items())
+            for name in ["corner{}".format(direction),"corner{}".format(R(direction)),"side{}".format(direction),"state_center_data"]:
+                self.assertNotEqual(new_filenames[name],old_filenames[name])
+            for corner_id in range(4):
+                if corner_id not in (direction,R(direction)):
+                    self.assertEqual(new_filenames["corner{}".format(corner_id)],old_filenames["corner{}".format(corner_id)])
+            self.assertEqual(sorted(os.listdir(path)),sorted(set(new_filenames.values())|{"manifest.pickle.gz"}))
+            resumed_system = _2d.System.resume(path)
+        self.assertAlmostEqual(resumed_system.computeExpectation(),system.computeExpectation())
+    # }}}
+    def test_new_writer_keeps_existing_pieces(self): # {{{
+        system = _2d.System.newRandom()
+        with TemporaryDirectory() as path:
+            writer = CheckpointWriter(path)
+            writer.write(system)
+            writer.wait()
+            old_filenames = set(filename for _, filename in writer.written_pieces.values())
+            resumed_system = _2d.System.resume(path)
+            writer = CheckpointWriter(path)
+            writer.write(resumed_system)
+            writer.wait()
+            new_filenames = set(filename for _, filename in writer.written_pieces.values())
+            self.assertEqual(old_filenames & new_filenames,set())
+            self.assertEqual(sorted(os.listdir(path)),sorted(new_filenames|{"manifest.pickle.gz"}))
+    # }}}
+    def test_resumed_run_converges(self): # {{{
+        def setPolicies(system):
+            system.setPolicy("sweep convergence",RelativeOneSiteExpectationDifferenceThresholdConvergencePolicy(1e-7))
+            system.setPolicy("run convergence",RelativeOneSiteExpectationDifferenceThresholdConvergencePolicy(1e-7))
+            system.setPolicy("bandwidth increase",OneDirectionIncrementBandwidthIncreasePolicy(0,2))
+            system.setPolicy("contraction",RepeatPatternContractionPolicy([0,2]))
+        system = _2d.System.newTrivialWithSimpleSparseOperator(O=-NDArrayData.Z,OO_LR=[NDArrayData.X,-0.01*NDArrayData.X])
+        setPolicies(system)
+        with TemporaryDirectory() as path:
+            system.setPolicy("checkpoint",IterationCountCheckpointPolicy(path,1))
+            system.runUntilConverged()
+            system._policies["checkpoint"].writer.wait()
+            resumed_system = _2d.System.resume(path)
+        resumed_system.runUntilConverged()
+        self.assertAlmostEqual(resumed_system.computeOneSiteExpectation(),-1.0000250001562545)
+    # }}}
+# }}}
@@ -1,5 +1,5 @@
 # Imports {{{
-from numpy import prod
+from numpy import prod, tensordot
 from scipy.linalg import eigh, eigvalsh
 from scipy.sparse.linalg import eigs, eigsh
 
@@ -29,6 +29,81 @@ class TestNDArrayData(TestCase): # {{{
             matrix.contractWith(tensor,(1,),(axis,)).join(*new_axes),
         )
     # }}}
+    @with_checker # test_absorbMatrixAt_non_square_on_view {{{
+    def test_absorbMatrixAt_non_square_on_view(self,ndim=irange(1,5),n=irange(1,8),m=irange(1,8)):
+        axis = randint(0,ndim-1)
+        permutation = list(range(ndim))
+        shuffle(permutation)
+        tensor = NDArrayData.newRandom(*(randint(1,n) for _ in range(ndim))).transpose(permutation)
+        matrix = NDArrayData.newRandom(m,tensor.shape[axis])
+        new_axes = list(range(1,ndim))
+        new_axes.insert(axis,0)
+        self.assertDataAlmostEqual(
+            tensor.absorbMatrixAt(axis,matrix),
+            matrix.contractWith(tensor,(1,),(axis,)).join(*new_axes),
+        )
+    # }}}
+    @with_checker # test_contractBatchWith {{{
+    def test_contractBatchWith(self,batch_size=irange(1,5),ndim=irange(1,4),n=irange(1,3)):
+        number_of_contracted_axes = randint(0,ndim)
+        contracted_shape = [randint(1,n) for _ in range(number_of_contracted_axes)]
+        self_shape = contracted_shape + [randint(1,n) for _ in range(ndim-number_of_contracted_axes)]
+        other_shape = [randint(1,n) for _ in range(randint(0,2))] + contracted_shape
+        self_permutation = list(range(ndim))
+        shuffle(self_permutation)
+        a = NDArrayData.newRandom(batch_size,*self_shape).join(0,*(axis+1 for axis in self_permutation))
+        b = NDArrayData.newRandom(batch_size,*other_shape)
+        self_axes = [self_permutation.index(axis)+1 for axis in range(number_of_contracted_axes)]
+        other_axes = list(range(len(other_shape)-number_of_contracted_axes+1,len(other_shape)+1))
+        result = a.contractBatchWith(b,self_axes,other_axes)
+        for index in range(batch_size):
+            self.assertDataAlmostEqual(result[index],a[index].contractWith(b[index],[axis-1 for axis in self_axes],[axis-1 for axis in other_axes]))
+    # }}}
+    @with_checker # test_conj_is_lazy {{{
+    def test_conj_is_lazy(self,ndim=irange(0,4),n=irange(1,5)):
+        data = NDArrayData.newRandom(*(randint(1,n) for _ in range(ndim)))
+        data_conj = data.conj()
+        self.assertIs(data_conj._data,data._data)
+        self.assertAllClose(data_conj.toArray(),data.toArray().conj())
+        self.assertAllClose(data.toArray(),data_conj.conj().toArray())
+    # }}}
+    @with_checker # test_contractWith_lazily_conjugated {{{
+    def test_contractWith_lazily_conjugated(self,ndim=irange(1,4),n=irange(1,5),which=choiceof(("self","other","both"))):
+        number_of_contracted_axes = randint(0,ndim)
+        contracted_shape = [randint(1,n) for _ in range(number_of_contracted_axes)]
+        self_shape = contracted_shape + [randint(1,n) for _ in range(ndim-number_of_contracted_axes)]
+        other_shape = contracted_shape + [randint(1,n) for _ in range(randint(0,2))]
+        a = NDArrayData.newRandom(*self_shape)
+        b = NDArrayData.newRandom(*other_shape)
+        a_arr = a.toArray()
+        b_arr = b.toArray()
+        if which in ("self","both"):
+            a = a.conj()
+            a_arr = a_arr.conj()
+        if which in ("other","both"):
+            b = b.conj()
+            b_arr = b_arr.conj()
+        axes = list(range(number_of_contracted_axes))
+        self.assertAllClose(
+            a.contractWith(b,axes,axes).toArray(),
+            tensordot(a_arr,b_arr,(axes,axes)),
+        )
+    # }}}
+    @with_checker # test_contractWith_out {{{
+    def test_contractWith_out(self,ndim=irange(1,4),n=irange(1,5),accumulate=choiceof((False,True)),transposed=choiceof((False,True))):
+        number_of_contracted_axes = randint(0,ndim)
+        contracted_shape = [randint(1,n) for _ in range(number_of_contracted_axes)]
+        a = NDArrayData.newRandom(*(contracted_shape + [randint(1,n) for _ in range(ndim-number_of_contracted_axes)]))
+        b = NDArrayData.newRandom(*(contracted_shape + [randint(1,n) for _ in range(randint(1,2))]))
+        axes = list(range(number_of_contracted_axes))
+        correct_result = tensordot(a.toArray(),b.toArray(),(axes,axes))
+        out = NDArrayData.newRandom(*correct_result.shape[::-1 if transposed else 1])
+        if transposed:
+            out = out.transpose()
+        initial = out.toArray().copy()
+        self.assertIs(a.contractWith(b,axes,axes,out=out,accumulate=accumulate),out)
+        self.assertAllClose(out.toArray(),correct_result + initial*accumulate)
+    # }}}
     @with_checker # test_directSumWith_all_axes_summed {{{
     def test_directSumWith_all_axes_summed(self,shapes=((irange(1,5),)*5,)*2):
         datas = [NDArrayData.newRandom(*shape) for shape in shapes]
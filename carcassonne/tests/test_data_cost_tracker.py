@@ -207,3 +207,47 @@ class TestCostTracker(TestCase): # {{{
         self.assertEqual(contraction.cost,a*b*c*d*e*f*g*h)
     # }}}
 # }}}
+
+class TestMemoryTracker(TestCase): # {{{
+    @with_checker # test_matrix_multiplication_three_matrices {{{
+    def test_matrix_multiplication_three_matrices(self,
+        a=irange(1,10),
+        b=irange(1,10),
+        c=irange(1,10),
+        d=irange(1,10),
+    ):
+        ledger = computeMemoryUsageOfContracting(
+            formDataContractor([Join(1,1,2,0),Join(0,1,1,0)],[[(0,0)],[(2,1)]]),
+            (a,b),(b,c),(c,d)
+        )
+        self.assertEqual(ledger.intermediate_sizes,[b*d,a*d])
+        self.assertEqual(ledger.peak,a*b+b*c+c*d+b*d+a*d)
+        self.assertEqual(ledger.live,0)
+    # }}}
+    @with_checker # test_inputs_freed_when_no_longer_needed {{{
+    def test_inputs_freed_when_no_longer_needed(self,
+        a=irange(1,10),
+        b=irange(1,10),
+        c=irange(1,10),
+        d=irange(1,10),
+    ):
+        ledger = MemoryLedger()
+        contractor = formDataContractor([Join(1,1,2,0),Join(0,1,1,0)],[[(0,0)],[(2,1)]])
+        A = MemoryTracker((a,b),0,ledger)
+        B = MemoryTracker((b,c),0,ledger)
+        C = MemoryTracker((c,d),0,ledger)
+        result = contractor(A,B,C)
+        self.assertEqual(ledger.live,a*b+b*c+c*d+a*d)
+        del A, B, C
+        self.assertEqual(ledger.live,a*d)
+        del result
+        self.assertEqual(ledger.live,0)
+    # }}}
+    @with_checker # test_transposing_copies {{{
+    def test_transposing_copies(self,m=irange(1,10),n=irange(1,10)):
+        ledger = computeMemoryUsageOfContracting(formDataContractor([],[[(0,1)],[(0,0)]]),(m,n))
+        self.assertEqual(ledger.peak,2*m*n)
+        ledger = computeMemoryUsageOfContracting(formDataContractor([],[[(0,0),(0,1)]]),(m,n))
+        self.assertEqual(ledger.peak,m*n)
+    # }}}
+# }}}
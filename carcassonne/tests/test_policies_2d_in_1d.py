@@ -1,5 +1,5 @@
 # Imports {{{
-from numpy import ones
+from numpy import float32, float64, ones
 
 from . import *
 from ..policies import *
@@ -60,4 +60,24 @@ class TestConvergencePolicies1D(TestCase): # {{{
         system.runUntilConverged()
         self.assertAlmostEqual(system.computeOneSiteExpectation(),-1.0000250001562545)
     # }}}
+
+class TestPrecisionPolicies1D(TestCase): # {{{
+    @ with_checker(number_of_calls=10) # test_single_precision_until_converged {{{
+    def test_single_precision_until_converged(self,direction=choiceof((0,1))):
+        if direction == 0:
+            system = System.newTrivialWithSimpleSparseOperator(O=-NDArrayData.Z,OO_LR=[NDArrayData.X,-0.01*NDArrayData.X])
+        else:
+            system = System.newTrivialWithSimpleSparseOperator(O=-NDArrayData.Z,OO_UD=[NDArrayData.X,-0.01*NDArrayData.X])
+        system.setPolicy("sweep convergence",RelativeOneSiteExpectationDifferenceThresholdConvergencePolicy(1e-7))
+        system.setPolicy("run convergence",RelativeOneSiteExpectationDifferenceThresholdConvergencePolicy(1e-7))
+        system.setPolicy("bandwidth increase",OneDirectionIncrementBandwidthIncreasePolicy(direction,2))
+        system.setPolicy("contraction",RepeatPatternContractionPolicy([0+direction,2+direction]))
+        system.setPolicy("precision",SinglePrecisionUntilConvergedPrecisionPolicy(RelativeOneSiteExpectationDifferenceThresholdConvergencePolicy(1e-4)))
+        dtypes = set()
+        system.setPolicy("post-optimization hook",HookPolicy(lambda system: dtypes.add(system.state_center_data.dtype.type)))
+        system.runUntilConverged()
+        self.assertIn(float32,dtypes)
+        self.assertEqual(system.state_center_data.dtype,float64)
+        self.assertAlmostEqual(system.computeOneSiteExpectation(),-1.0000250001562545)
+    # }}}
 # }}}
@@ -38,3 +38,13 @@ class TestSimulator1D2D(): # {{{
             self.assertAlmostEqual(system.computeEstimatedOneSiteExpectation()/4,-0.4431471805599,places=3)
     # }}}
 # }}}
+class TestSystem1D2D(TestCase): # {{{
+    def test_normalizeStateCenterAxis_follows_the_center(self): # {{{
+        system = System.newSimple(0,Pauli.Z)
+        system.normalizeStateCenterAxis(0)
+        system.contractTowards(0)
+        system.minimizeExpectation()
+        for data, correct_data in zip(system.normalizeStateCenterAxis(0),system.state_center_data.normalizeAxis(0)):
+            self.assertDataAlmostEqual(data,correct_data)
+    # }}}
+# }}}
@@ -0,0 +1,86 @@
+# Imports {{{
+from . import *
+from ..sparse import *
+# }}}
+
+class TestContractSparseTensors(TestCase): # {{{
+    def contractSparseTensorsByVisitingAllPairs(self,dense_contractors,tensor_1,tensor_2): # {{{
+        result_tensor = {}
+        for tag_1, data_1 in tensor_1.items():
+            for tag_2, data_2 in tensor_2.items():
+                if (type(tag_1),type(tag_2)) in dense_contractors:
+                    handler = dense_contractors[type(tag_1),type(tag_2)](tag_1,tag_2)
+                    if handler is not None and handler[0] is not None:
+                        result_tag, contractDenseTensors = handler
+                        result_data = contractDenseTensors(data_1,data_2)
+                        if result_tag in result_tensor:
+                            result_tensor[result_tag] += result_data
+                        else:
+                            result_tensor[result_tag]  = result_data
+        return result_tensor
+    # }}}
+    def makeRandomSparseTensor(self,number_of_ids,maximum_position): # {{{
+        tags = [Identity(),Complete(),TwoSiteOperatorCompressed(randint(0,1))]
+        tags.extend(
+            TwoSiteOperator(id,direction,randint(0,maximum_position))
+            for id in range(number_of_ids)
+            for direction in range(3)
+            if randint(0,1) == 1
+        )
+        return {tag: NDArrayData.newRandom(2) for tag in tags}
+    # }}}
+    @with_checker # test_same_as_visiting_all_pairs {{{
+    def test_same_as_visiting_all_pairs(self,number_of_ids=irange(0,5),maximum_position=irange(0,2)):
+        contract = lambda x, y: x.contractWith(y,(),())
+        terms = {}
+        addStandardCompleteAndIdentityTerms(terms,contract)
+        terms.update({
+            (TwoSiteOperator,Identity): lambda l,r: (l.matchesSideIdentityOnRight(),contract),
+            (Identity,TwoSiteOperator): lambda l,r: (r.matchesCornerIdentityOnLeft(),contract),
+            (TwoSiteOperator,TwoSiteOperator): lambda l,r: (l.matches(r),contract),
+            (TwoSiteOperatorCompressed,TwoSiteOperatorCompressed): lambda l,r: (l.matches(r),contract),
+        })
+        tensor_1 = self.makeRandomSparseTensor(number_of_ids,maximum_position)
+        tensor_2 = self.makeRandomSparseTensor(number_of_ids,maximum_position)
+        result_tensor = contractSparseTensors(terms,tensor_1,tensor_2)
+        correct_result_tensor = self.contractSparseTensorsByVisitingAllPairs(terms,tensor_1,tensor_2)
+        self.assertEqual(set(result_tensor.keys()),set(correct_result_tensor.keys()))
+        for tag, data in correct_result_tensor.items():
+            self.assertDataAlmostEqual(result_tensor[tag],data)
+    # }}}
+# }}}
+class TestStackedSparseTensor(TestCase): # {{{
+    @with_checker # test_contractSparseTensors_same_as_unstacked {{{
+    def test_contractSparseTensors_same_as_unstacked(self,number_of_ids=irange(0,5),maximum_position=irange(0,2),batchable=choiceof((False,True))):
+        if batchable:
+            contract = formBatchableDataContractor([],[[(0,0)],[(1,0)]])
+        else:
+            contract = lambda x, y: x.contractWith(y,(),())
+        terms = {}
+        addStandardCompleteAndIdentityTerms(terms,contract)
+        terms.update({
+            (TwoSiteOperator,Identity): lambda l,r: (l.matchesSideIdentityOnRight(),contract),
+            (Identity,TwoSiteOperator): lambda l,r: (r.matchesCornerIdentityOnLeft(),contract),
+            (TwoSiteOperator,TwoSiteOperator): lambda l,r: (l.matches(r),contract),
+            (TwoSiteOperatorCompressed,TwoSiteOperatorCompressed): lambda l,r: (l.matches(r),contract),
+        })
+        tensor_1 = TestContractSparseTensors.makeRandomSparseTensor(self,number_of_ids,maximum_position)
+        tensor_2 = TestContractSparseTensors.makeRandomSparseTensor(self,number_of_ids,maximum_position)
+        result_tensor = contractSparseTensors(terms,StackedSparseTensor.newFromSparse(tensor_1),StackedSparseTensor.newFromSparse(tensor_2))
+        correct_result_tensor = contractSparseTensors(terms,tensor_1,tensor_2)
+        self.assertIsInstance(result_tensor,StackedSparseTensor)
+        self.assertEqual(set(result_tensor.keys()),set(correct_result_tensor.keys()))
+        for tag, data in correct_result_tensor.items():
+            self.assertDataAlmostEqual(result_tensor[tag],data)
+    # }}}
+    @with_checker # test_mapOverSparseData {{{
+    def test_mapOverSparseData(self,number_of_ids=irange(0,5)):
+        sparse = TestContractSparseTensors.makeRandomSparseTensor(self,number_of_ids,2)
+        matrix = NDArrayData.newRandom(3,2)
+        f = lambda data: matrix.contractWith(data,(1,),(0,))
+        stacked_result = mapOverSparseData(f,StackedSparseTensor.newFromSparse(sparse))
+        self.assertIsInstance(stacked_result,StackedSparseTensor)
+        for tag, data in mapOverSparseData(f,sparse).items():
+            self.assertDataAlmostEqual(stacked_result[tag],data)
+    # }}}
+# }}}
@@ -3,8 +3,10 @@ from numpy import array, complex128, prod, isnan
 from numpy.linalg import norm
 
 from . import *
+from ..policies import *
 from ..system import *
 from ..sparse import *
+from ..tensors._2d.sparse import formExpectationAndNormalizationMultipliers
 from ..utils import *
 # }}}
 
@@ -114,6 +116,45 @@ class TestSystem(TestCase): # {{{
         self.assertAlmostEqual(normalization2,normalization1)
         self.assertAlmostEqual(expectation2,expectation1)
     # }}}
+    @with_checker(number_of_calls=10) # test_compressCornerTwoSiteOperatorTowards_after_each_step {{{
+    def test_compressCornerTwoSiteOperatorTowards_after_each_step(self,
+        corner_id=irange(0,3),
+        direction=irange(0,1),
+        physical_dimension=irange(1,4),
+        new_dimension=irange(1,10),
+    ):
+        side_id = sideFromCorner(corner_id,direction)
+
+        operator_data = [NDArrayData.newRandomHermitian(physical_dimension,physical_dimension) for _ in range(2)]
+        if side_id in (1,3):
+            operator_direction = "OO_LR"
+        else:
+            operator_direction = "OO_UD"
+        system1 = System.newTrivialWithSimpleSparseOperator(**{operator_direction:operator_data})
+
+        if direction == 0:
+            system1.contractTowards(R(side_id))
+        else:
+            system1.contractTowards(L(side_id))
+        for _ in range(new_dimension):
+            system1.contractTowards(side_id)
+        state_center_data = system1.state_center_data
+        system2 = copy(system1)
+        # Each step pushes a single new term into the block compressed by the
+        # step before, as happens when compressing during a sweep.
+        for _ in range(new_dimension*2+1):
+            system1.contractTowards(side_id)
+            system2.contractTowards(side_id)
+            system2.compressCornerTwoSiteOperatorTowards(corner_id,direction,new_dimension)
+        system1.setStateCenter(state_center_data)
+        system2.setStateCenter(state_center_data)
+
+        self.assertTrue(system2.corners[corner_id][TwoSiteOperatorCompressed(direction)].shape[3*direction+2] <= new_dimension)
+        expectation1, normalization1 = system1.computeExpectationAndNormalization()
+        expectation2, normalization2 = system2.computeExpectationAndNormalization()
+        self.assertAlmostEqual(normalization2,normalization1)
+        self.assertAlmostEqual(expectation2,expectation1)
+    # }}}
     @with_checker(number_of_calls=10) # test_compressCornerTwoSiteOperatorTowards_new_same_as_old {{{
     def test_compressCornerTwoSiteOperatorTowards_new_same_as_old(self,
         corner_id=irange(0,3),
@@ -195,6 +236,76 @@ class TestSystem(TestCase): # {{{
             state_center_data_conj.ravel().contractWith(state_center_data.absorbMatrixAt(4,O).ravel(),(0,),(0,)).extractScalar()/state_center_data_conj.ravel().contractWith(state_center_data.ravel(),(0,),(0,)).extractScalar()
         )
     # }}}
+    @with_checker(number_of_calls=10) # test_computeOneSiteExpectation_same_as_term_by_term {{{
+    def test_computeOneSiteExpectation_same_as_term_by_term(self,directions=[irange(0,3)]):
+        system = System.newTrivialWithSimpleSparseOperator(O=NDArrayData.Z,OO_UD=(NDArrayData.X,NDArrayData.X),OO_LR=(NDArrayData.Y,NDArrayData.Y))
+        for direction in directions:
+            system.minimizeExpectation()
+            system.contractTowards(direction)
+        system.minimizeExpectation()
+
+        stripped_system = system.stripExpectationEnvironment()
+        expectation = 0
+        for tag, value in system.operator_center_tensor.items():
+            if isinstance(tag,OneSiteOperator):
+                term_system = copy(stripped_system)
+                term_system.operator_center_tensor[tag] = value
+                expectation += term_system.computeExpectation()
+            elif isinstance(tag,TwoSiteOperator) and tag.position == 0 and tag.direction in (0,1):
+                other_tag = tag.withNewDirectionAndPosition(tag.direction+2,0)
+                term_system = copy(stripped_system)
+                term_system.operator_center_tensor[tag] = value
+                term_system.operator_center_tensor[other_tag] = system.operator_center_tensor[other_tag]
+                term_system.contractTowards(tag.direction)
+                expectation += term_system.computeExpectation()
+
+        self.assertAlmostEqual(system.computeOneSiteExpectation(),expectation)
+    # }}}
+    @with_checker(number_of_calls=10) # test_computeExpectations_sum_to_computeOneSiteExpectation {{{
+    def test_computeExpectations_sum_to_computeOneSiteExpectation(self,directions=[irange(0,3)]):
+        operators = dict(O=NDArrayData.Z,OO_UD=(NDArrayData.X,NDArrayData.X),OO_LR=(NDArrayData.Y,NDArrayData.Y))
+        system = System.newTrivialWithSimpleSparseOperator(**operators)
+        for direction in directions:
+            system.minimizeExpectation()
+            system.contractTowards(direction)
+        system.minimizeExpectation()
+        expectations = system.computeExpectations(Os=[operators["O"]],OO_UDs=[operators["OO_UD"]],OO_LRs=[operators["OO_LR"]])
+        self.assertEqual(len(expectations),3)
+        self.assertAlmostEqual(sum(expectations),system.computeOneSiteExpectation())
+    # }}}
+    @with_checker(number_of_calls=10) # test_computeExpectations_each_same_as_term_by_term {{{
+    def test_computeExpectations_each_same_as_term_by_term(self,directions=[irange(0,3)]):
+        system = System.newTrivialWithSimpleSparseOperator(O=NDArrayData.Z,OO_UD=(NDArrayData.X,NDArrayData.Y),OO_LR=(NDArrayData.Y,NDArrayData.Z))
+        for direction in directions:
+            system.setStateCenter(NDArrayData.newRandom(*system.state_center_data.shape))
+            system.contractTowards(direction)
+        system.setStateCenter(NDArrayData.newRandom(*system.state_center_data.shape))
+        Os = [NDArrayData.Z,NDArrayData.X,NDArrayData.Y]
+        OO_UDs = [(NDArrayData.X,NDArrayData.Z),(NDArrayData.Z,NDArrayData.X),(NDArrayData.Y,NDArrayData.Y)]
+        OO_LRs = [(NDArrayData.X,NDArrayData.Z),(NDArrayData.Z,NDArrayData.X)]
+        expectations = system.computeExpectations(Os=Os,OO_UDs=OO_UDs,OO_LRs=OO_LRs)
+        self.assertEqual(len(expectations),len(Os)+len(OO_UDs)+len(OO_LRs))
+
+        stripped_system = system.stripExpectationEnvironment()
+        correct_expectations = []
+        for O in Os:
+            term_system = copy(stripped_system)
+            term_system.operator_center_tensor[OneSiteOperator(None)] = O
+            correct_expectations.append(term_system.computeExpectation())
+        for direction, name, OOs in ((1,"OO_UD",OO_UDs),(0,"OO_LR",OO_LRs)):
+            for OO in OOs:
+                term_system = copy(stripped_system)
+                term_system.operator_center_tensor.update(
+                    (tag, value)
+                    for tag, value in makeSimpleSparseOperator(**{name:OO}).items()
+                    if tag is not Identity()
+                )
+                term_system.contractTowards(direction)
+                correct_expectations.append(term_system.computeExpectation())
+
+        for expectation, correct_expectation in zip(expectations,correct_expectations):
+            self.assertAlmostEqual(expectation,correct_expectation)
+    # }}}
     @with_checker # test_expectation_of_identity_after_no_steps # {{{
     def test_expectation_of_sum_of_identities_after_no_steps(self):
         self.assertAlmostEqual(System.newRandom(makeOperator=lambda N: NDArrayData.newIdentity(N)).computeExpectation(),1)
@@ -245,6 +356,174 @@ class TestSystem(TestCase): # {{{
         self.assertEqual(expectation_mutiplier.shape,(system.state_center_data.size(),)*2)
         self.assertEqual(normalization_multiplier.shape,(system.state_center_data.size(),)*2)
     # }}}
+    @with_checker(number_of_calls=10) # test_eigensolver_subspace_follows_contractTowards {{{
+    def test_eigensolver_subspace_follows_contractTowards(self,directions=[irange(0,3)]):
+        system = System.newRandom()
+        system.minimizeExpectation()
+        for direction in directions:
+            system.contractTowards(direction)
+            for vector in system.eigensolver_subspace:
+                self.assertEqual(vector.shape,system.state_center_data.shape)
+            system.minimizeExpectation()
+    # }}}
+    @with_checker(number_of_calls=10) # test_eigensolver_subspace_stays_normalized_in_compressed_sweep {{{
+    def test_eigensolver_subspace_stays_normalized_in_compressed_sweep(self,direction=choiceof((0,1))):
+        if direction == 0:
+            system = System.newTrivialWithSimpleSparseOperator(OO_LR=[NDArrayData.Z,-NDArrayData.Z])
+        else:
+            system = System.newTrivialWithSimpleSparseOperator(OO_UD=[NDArrayData.Z,-NDArrayData.Z])
+        system.setPolicy("state compression",ConstantStateCompressionPolicy(1))
+        system.setPolicy("sweep convergence",RelativeOneSiteExpectationDifferenceThresholdConvergencePolicy(1e-7))
+        system.setPolicy("run convergence",RelativeOneSiteExpectationDifferenceThresholdConvergencePolicy(1e-7))
+        system.setPolicy("bandwidth increase",AllDirectionsIncrementBandwidthIncreasePolicy())
+        system.setPolicy("contraction",RepeatPatternContractionPolicy(range(4)))
+        # The hook runs just after the contraction has transformed the Ritz
+        # vectors that warm-start the optimization.
+        norms = []
+        system.setPolicy("pre-optimization hook",HookPolicy(lambda system: norms.extend(vector.norm() for vector in system.eigensolver_subspace)))
+        system.runUntilConverged()
+        self.assertTrue(norms)
+        for vector_norm in norms:
+            self.assertAlmostEqual(vector_norm,1)
+        self.assertAlmostEqual(system.computeOneSiteExpectation(),-1,places=6)
+    # }}}
+    @with_checker(number_of_calls=10) # test_normalizeStateCenterAxis_is_cached_until_the_center_changes {{{
+    def test_normalizeStateCenterAxis_is_cached_until_the_center_changes(self,axis=irange(0,3),direction=irange(0,3)):
+        system = System.newRandom()
+        normalization = system.normalizeStateCenterAxis(axis)
+        self.assertIs(system.normalizeStateCenterAxis(axis),normalization)
+        for data, correct_data in zip(normalization,system.state_center_data.normalizeAxis(axis)):
+            self.assertDataAlmostEqual(data,correct_data)
+        system.contractTowards(direction)
+        system.minimizeExpectation()
+        self.assertEqual(system._state_center_normalizations,(None,{}))
+        normalization = system.normalizeStateCenterAxis(axis)
+        for data, correct_data in zip(normalization,system.state_center_data.normalizeAxis(axis)):
+            self.assertDataAlmostEqual(data,correct_data)
+    # }}}
+    @with_checker(number_of_calls=10) # test_normalization_solver_tracks_environment {{{
+    def test_normalization_solver_tracks_environment(self,direction=irange(0,3)):
+        system = System.newRandom()
+        system.minimizeExpectation()
+        dependencies = system.normalization_solver.dependencies
+        system.minimizeExpectation()
+        self.assertIs(system.normalization_solver.dependencies,dependencies)
+        system.contractTowards(direction)
+        system.minimizeExpectation()
+        self.assertIsNot(system.normalization_solver.dependencies,dependencies)
+        self.assertEqual(list(system.normalization_solver.dependencies),system.corners+system.sides)
+    # }}}
+    @with_checker(number_of_calls=10) # test_formExpectationAndNormalizationMultipliers_uses_cached_environment {{{
+    def test_formExpectationAndNormalizationMultipliers_uses_cached_environment(self,directions=[irange(0,3)]):
+        system = System.newRandom()
+        system.formExpectationAndNormalizationMultipliers()
+        for direction in directions:
+            stage1s = [system.formExpectationStage1(corner_id) for corner_id in range(4)]
+            system.contractTowards(direction)
+            for corner_id in range(4):
+                if corner_id in (direction,R(direction)):
+                    self.assertIsNot(system.formExpectationStage1(corner_id),stage1s[corner_id])
+                else:
+                    self.assertIs(system.formExpectationStage1(corner_id),stage1s[corner_id])
+            random_data = NDArrayData.newRandom(*system.state_center_data.shape)
+            for cached_multiplier, multiplier in zip(
+                system.formExpectationAndNormalizationMultipliers(),
+                formExpectationAndNormalizationMultipliers(system.corners,system.sides,system.operator_center_tensor)
+            ):
+                self.assertDataAlmostEqual(cached_multiplier(random_data),multiplier(random_data))
+    # }}}
+    @with_checker(number_of_calls=10) # test_formExpectationAndNormalizationMultipliers_sees_operator_center_changed_in_place {{{
+    def test_formExpectationAndNormalizationMultipliers_sees_operator_center_changed_in_place(self,directions=[irange(0,3)]):
+        system = System.newTrivialWithSimpleSparseOperator(O=NDArrayData.Z,OO_UD=(NDArrayData.X,NDArrayData.X),OO_LR=(NDArrayData.X,NDArrayData.X))
+        for direction in directions:
+            system.contractTowards(direction)
+        system.setStateCenter(NDArrayData.newRandom(*system.state_center_data.shape))
+        multipliers = system.formExpectationAndNormalizationMultipliers()
+        self.assertIs(system.formExpectationAndNormalizationMultipliers(),multipliers)
+        system.operator_center_tensor[OneSiteOperator(None)] = NDArrayData.X
+        random_data = NDArrayData.newRandom(*system.state_center_data.shape)
+        for cached_multiplier, multiplier in zip(
+            system.formExpectationAndNormalizationMultipliers(),
+            formExpectationAndNormalizationMultipliers(system.corners,system.sides,system.operator_center_tensor)
+        ):
+            self.assertDataAlmostEqual(cached_multiplier(random_data),multiplier(random_data))
+    # }}}
+    @with_checker(number_of_calls=10) # test_computeEstimatedOneSiteExpectation_leaves_system_alone {{{
+    def test_computeEstimatedOneSiteExpectation_leaves_system_alone(self,directions=[irange(0,3)],direction=irange(0,3)):
+        system = System.newTrivialWithSimpleSparseOperator(O=NDArrayData.Z,OO_UD=(NDArrayData.X,NDArrayData.X),OO_LR=(NDArrayData.X,NDArrayData.X))
+        for contraction_direction in directions:
+            system.minimizeExpectation()
+            system.contractTowards(contraction_direction)
+        system.minimizeExpectation()
+        multipliers = system.formExpectationAndNormalizationMultipliers()
+        expectation = system.computeExpectation()
+
+        contracted_system = copy(system)
+        contracted_system.contractTowards(direction)
+        self.assertAlmostEqual(system.computeEstimatedOneSiteExpectation(direction),contracted_system.computeExpectation()-expectation)
+
+        self.assertIs(system.formExpectationAndNormalizationMultipliers(),multipliers)
+        self.assertAlmostEqual(system.computeExpectation(),expectation)
+    # }}}
+    @with_checker(number_of_calls=10) # test_stackEnvironment {{{
+    def test_stackEnvironment(self,directions=[irange(0,3)]):
+        system = System.newTrivialWithSparseOperator(
+            Os=[NDArrayData.newRandomHermitian(2,2)],
+            OO_UDs=[(NDArrayData.newRandomHermitian(2,2),NDArrayData.newRandomHermitian(2,2))],
+            OO_LRs=[(NDArrayData.newRandomHermitian(2,2),NDArrayData.newRandomHermitian(2,2))],
+        )
+        stacked_system = copy(system)
+        stacked_system.stackEnvironment()
+        for direction in directions:
+            system.contractTowards(direction)
+            stacked_system.contractTowards(direction)
+        for corner_or_side in stacked_system.corners + stacked_system.sides:
+            self.assertIsInstance(corner_or_side,StackedSparseTensor)
+        self.assertAlmostEqual(stacked_system.computeExpectation(),system.computeExpectation())
+    # }}}
+    @with_checker(number_of_calls=10) # test_real_operator_uses_real_arithmetic {{{
+    def test_real_operator_uses_real_arithmetic(self,directions=[irange(0,3)]):
+        operators = dict(O=NDArrayData.Z,OO_UD=(NDArrayData.X,-NDArrayData.X),OO_LR=(NDArrayData.X,-NDArrayData.X))
+        real_system = System.newTrivialWithSimpleSparseOperator(**operators)
+        complex_system = System.newTrivialWithSimpleSparseOperator(dtype=complex128,**operators)
+        for direction in directions:
+            real_system.minimizeExpectation()
+            complex_system.setStateCenter(NDArrayData(real_system.state_center_data.toArray().astype(complex128)))
+            real_system.contractTowards(direction)
+            complex_system.contractTowards(direction)
+        for corner_or_side in real_system.corners + real_system.sides:
+            for data in corner_or_side.values():
+                self.assertFalse(numpy.iscomplexobj(data.toArray()))
+        self.assertFalse(numpy.iscomplexobj(real_system.state_center_data.toArray()))
+        self.assertAlmostEqual(real_system.computeExpectation(),complex_system.computeExpectation())
+    # }}}
+    def test_real_arithmetic_rejects_complex_operator(self): # {{{
+        self.assertRaises(ValueError,System.newTrivialWithSimpleSparseOperator,O=NDArrayData.Y,dtype=numpy.float64)
+    # }}}
+    @with_checker(number_of_calls=10) # test_setPrecision_casts_state_compressors {{{
+    def test_setPrecision_casts_state_compressors(self,corner_id=irange(0,3),direction=irange(0,1)):
+        system = System.newRandom(maximum_dimension=4)
+        dimension = system.corners[corner_id][Identity()].shape[3*direction]
+        system.compressCornerStateTowards(corner_id,direction,dimension)
+        single_dtype = changePrecisionOf(system.state_center_data.dtype,True)
+        system.setPrecision(True)
+        self.assertEqual(system.state_center_data.dtype,single_dtype)
+        for compressor in system.state_compressors.values():
+            self.assertEqual(compressor.dtype,single_dtype)
+    # }}}
+    @with_checker(number_of_calls=10) # test_formExpectationAndNormalizationMultipliers_diagonals {{{
+    def test_formExpectationAndNormalizationMultipliers_diagonals(self,moves=(irange(0,2),)*4):
+        system = System.newRandom()
+        directions = sum(([i]*moves[i] for i in range(4)),[])
+        shuffle(directions)
+        for direction in directions:
+            system.contractTowards(direction)
+
+        expectation_multiplier, normalization_multiplier = system.formExpectationAndNormalizationMultipliers()
+
+        self.assertDataAlmostEqual(expectation_multiplier.formDiagonal().ravel(),NDArrayData(expectation_multiplier.formMatrix().toArray().diagonal().copy()))
+        self.assertDataAlmostEqual(normalization_multiplier.formDiagonal().ravel(),NDArrayData(normalization_multiplier.formMatrix().toArray().diagonal().copy()))
+    # }}}
     @with_checker # test_formNormalizationMatrix {{{
     def test_formNormalizationMatrix(self):
         system = System.newRandom()
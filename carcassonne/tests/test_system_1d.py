@@ -1,5 +1,5 @@
 # Imports {{{
-from numpy import array, complex128, cos, sin, sqrt, zeros
+from numpy import array, complex128, cos, dot, identity, sin, sqrt, zeros
 from paycheck import *
 
 from . import *
@@ -59,6 +59,62 @@ class TestSystem1D(TestCase): # {{{
             )
         self.assertAlmostEqual(system.computeOneSiteExpectation(),abs(field_strength))
     # }}}
+    @with_checker # test_computeExpectations_all_up {{{
+    def test_computeExpectations_all_up(self,phase=float,field_strength=float):
+        system = \
+            System(
+                [1,0,0],
+                [0,0,1],
+                buildTensor((3,3,2,2),{
+                    (0,0): Pauli.I,
+                    (0,1): field_strength*Pauli.Z,
+                    (1,2): Pauli.Z,
+                    (2,2): Pauli.I,
+                }),
+                array([[[cos(phase)+1j*sin(phase),0]]]),
+            )
+        expectations = system.computeExpectations(Os=[Pauli.Z,Pauli.X],OOs=[(Pauli.Z,Pauli.Z),(Pauli.X,Pauli.Z)])
+        self.assertEqual(len(expectations),4)
+        for expectation, correct_expectation in zip(expectations,[1,0,1,0]):
+            self.assertAlmostEqual(expectation,correct_expectation)
+    # }}}
+    @with_checker(number_of_calls=10) # test_computeExpectations_random_state {{{
+    def test_computeExpectations_random_state(self,physical_dimension=irange(2,3)):
+        # Each expectation is compared with the one formed by a system whose
+        # operator has the single channel given by the operator;  for a pair,
+        # its right operator is first absorbed into the right environment.
+        state_dimension = 3
+        A, B = [NDArrayData.newRandomHermitian(physical_dimension,physical_dimension).toArray() for _ in range(2)]
+        Os = [A,B]
+        OOs = [(A,B),(B,A)]
+        state_center_data = crand(state_dimension,state_dimension,physical_dimension)
+        environments = []
+        for _ in range(2):
+            environment = crand(state_dimension,state_dimension)
+            environments.append(NDArrayData(dot(environment,environment.conj().transpose()).reshape(1,state_dimension,state_dimension)))
+        def makeSystem(O):
+            system = System([1],[1],O.reshape((1,1)+O.shape),state_center_data)
+            system.right_environment, system.left_environment = environments
+            return system
+        def computeUnnormalizedExpectation(system):
+            return system.computeScalarUsingMultiplier(system.formExpectationMultiplier())
+
+        expectations = makeSystem(identity(physical_dimension)).computeExpectations(Os=Os,OOs=OOs)
+        self.assertEqual(len(expectations),len(Os)+len(OOs))
+
+        normalization = computeUnnormalizedExpectation(makeSystem(identity(physical_dimension)))
+        for O, expectation in zip(Os,expectations[:len(Os)]):
+            self.assertAlmostEqual(expectation,computeUnnormalizedExpectation(makeSystem(O))/normalization)
+
+        system = makeSystem(identity(physical_dimension))
+        system.contractTowards(0)
+        normalization = computeUnnormalizedExpectation(system)
+        for (O_L,O_R), expectation in zip(OOs,expectations[len(Os):]):
+            system = makeSystem(O_R)
+            system.contractTowards(0)
+            system.operator_center_data = NDArrayData(O_L.reshape((1,1)+O_L.shape))
+            self.assertAlmostEqual(expectation,computeUnnormalizedExpectation(system)/normalization)
+    # }}}
     @with_checker # test_increaseBandwidth {{{
     def test_increaseBandwidth(self,
         operator_dimension=irange(1,5),
@@ -77,6 +133,25 @@ class TestSystem1D(TestCase): # {{{
 
         self.assertAlmostEqual(system1.computeExpectation(),system2.computeExpectation())
     # }}}
+    @with_checker # test_setPrecision {{{
+    def test_setPrecision(self,
+        operator_dimension=irange(1,3),
+        state_dimension=irange(1,3),
+        physical_dimension=irange(2,3),
+    ):
+        system = System.newRandom(operator_dimension,state_dimension,physical_dimension)
+        system.contractTowards(0)
+        expectation = system.computeExpectation()
+        double_dtype = system.state_center_data.dtype
+        system.setPrecision(True)
+        self.assertEqual(system.state_center_data.dtype,changePrecisionOf(double_dtype,True))
+        self.assertEqual(system.right_environment.dtype,changePrecisionOf(double_dtype,True))
+        self.assertAlmostEqual(system.computeExpectation()/expectation,1,places=3)
+        system.setPrecision(False)
+        self.assertEqual(system.state_center_data.dtype,double_dtype)
+        system.contractTowards(1)
+        system.minimizeExpectation()
+    # }}}
 # }}}
 
 # }}}
@@ -19,4 +19,16 @@ class TestFormExpectationMultiplier(TestCase): # {{{
         matrix = multiply.formMatrix()
         self.assertDataAlmostEqual(multiply(state_center_data),matrix.contractWith(state_center_data.ravel(),1,0).split(ls,rs,p))
     # }}}
+    @with_checker # test_formDiagonal_same_as_formMatrix {{{
+    def test_formDiagonal_same_as_formMatrix(self,
+        lo=irange(1,5),ro=irange(1,5),
+        ls=irange(1,5),rs=irange(1,5),
+        p=irange(1,5)
+    ):
+        left_environment = NDArrayData.newRandom(lo,ls,ls)
+        right_environment = NDArrayData.newRandom(ro,rs,rs)
+        operator_center_data = NDArrayData.newRandom(lo,ro,p,p)
+        multiply = formExpectationMultiplier(left_environment,right_environment,operator_center_data)
+        self.assertDataAlmostEqual(multiply.formDiagonal().ravel(),NDArrayData(multiply.formMatrix().toArray().diagonal().copy()))
+    # }}}
 # }}}
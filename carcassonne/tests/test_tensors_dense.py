@@ -184,4 +184,50 @@ class TestDenseStages(TestCase): # {{{
             return
         self.assertDataAlmostEqual(E1,E2)
     # }}}
+    @with_checker(number_of_calls=10) # test_batched_stage_3 {{{
+    def test_batched_stage_3(self,
+        a = irange(1,3),
+        b = irange(1,3),
+        c = irange(1,3),
+        d = irange(1,3),
+        e = irange(1,3),
+        f = irange(1,3),
+        g = irange(1,3),
+        number_of_operators = irange(1,3),
+        number_of_terms_per_operator = irange(1,3),
+    ):
+        terms = [
+            (NDArrayData.newRandom(g,g),[NDArrayData.newRandom(a,b,c,d,c,d) for _ in range(number_of_terms_per_operator)])
+            for _ in range(number_of_operators)
+        ]
+        B = NDArrayData.newRandom(b,a,e,f,e,f)
+        D = NDArrayData.newRandom(c,d,e,f,g)
+        multiplier = formBatchedDenseStage3(B,terms)
+        E1 = multiplier(D)
+        E2 = D.newZeros(D.shape,dtype=D.dtype)
+        M = NDArrayData.newZeros(multiplier.shape,dtype=D.dtype)
+        for C, As in terms:
+            for A in As:
+                E2 += formDenseStage3(A,B,C)(D)
+                M += formDenseStage3(A,B,C).formMatrix()
+        self.assertDataAlmostEqual(E1,E2)
+        self.assertDataAlmostEqual(multiplier.formMatrix(),M)
+        self.assertDataAlmostEqual(multiplier.formDiagonal().ravel(),NDArrayData(M.toArray().diagonal().copy()))
+    # }}}
+    @with_checker # test_stage_3_diagonal {{{
+    def test_stage_3_diagonal(self,
+        a = irange(1,5),
+        b = irange(1,5),
+        c = irange(1,5),
+        d = irange(1,5),
+        e = irange(1,5),
+        f = irange(1,5),
+        g = irange(1,5),
+    ):
+        A = NDArrayData.newRandom(a,b,c,d,c,d)
+        B = NDArrayData.newRandom(b,a,e,f,e,f)
+        C = NDArrayData.newRandom(g,g)
+        multiplier = formDenseStage3(A,B,C)
+        self.assertDataAlmostEqual(multiplier.formDiagonal().ravel(),NDArrayData(multiplier.formMatrix().toArray().diagonal().copy()))
+    # }}}
 # }}}
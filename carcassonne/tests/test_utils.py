@@ -1,11 +1,12 @@
 # Imports {{{
 from functools import reduce
-from numpy import dot, multiply, prod
+from numpy import complex128, dot, identity, multiply, prod, zeros
 from paycheck import *
 from scipy.linalg import eigh, eigvalsh
 from scipy.sparse.linalg import eigs, eigsh
 
 from ..data import NDArrayData
+from ..data.cost_tracker import computeCostOfContracting, computePeakMemoryOfContracting
 from ..utils import *
 from . import *
 # }}}
@@ -774,8 +775,350 @@ class TestFormDataContractor(TestCase): # {{{
             )(A,B)
         )
     # }}}
+    @with_checker
+    def test_matrix_multiplication_many_matrices_with_planned_order(self, number_of_matrices=irange(1,12)): # {{{
+        dimensions = [randint(1,10) for _ in range(number_of_matrices+1)]
+        matrices = [NDArrayData.newRandom(*(dimensions[i],dimensions[i+1])) for i in range(number_of_matrices)]
+        correct_value = reduce(dot,[matrix.toArray() for matrix in matrices])
+        joins = [Join(i,1,i+1,0) for i in range(number_of_matrices-1)]
+        shuffle(joins)
+        contraction = formDataContractor(joins,[[(0,0)],[(number_of_matrices-1,1)]],tensor_shapes=[matrix.shape for matrix in matrices])(*matrices)
+        self.assertAllClose(
+            correct_value,
+            contraction.toArray()
+        )
+    # }}}
+    @with_checker(number_of_calls=10)
+    def test_triangle_with_planned_order(self, # {{{
+        a = irange(1,10),
+        b = irange(1,10),
+        c = irange(1,10),
+        d = irange(1,10),
+        e = irange(1,10),
+        f = irange(1,10),
+    ):
+        A = NDArrayData.newRandom(a,e,b)
+        B = NDArrayData.newRandom(c,b,f)
+        C = NDArrayData.newRandom(d,a,c)
+        self.assertDataAlmostEqual(
+            A.contractWith(B,[2],[1]).contractWith(C,[0,2],[1,2]),
+            formDataContractor(
+                [
+                    Join(0,0,2,1),
+                    Join(0,2,1,1),
+                    Join(1,0,2,2),
+                ],
+                [
+                    [(0,1)],
+                    [(1,2)],
+                    [(2,0)],
+                ],
+                tensor_shapes=[A.shape,B.shape,C.shape]
+            )(A,B,C)
+        )
+    # }}}
+    @with_checker
+    def test_triangle_with_out_and_workspace(self, # {{{
+        a = irange(1,10),
+        b = irange(1,10),
+        c = irange(1,10),
+        d = irange(1,10),
+        e = irange(1,10),
+        f = irange(1,10),
+        accumulate = choiceof((False,True)),
+    ):
+        A = NDArrayData.newRandom(a,e,b)
+        B = NDArrayData.newRandom(c,b,f)
+        C = NDArrayData.newRandom(d,a,c)
+        contractor = formDataContractor(
+            [
+                Join(0,0,2,1),
+                Join(0,2,1,1),
+                Join(1,0,2,2),
+            ],
+            [
+                [(2,0),(0,1)],
+                [(1,2)],
+            ],
+            tensor_shapes=[A.shape,B.shape,C.shape]
+        )
+        correct_result = A.contractWith(B,[2],[1]).contractWith(C,[0,2],[1,2]).transpose([2,0,1]).join([0,1],2)
+        out = NDArrayData.newRandom(d*e,f)
+        initial = copy(out)
+        workspace = {}
+        for _ in range(2):
+            self.assertIs(contractor(A,B,C,out=out,accumulate=accumulate,workspace=workspace),out)
+            self.assertDataAlmostEqual(contractor(A,B,C,workspace=workspace),correct_result)
+        self.assertDataAlmostEqual(out,correct_result*2+initial if accumulate else correct_result)
+    # }}}
+    @with_checker
+    def test_matrix_multiplication_many_matrices_with_einsum(self, number_of_matrices=irange(1,12)): # {{{
+        dimensions = [randint(1,10) for _ in range(number_of_matrices+1)]
+        matrices = [NDArrayData.newRandom(*(dimensions[i],dimensions[i+1])) for i in range(number_of_matrices)]
+        correct_value = reduce(dot,[matrix.toArray() for matrix in matrices])
+        joins = [Join(i,1,i+1,0) for i in range(number_of_matrices-1)]
+        shuffle(joins)
+        contraction = formDataContractor(joins,[[(0,0)],[(number_of_matrices-1,1)]],backend="einsum")(*matrices)
+        self.assertAllClose(
+            correct_value,
+            contraction.toArray()
+        )
+    # }}}
+    @with_checker(number_of_calls=10)
+    def test_triangle_with_einsum(self, # {{{
+        a = irange(1,10),
+        b = irange(1,10),
+        c = irange(1,10),
+        d = irange(1,10),
+        e = irange(1,10),
+        f = irange(1,10),
+    ):
+        A = NDArrayData.newRandom(a,e,b)
+        B = NDArrayData.newRandom(c,b,f)
+        C = NDArrayData.newRandom(d,a,c)
+        joins = lambda: [
+            Join(0,0,2,1),
+            Join(0,2,1,1),
+            Join(1,0,2,2),
+        ]
+        final_groups = lambda: [
+            [(2,0),(0,1)],
+            [(1,2)],
+        ]
+        contractor = formDataContractor(joins(),final_groups(),tensor_shapes=[A.shape,B.shape,C.shape],backend="einsum")
+        self.assertDataAlmostEqual(formDataContractor(joins(),final_groups())(A,B,C),contractor(A,B,C))
+        self.assertEqual(
+            computeCostOfContracting(contractor,A,B,C),
+            computeCostOfContracting(formDataContractor(joins(),final_groups(),tensor_shapes=[A.shape,B.shape,C.shape]),A,B,C)
+        )
+    # }}}
+    @with_checker(number_of_calls=10)
+    def test_outer_product_with_einsum(self,number_of_tensors=irange(1,4)): # {{{
+        tensors = [NDArrayData.newRandom(randint(1,5)) for _ in range(number_of_tensors)]
+        final_groups = lambda: [[(tensor_number,0)] for tensor_number in reversed(range(number_of_tensors))]
+        self.assertDataAlmostEqual(
+            formDataContractor([],final_groups())(*tensors),
+            formDataContractor([],final_groups(),backend="einsum")(*tensors)
+        )
+    # }}}
+    @with_checker(number_of_calls=20)
+    def test_triangle_batched(self, # {{{
+        batch_size = irange(1,5),
+        batched_tensors = (choiceof((False,True)),)*3,
+        backend = choiceof(("einsum","tensordot")),
+    ):
+        batched_tensors = [tensor_number for tensor_number in range(3) if batched_tensors[tensor_number]]
+        shapes = [(2,3,4),(5,4,3),(6,2,5)]
+        tensors = [NDArrayData.newRandom(*(((batch_size,) if tensor_number in batched_tensors else ())+shape)) for tensor_number, shape in enumerate(shapes)]
+        joins = lambda: [
+            Join(0,0,2,1),
+            Join(0,2,1,1),
+            Join(1,0,2,2),
+        ]
+        final_groups = lambda: [
+            [(2,0),(0,1)],
+            [(1,2)],
+        ]
+        contract = formDataContractor(joins(),final_groups())
+        if not batched_tensors:
+            self.assertDataAlmostEqual(formDataContractor(joins(),final_groups(),backend=backend)(*tensors),contract(*tensors))
+            return
+        results = formDataContractor(joins(),final_groups(),batched_tensors=batched_tensors,backend=backend)(*tensors)
+        self.assertEqual(results.shape,(batch_size,18,3))
+        for index in range(batch_size):
+            self.assertDataAlmostEqual(results[index],contract(*(tensor[index] if tensor_number in batched_tensors else tensor for tensor_number, tensor in enumerate(tensors))))
+        if len(batched_tensors) > 1:
+            self.assertDataAlmostEqual(
+                formDataContractor(joins(),final_groups(),batched_tensors=batched_tensors,sum_over_batch=True,backend=backend)(*tensors),
+                sum((results[index] for index in range(1,batch_size)),results[0])
+            )
+    # }}}
+    def test_unknown_backend_detected(self): # {{{
+        try:
+            formDataContractor([Join(0,1,1,0)],[[(0,0)],[(1,1)]],backend="magic")
+            self.fail("exception was not thrown")
+        except ValueError:
+            pass
+    # }}}
+    def test_bad_shape_specification_detected(self): # {{{
+        try:
+            formDataContractor([Join(0,1,1,0)],[[(0,0)],[(1,1)]],tensor_shapes=[(1,2),(2,3,4)])
+            self.fail("exception was not thrown")
+        except ValueError:
+            pass
+    # }}}
 # }}}
 
+class TestComputeRandomizedEigenvectors(TestCase): # {{{
+    @with_checker
+    def test_low_rank(self,n=irange(1,30),k=irange(1,10),rank=irange(1,10),columns=choiceof((False,True))): # {{{
+        k = min(k,n)
+        rank = min(rank,k)
+        factor = crand(rank,n)
+        matrix = dot(factor.transpose().conj(),factor)
+        multiply = lambda v: dot(matrix,v)
+        multiplier = Multiplier((n,n),multiply,n*n,lambda: matrix,0,multiplyColumns=multiply if columns else None)
+        evals, evecs = computeRandomizedEigenvectors(multiplier,k,matrix.dtype)
+        correct_evals = eigvalsh(matrix)[-k:]
+        self.assertAllClose(evals,correct_evals)
+        self.assertAllClose(dot(matrix,evecs),evecs*evals)
+        self.assertAllClose(dot(evecs.transpose().conj(),evecs),identity(k))
+    # }}}
+# }}}
+
+class TestComputeCheapestJoinOrder(TestCase): # {{{
+    @with_checker
+    def test_matrix_multiplication_three_matrices(self, # {{{
+        a=irange(1,10),
+        b=irange(1,10),
+        c=irange(1,10),
+        d=irange(1,10),
+    ):
+        joins = [Join(0,1,1,0),Join(1,1,2,0)]
+        contractor = formDataContractor(joins,[[(0,0)],[(2,1)]],tensor_shapes=[(a,b),(b,c),(c,d)])
+        self.assertEqual(
+            computeCostOfContracting(contractor,(a,b),(b,c),(c,d)),
+            min(a*b*c+a*c*d,b*c*d+a*b*d)
+        )
+    # }}}
+    @with_checker
+    def test_never_worse_than_given_order(self, number_of_matrices=irange(1,10)): # {{{
+        dimensions = [randint(1,20) for _ in range(number_of_matrices+1)]
+        shapes = [(dimensions[i],dimensions[i+1]) for i in range(number_of_matrices)]
+        formJoins = lambda: [Join(i,1,i+1,0) for i in range(number_of_matrices-1)]
+        final_groups = lambda: [[(0,0)],[(number_of_matrices-1,1)]]
+        self.assertLessEqual(
+            computeCostOfContracting(formDataContractor(formJoins(),final_groups(),tensor_shapes=shapes),*shapes),
+            computeCostOfContracting(formDataContractor(formJoins(),final_groups()),*shapes)
+        )
+    # }}}
+    @with_checker
+    def test_greedy_search_contracts_everything(self, number_of_matrices=irange(1,10)): # {{{
+        dimensions = [randint(1,20) for _ in range(number_of_matrices+1)]
+        shapes = [(dimensions[i],dimensions[i+1]) for i in range(number_of_matrices)]
+        joins = [Join(i,1,i+1,0) for i in range(number_of_matrices-1)]
+        ordered_joins = computeCheapestJoinOrder(joins,shapes,maximum_number_of_tensors_for_exhaustive_search=0)
+        self.assertEqual(set(map(id,joins)),set(map(id,ordered_joins)))
+    # }}}
+    @with_checker
+    def test_peak_memory_within_budget(self, number_of_matrices=irange(2,8)): # {{{
+        dimensions = [randint(1,20) for _ in range(number_of_matrices+1)]
+        shapes = [(dimensions[i],dimensions[i+1]) for i in range(number_of_matrices)]
+        formJoins = lambda: [Join(i,1,i+1,0) for i in range(number_of_matrices-1)]
+        final_groups = lambda: [[(0,0)],[(number_of_matrices-1,1)]]
+        cheapest_contractor = formDataContractor(formJoins(),final_groups(),tensor_shapes=shapes)
+        smallest_contractor = formDataContractor(formJoins(),final_groups(),tensor_shapes=shapes,maximum_peak_memory=1)
+        smallest_peak = computePeakMemoryOfContracting(smallest_contractor,*shapes)
+        cheapest_peak = computePeakMemoryOfContracting(cheapest_contractor,*shapes)
+        self.assertLessEqual(smallest_peak,cheapest_peak)
+        maximum_peak_memory = randint(smallest_peak,cheapest_peak)
+        contractor = formDataContractor(formJoins(),final_groups(),tensor_shapes=shapes,maximum_peak_memory=maximum_peak_memory)
+        self.assertLessEqual(computePeakMemoryOfContracting(contractor,*shapes),maximum_peak_memory)
+        self.assertGreaterEqual(
+            computeCostOfContracting(contractor,*shapes),
+            computeCostOfContracting(cheapest_contractor,*shapes)
+        )
+        matrices = [NDArrayData.newRandom(*shape) for shape in shapes]
+        self.assertDataAlmostEqual(contractor(*matrices),cheapest_contractor(*matrices))
+    # }}}
+# }}}
+
+class TestPlannedDataContractor(TestCase): # {{{
+    @with_checker
+    def test_same_as_unplanned(self, number_of_matrices=irange(1,6)): # {{{
+        dimensions = [randint(1,10) for _ in range(number_of_matrices+1)]
+        matrices = [NDArrayData.newRandom(*(dimensions[i],dimensions[i+1])) for i in range(number_of_matrices)]
+        formJoins = lambda: [Join(i,1,i+1,0) for i in range(number_of_matrices-1)]
+        final_groups = lambda: [[(0,0)],[(number_of_matrices-1,1)]]
+        self.assertDataAlmostEqual(
+            formDataContractor(formJoins(),final_groups())(*matrices),
+            PlannedDataContractor(formJoins(),final_groups(),cache=DataContractorPlanCache())(*matrices),
+        )
+    # }}}
+    @with_checker(number_of_calls=10)
+    def test_plans_cached_by_shape(self, m=irange(1,10), n=irange(1,10), o=irange(11,20)): # {{{
+        cache = DataContractorPlanCache()
+        contractor = PlannedDataContractor([Join(0,1,1,0)],[[(0,0)],[(1,1)]],cache=cache)
+        contractor(NDArrayData.newRandom(m,n),NDArrayData.newRandom(n,m))
+        contractor(NDArrayData.newRandom(m,n),NDArrayData.newRandom(n,m))
+        self.assertEqual((cache.hits,cache.misses),(1,1))
+        contractor(NDArrayData.newRandom(m,o),NDArrayData.newRandom(o,m))
+        self.assertEqual((cache.hits,cache.misses),(1,2))
+        self.assertEqual(len(cache),2)
+    # }}}
+    def test_least_recently_used_plan_evicted(self): # {{{
+        cache = DataContractorPlanCache(maximum_size=2)
+        contractor = PlannedDataContractor([Join(0,1,1,0)],[[(0,0)],[(1,1)]],cache=cache)
+        for n in (1,2,1,3,1):
+            contractor(NDArrayData.newRandom(n,n),NDArrayData.newRandom(n,n))
+        self.assertEqual((cache.hits,cache.misses),(2,3))
+        self.assertEqual(set(key[1] for key in cache.plans),{((1,1),(1,1)),((3,3),(3,3))})
+    # }}}
+    def test_unexpected_tensor_rank_detected(self): # {{{
+        contractor = PlannedDataContractor([Join(0,1,1,0)],[[(0,0)],[(1,1)]],cache=DataContractorPlanCache())
+        try:
+            contractor(NDArrayData.newRandom(2,2),NDArrayData.newRandom(2,2,2))
+            self.fail("exception was not thrown")
+        except UnexpectedTensorRankError as e:
+            self.assertEqual(e.tensor_number,1)
+    # }}}
+# }}}
+
+class TestNormalizationSolver(TestCase): # {{{
+    def formMultiplier(self,matrix,matrix_free): # {{{
+        # The costs are chosen so that the matrix is formed exactly when
+        # matrix_free is not set.
+        m, n = matrix.shape
+        return Multiplier(
+            matrix.shape,
+            lambda v: matrix.matvecWith(v),
+            1 if matrix_free else m*n*m*n,
+            lambda: matrix,
+            m*n*m*n if matrix_free else 0,
+            lambda: NDArrayData(matrix.toArray().diagonal().copy()),
+            m
+        )
+    # }}}
+    def formPositiveDefiniteMatrix(self,N): # {{{
+        matrix = NDArrayData.newRandomHermitian(N,N)
+        matrix += -2*NDArrayData.newIdentity(N)*eigvalsh(matrix.toArray())[0]
+        return matrix
+    # }}}
+    @with_checker # test_applyInverse {{{
+    def test_applyInverse(self,N=irange(3,20),matrix_free=choiceof((False,True))):
+        matrix = self.formPositiveDefiniteMatrix(N)
+        solver = NormalizationSolver()
+        solver.prepare(self.formMultiplier(matrix,matrix_free),10,True,True,(N,),NDArrayData,matrix.toArray().dtype)
+        self.assertEqual(solver.factorization is None,matrix_free)
+        vector = NDArrayData.newRandom(N).toArray()
+        self.assertDataAlmostEqual(NDArrayData(dot(matrix.toArray(),solver.applyInverse(vector))),NDArrayData(vector),rtol=1e-4,atol=1e-4)
+        self.assertDataAlmostEqual(NDArrayData(solver.multiplyNormalization(vector)),NDArrayData(dot(matrix.toArray(),vector)))
+    # }}}
+    @with_checker # test_factorization_cached_until_dependencies_change {{{
+    def test_factorization_cached_until_dependencies_change(self,N=irange(3,20)):
+        matrix = self.formPositiveDefiniteMatrix(N)
+        expectation_matrix = NDArrayData.newRandomHermitian(N,N)
+        dependencies = [object(), object()]
+        solver = NormalizationSolver()
+        for _ in range(3):
+            solver.dependOn(dependencies)
+            relaxOver(NDArrayData.newRandom(N).normalized(),Multiplier.fromMatrix(expectation_matrix),self.formMultiplier(matrix,False),eigensolver=LanczosEigensolver(),normalization_solver=solver)
+        self.assertEqual(solver.number_of_factorizations,1)
+        dependencies[1] = object()
+        solver.dependOn(dependencies)
+        self.assertIsNone(solver.factorization)
+        self.assertIsNone(solver.matrix)
+    # }}}
+    @with_checker # test_factorization_not_cached_without_dependencies {{{
+    def test_factorization_not_cached_without_dependencies(self,N=irange(3,20)):
+        matrix = self.formPositiveDefiniteMatrix(N)
+        expectation_matrix = NDArrayData.newRandomHermitian(N,N)
+        solver = NormalizationSolver()
+        for _ in range(3):
+            relaxOver(NDArrayData.newRandom(N).normalized(),Multiplier.fromMatrix(expectation_matrix),self.formMultiplier(matrix,False),eigensolver=LanczosEigensolver(),normalization_solver=solver)
+        self.assertEqual(solver.number_of_factorizations,3)
+    # }}}
+# }}}
 class TestNormalize(TestCase): # {{{
     @with_checker # test_correctness {{{
     def test_correctness(self,number_of_dimensions=irange(2,4),size=irange(2,5)):
@@ -876,4 +1219,83 @@ class TestRelaxOver(TestCase): # {{{
         new_val = new_vec.conj().contractWith(matrix.contractWith(new_vec,(1,),(0,)),(0,),(0,)).extractScalar().real
         self.assertLess(new_val,old_val)
     # }}}
+    def formMatrixFreeMultiplier(self,matrix): # {{{
+        m, n = matrix.shape
+        return Multiplier(
+            matrix.shape,
+            lambda v: matrix.matvecWith(v),
+            1,
+            lambda: matrix,
+            m*n*m*n,
+            lambda: NDArrayData(matrix.toArray().diagonal().copy()),
+            m
+        )
+    # }}}
+    def checkEigensolverOnGeneralizedProblem(self,eigensolver,N,matrix_free): # {{{
+        matrix1 = NDArrayData.newRandomHermitian(N,N)
+        matrix2 = NDArrayData.newRandomHermitian(N,N)
+        matrix2 += -2*NDArrayData.newIdentity(N)*eigvalsh(matrix2.toArray())[0]
+        formMultiplier = self.formMatrixFreeMultiplier if matrix_free else Multiplier.fromMatrix
+        new_vec = relaxOver(NDArrayData.newRandom(N).normalized(),formMultiplier(matrix1),formMultiplier(matrix2),maximum_number_of_multiplications=10*N,tolerance=1e-12,eigensolver=eigensolver)
+        new_val = new_vec.conj().contractWith(matrix1.contractWith(new_vec,(1,),(0,)),(0,),(0,)).extractScalar().real/new_vec.conj().contractWith(matrix2.contractWith(new_vec,(1,),(0,)),(0,),(0,)).extractScalar().real
+        self.assertAlmostEqual(new_val,eigvalsh(matrix1.toArray(),matrix2.toArray())[0],5)
+        self.assertEqual(eigensolver.number_of_calls,1)
+        self.assertGreater(eigensolver.number_of_multiplications,0)
+        self.assertEqual(eigensolver.total_number_of_multiplications,eigensolver.number_of_multiplications)
+    # }}}
+    def checkEigensolverOnStandardProblem(self,eigensolver,N,matrix_free): # {{{
+        matrix = NDArrayData.newRandomHermitian(N,N)
+        formMultiplier = self.formMatrixFreeMultiplier if matrix_free else Multiplier.fromMatrix
+        new_vec = relaxOver(NDArrayData.newRandom(N).normalized(),formMultiplier(matrix),maximum_number_of_multiplications=10*N,tolerance=1e-12,eigensolver=eigensolver)
+        new_val = new_vec.conj().contractWith(matrix.contractWith(new_vec,(1,),(0,)),(0,),(0,)).extractScalar().real
+        self.assertAlmostEqual(new_val,eigvalsh(matrix.toArray())[0],5)
+        self.assertEqual(eigensolver.number_of_calls,1)
+        self.assertGreater(eigensolver.number_of_multiplications,0)
+    # }}}
+    @with_checker # test_relaxOver_Davidson_generalized {{{
+    def test_relaxOver_Davidson_generalized(self,N=irange(3,30),matrix_free=choiceof((False,True))):
+        self.checkEigensolverOnGeneralizedProblem(DavidsonEigensolver(maximum_dimension=8,number_of_kept_vectors=3),N,matrix_free)
+    # }}}
+    @with_checker # test_relaxOver_Davidson_standard {{{
+    def test_relaxOver_Davidson_standard(self,N=irange(3,30),matrix_free=choiceof((False,True))):
+        self.checkEigensolverOnStandardProblem(DavidsonEigensolver(maximum_dimension=8,number_of_kept_vectors=3),N,matrix_free)
+    # }}}
+    @with_checker # test_relaxOver_Lanczos_generalized {{{
+    def test_relaxOver_Lanczos_generalized(self,N=irange(3,30),matrix_free=choiceof((False,True))):
+        self.checkEigensolverOnGeneralizedProblem(LanczosEigensolver(maximum_dimension=8,number_of_kept_vectors=3),N,matrix_free)
+    # }}}
+    @with_checker # test_relaxOver_Lanczos_standard {{{
+    def test_relaxOver_Lanczos_standard(self,N=irange(3,30),matrix_free=choiceof((False,True))):
+        self.checkEigensolverOnStandardProblem(LanczosEigensolver(maximum_dimension=8,number_of_kept_vectors=3),N,matrix_free)
+    # }}}
+    @with_checker # test_relaxOver_warm_start {{{
+    def test_relaxOver_warm_start(self,N=irange(10,30),eigensolver_class=choiceof((DavidsonEigensolver,LanczosEigensolver))):
+        matrix = NDArrayData.newRandomHermitian(N,N)
+        eigensolver = eigensolver_class(maximum_dimension=8,number_of_kept_vectors=3)
+        vector, subspace = relaxOver(NDArrayData.newRandom(N).normalized(),Multiplier.fromMatrix(matrix),maximum_number_of_multiplications=10*N,tolerance=1e-12,eigensolver=eigensolver,return_subspace=True)
+        self.assertEqual(len(subspace),2)
+        for subspace_vector in subspace:
+            self.assertEqual(subspace_vector.shape,vector.shape)
+        cold_number_of_multiplications = eigensolver.number_of_multiplications
+        relaxOver(vector,Multiplier.fromMatrix(matrix),maximum_number_of_multiplications=10*N,tolerance=1e-12,eigensolver=eigensolver,initial_subspace=subspace)
+        self.assertLessEqual(eigensolver.number_of_multiplications,min(cold_number_of_multiplications,3))
+    # }}}
+    @with_checker # test_subspace_eigensolver_rejects_initial_vector_in_kernel_of_normalization {{{
+    def test_subspace_eigensolver_rejects_initial_vector_in_kernel_of_normalization(self,N=irange(3,10),eigensolver_class=choiceof((DavidsonEigensolver,LanczosEigensolver))):
+        expectation_matrix = NDArrayData.newRandomHermitian(N,N).toArray()
+        normalization_matrix = identity(N)
+        normalization_matrix[0,0] = 0
+        initial = zeros(N,dtype=complex128)
+        initial[0] = 1
+        self.assertRaises(
+            RelaxFailed,
+            eigensolver_class().solve,
+            initial,
+            lambda v: dot(expectation_matrix,v),
+            lambda v: dot(normalization_matrix,v),
+            lambda v: v,
+            1e-12,
+            10*N
+        )
+    # }}}
 # }}}
@@ -1,14 +1,22 @@
 # Imports {{{
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from copy import copy
 from functools import partial, reduce
-from numpy import argmax, argmin, array, complex128, dot, identity, multiply, prod, sqrt, set_printoptions, tensordot, trace, zeros
+from itertools import count
+from string import ascii_letters
+from numpy import argmax, argmin, array, complex64, complex128, complexfloating, dot, float32, float64, floating, identity, iscomplexobj, issubdtype, multiply, prod, result_type, sqrt, set_printoptions, tensordot, trace, zeros
 from numpy.random import rand, random_sample
-from scipy.linalg import LinAlgError, eig, eigh, eigvals, lu_factor, lu_solve, norm, svd, qr
-from scipy.sparse.linalg import LinearOperator, eigs, eigsh, gmres
+from scipy.linalg import LinAlgError, cho_factor, cho_solve, eig, eigh, eigvals, lu_factor, lu_solve, norm, svd, qr
+from scipy.sparse.linalg import LinearOperator, cg, eigs, eigsh, gmres
 # }}}
 
 set_printoptions(linewidth=132)
 
+# Logging {{{
+import logging
+log = logging.getLogger(__name__)
+# }}}
+
 # Exceptions {{{
 class DimensionMismatchError(ValueError): # {{{
     def __init__(self,left_tensor_number,left_index,left_dimension,right_tensor_number,right_index,right_dimension): # {{{
@@ -31,6 +39,29 @@ class RelaxFailed(Exception): # {{{
     def __repr__(self):
         return "RelaxFailed({},{})".format(self.initial_value,self.final_value)
 # }}}
+class InitialVectorRejected(RelaxFailed): # {{{
+    # Raised when the initial vector has no length under the normalization,
+    # which leaves nothing to start the subspace from;  as it is a
+    # RelaxFailed the sweep skips the optimization in the iteration where it
+    # happened.
+    def __init__(self):
+        pass
+    def __str__(self):
+        return "the initial vector has no length under the normalization"
+    def __repr__(self):
+        return "InitialVectorRejected()"
+# }}}
+class NormalizationInverseFailed(RelaxFailed): # {{{
+    # Raised when neither conjugate gradients nor gmres converge when applying
+    # the inverse of the normalization;  as it is a RelaxFailed the sweep
+    # skips the optimization in the iteration where it happened.
+    def __init__(self,info):
+        self.info = info
+    def __str__(self):
+        return "unable to apply the inverse of the normalization (gmres returned info = {})".format(self.info)
+    def __repr__(self):
+        return "NormalizationInverseFailed({})".format(self.info)
+# }}}
 class UnexpectedTensorRankError(ValueError): # {{{
     def __init__(self,tensor_number,expected_rank,actual_rank): # {{{
         self.tensor_number = tensor_number
@@ -42,6 +73,181 @@ class UnexpectedTensorRankError(ValueError): # {{{
 # }}}
 
 # Classes {{{
+class Eigensolver: # {{{
+    # Subclasses implement solve, which is given functions that apply the
+    # expectation operator, the normalization operator, and the inverse of the
+    # latter to flattened arrays (the last only when uses_inverse_normalization
+    # is set), and returns the initial value, the final value, the final
+    # vector, and a (possibly empty) list of the next lowest Ritz vectors that
+    # can be passed back in as the initial subspace of a later call.
+    uses_diagonals = False
+    uses_inverse_normalization = False
+    def __init__(self): # {{{
+        self.number_of_calls = 0
+        self.number_of_multiplications = 0
+        self.total_number_of_multiplications = 0
+    # }}}
+    def recordCall(self,number_of_multiplications): # {{{
+        self.number_of_calls += 1
+        self.number_of_multiplications = number_of_multiplications
+        self.total_number_of_multiplications += number_of_multiplications
+    # }}}
+# }}}
+class SubspaceEigensolver(Eigensolver): # {{{
+    # Rayleigh-Ritz in a subspace whose basis is kept orthonormal with respect
+    # to the normalization, so that the projected problem is a standard
+    # Hermitian one;  subclasses differ only in how the subspace is expanded.
+    def __init__(self,maximum_dimension=20,number_of_kept_vectors=4): # {{{
+        Eigensolver.__init__(self)
+        self.maximum_dimension = maximum_dimension
+        self.number_of_kept_vectors = number_of_kept_vectors
+    # }}}
+    def __repr__(self): # {{{
+        return "{}({},{})".format(type(self).__name__,self.maximum_dimension,self.number_of_kept_vectors)
+    # }}}
+    @property
+    def expected_number_of_multiplications(self): # {{{
+        return self.maximum_dimension
+    # }}}
+    def solve(self,initial,multiplyExpectation,multiplyNormalization,applyInverseNormalization,tolerance,maximum_number_of_multiplications,expectation_diagonal=None,normalization_diagonal=None,initial_subspace=()): # {{{
+        if multiplyNormalization is None:
+            multiplyNormalization = lambda v: v
+        N = len(initial)
+        basis = []
+        normalized_basis = []
+        multiplied_basis = []
+        def addToBasis(vector):
+            original_norm = norm(vector)
+            for _ in range(2):
+                if basis:
+                    vector = vector - dot(dot(array(normalized_basis).conj(),vector),array(basis))
+            # The normalization is applied only after orthogonalizing, as
+            # updating the normalized vector by subtraction lets rounding
+            # errors grow from one basis vector to the next.
+            normalized_vector = multiplyNormalization(vector)
+            length = sqrt(abs(dot(vector.conj(),normalized_vector)))
+            if norm(vector) <= 1e-10*original_norm or length == 0:
+                return False
+            basis.append(vector/length)
+            normalized_basis.append(normalized_vector/length)
+            multiplied_basis.append(multiplyExpectation(basis[-1]))
+            return True
+        if not addToBasis(initial):
+            raise InitialVectorRejected()
+        initial_value = dot(basis[0].conj(),multiplied_basis[0]).real
+        for vector in initial_subspace:
+            addToBasis(vector)
+        number_of_multiplications = len(basis)
+        while True:
+            projected_matrix = dot(array(basis).conj(),array(multiplied_basis).transpose())
+            evals, evecs = eigh((projected_matrix + projected_matrix.conj().transpose())/2)
+            value = evals[0]
+            final = dot(evecs[:,0],array(basis))
+            residual = dot(evecs[:,0],array(multiplied_basis)) - value*dot(evecs[:,0],array(normalized_basis))
+            if norm(residual) <= tolerance*max(1,abs(value)) or len(basis) == N or maximum_number_of_multiplications is not None and number_of_multiplications >= maximum_number_of_multiplications:
+                break
+            for vector in self.formExpansionVectors(value,residual,multiplied_basis[-1],applyInverseNormalization,expectation_diagonal,normalization_diagonal):
+                if addToBasis(vector):
+                    break
+            else:
+                break
+            number_of_multiplications += 1
+            if len(basis) > self.maximum_dimension:
+                # Keep the lowest Ritz vectors together with the newest
+                # vector, which is orthogonal to all of them.
+                kept_evecs = zeros((len(basis),self.number_of_kept_vectors+1),dtype=evecs.dtype)
+                kept_evecs[:-1,:-1] = evecs[:,:self.number_of_kept_vectors]
+                kept_evecs[-1,-1] = 1
+                basis = list(dot(kept_evecs.transpose(),array(basis)))
+                normalized_basis = list(dot(kept_evecs.transpose(),array(normalized_basis)))
+                multiplied_basis = list(dot(kept_evecs.transpose(),array(multiplied_basis)))
+        return initial_value, value, final, list(dot(evecs[:,1:self.number_of_kept_vectors].transpose(),array(basis)))
+    # }}}
+# }}}
+class DavidsonEigensolver(SubspaceEigensolver): # {{{
+    uses_diagonals = True
+    def formExpansionVectors(self,value,residual,multiplied_vector,applyInverseNormalization,expectation_diagonal,normalization_diagonal): # {{{
+        if expectation_diagonal is not None:
+            denominator = expectation_diagonal - value*(1 if normalization_diagonal is None else normalization_diagonal)
+            denominator[abs(denominator) < 1e-8] = 1e-8
+            yield residual/denominator
+        yield residual
+    # }}}
+# }}}
+class LanczosEigensolver(SubspaceEigensolver): # {{{
+    # Thick-restart Lanczos on the inverse normalization times the
+    # expectation, which is Hermitian in the inner product given by the
+    # normalization.  In a Krylov space the residual of the lowest Ritz vector
+    # points along the next Lanczos vector, so expanding with it is the same
+    # as the usual recurrence while also working when the space was seeded
+    # with an initial subspace.
+    uses_inverse_normalization = True
+    def formExpansionVectors(self,value,residual,multiplied_vector,applyInverseNormalization,expectation_diagonal,normalization_diagonal): # {{{
+        yield applyInverseNormalization(residual)
+    # }}}
+# }}}
+class RestartedKrylovEigensolver(Eigensolver): # {{{
+    uses_inverse_normalization = True
+    def __init__(self,dimension_of_krylov_space=3): # {{{
+        Eigensolver.__init__(self)
+        self.dimension_of_krylov_space = dimension_of_krylov_space
+    # }}}
+    def __repr__(self): # {{{
+        return "RestartedKrylovEigensolver({})".format(self.dimension_of_krylov_space)
+    # }}}
+    @property
+    def expected_number_of_multiplications(self): # {{{
+        return 2*self.dimension_of_krylov_space
+    # }}}
+    def solve(self,initial,multiplyExpectation,multiplyNormalization,applyInverseNormalization,tolerance,maximum_number_of_multiplications,**_): # {{{
+        N = len(initial)
+        dimension_of_krylov_space = self.dimension_of_krylov_space
+        multiply = lambda v: applyInverseNormalization(multiplyExpectation(v))
+        initial_value = dot(initial.conj(),multiply(initial))
+
+        number_of_multiplications = 0
+        last_lowest_eigenvalue = None
+        space_is_complete = dimension_of_krylov_space == N
+        while True:
+            krylov_basis = zeros((dimension_of_krylov_space,N),dtype=initial.dtype)
+            multiplied_krylov_basis = zeros((dimension_of_krylov_space,N),dtype=initial.dtype)
+            krylov_basis[0] = initial
+            del initial
+            for i in range(0,dimension_of_krylov_space):
+                multiplied_krylov_basis[i] = multiply(krylov_basis[i])
+                if i < dimension_of_krylov_space-1:
+                    # Note:  Subtracting and then normalizing is numerically unstable
+                    #        when the vector is close to being an eigenvector
+                    #        due to the loss of precision when taking the difference
+                    #        between the original vector and the multiplied vector
+                    krylov_basis[i+1] = multiplied_krylov_basis[i] - dot(dot(krylov_basis[:i+1].conj(),multiplied_krylov_basis[i]),krylov_basis[:i+1])
+                    normalization = norm(krylov_basis[i+1])
+                    if normalization <= 1e-14:
+                        space_is_complete = True
+                        krylov_basis = krylov_basis[:i+1]
+                        multiplied_krylov_basis = multiplied_krylov_basis[:i+1]
+                        break
+                    krylov_basis[i+1] /= normalization
+            number_of_multiplications += dimension_of_krylov_space
+
+            matrix_in_krylov_subspace = dot(krylov_basis.conj(),multiplied_krylov_basis.transpose())
+            evals, evecs = eig(matrix_in_krylov_subspace)
+            mindex = argmin(evals.real)
+            mineval = evals[mindex]
+            minevec = evecs[:,mindex]
+            if not iscomplexobj(krylov_basis):
+                # The eigenvector of a real problem is real up to a phase.
+                minevec = (minevec/minevec[argmax(abs(minevec))]).real
+            if space_is_complete or last_lowest_eigenvalue is not None and (abs(last_lowest_eigenvalue-mineval)<=tolerance) or maximum_number_of_multiplications is not None and number_of_multiplications >= maximum_number_of_multiplications:
+                final = dot(minevec,krylov_basis)
+                final /= norm(final)
+                return initial_value, dot(final.conj(),multiply(final)), final, []
+            else:
+                initial = dot(minevec,krylov_basis)
+                initial /= norm(initial)
+                last_lowest_eigenvalue = mineval
+    # }}}
+# }}}
 class Join: # {{{
     def __init__( # {{{
         self
@@ -57,11 +263,14 @@ class Join: # {{{
         if len(left_tensor_indices) != len(right_tensor_indices):
             raise ValueError("number of left indices does not match number of right indices (len({}) != len({}))".format(left_tensor_indices,right_tensor_indices))
         self.left_tensor_number = left_tensor_number
-        self.left_tensor_indices = left_tensor_indices
+        self.left_tensor_indices = list(left_tensor_indices)
         self.right_tensor_number = right_tensor_number
-        self.right_tensor_indices = right_tensor_indices
+        self.right_tensor_indices = list(right_tensor_indices)
         self.checkOrderAndSwap()
     # }}}
+    def __copy__(self): # {{{
+        return Join(self.left_tensor_number,self.left_tensor_indices,self.right_tensor_number,self.right_tensor_indices)
+    # }}}
     def __repr__(self): # {{{
         return "Join({left_tensor_number},{left_tensor_indices},{right_tensor_number},{right_tensor_indices})".format(**self.__dict__)
     # }}}
@@ -100,6 +309,41 @@ class Join: # {{{
             self.checkOrderAndSwap()
     # }}}
 # }}}
+class DataContractorPlanCache: # {{{
+    def __init__(self,maximum_size=256,maximum_peak_memory=None): # {{{
+        self.maximum_size = maximum_size
+        self.maximum_peak_memory = maximum_peak_memory
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    # }}}
+    def __len__(self): # {{{
+        return len(self.plans)
+    # }}}
+    def __repr__(self): # {{{
+        return "DataContractorPlanCache(size={},maximum_size={},hits={},misses={})".format(len(self.plans),self.maximum_size,self.hits,self.misses)
+    # }}}
+    def clear(self): # {{{
+        self.plans.clear()
+        self.hits = 0
+        self.misses = 0
+    # }}}
+    def lookup(self,key,formPlan): # {{{
+        plans = self.plans
+        try:
+            plan = plans[key]
+        except KeyError:
+            self.misses += 1
+            plan = formPlan()
+            plans[key] = plan
+            while len(plans) > self.maximum_size:
+                plans.popitem(last=False)
+        else:
+            self.hits += 1
+            plans.move_to_end(key)
+        return plan
+    # }}}
+# }}}
 class FromLeft: # {{{
     # Constants {{{
     number_of_left_dimensions = 1
@@ -178,16 +422,24 @@ class FromBoth: # {{{
     # }}}
 # }}}
 class Multiplier: # {{{
-    def __init__(self,shape,multiply,cost_of_multiply,formMatrix,cost_of_formMatrix): # {{{
+    def __init__(self,shape,multiply,cost_of_multiply,formMatrix,cost_of_formMatrix,formDiagonal=None,cost_of_formDiagonal=None,multiplyColumns=None): # {{{
         self.shape = shape
         self.multiply = multiply
         self.cost_of_multiply = cost_of_multiply
         self.formMatrix = formMatrix
         self.cost_of_formMatrix = cost_of_formMatrix
+        self.formDiagonal = formDiagonal
+        self.cost_of_formDiagonal = cost_of_formDiagonal
+        self.multiplyColumns = multiplyColumns
     # }}}
     def __call__(self,vector): # {{{
         return self.multiply(vector)
     # }}}
+    def applyToColumns(self,matrix): # {{{
+        if self.multiplyColumns is not None:
+            return self.multiplyColumns(matrix)
+        return array([self.multiply(column) for column in matrix.transpose()]).reshape(matrix.shape[::-1]).transpose()
+    # }}}
     @classmethod # fromMatrix {{{
     def fromMatrix(self,matrix):
         m, n = matrix.shape
@@ -205,6 +457,119 @@ class Multiplier: # {{{
                 self.cost_of_formMatrix + estimated_number_of_applications*self.shape[0]*self.shape[1]
     # }}}
 # }}}
+class NormalizationSolver: # {{{
+    # Applies the normalization and its inverse for relaxOver.  When it is
+    # cheap enough the matrix is formed and its Cholesky factorization is
+    # kept until the objects that the normalization was built from change (as
+    # reported to dependOn);  otherwise the inverse is applied by conjugate
+    # gradients preconditioned by the diagonal.
+    def __init__(self): # {{{
+        self.dependencies = None
+        self.number_of_factorizations = 0
+        self.invalidate()
+    # }}}
+    def applyInverse(self,vector): # {{{
+        if self.factorization is not None:
+            return self.factorization(vector)
+        result, info = cg(self.operator,vector,M=self.preconditioner)
+        if info != 0:
+            result, info = gmres(self.operator,vector)
+            if info != 0:
+                raise NormalizationInverseFailed(info)
+        return result
+    # }}}
+    def dependOn(self,dependencies): # {{{
+        dependencies = tuple(dependencies)
+        if self.dependencies is None or len(dependencies) != len(self.dependencies) or any(x is not y for x, y in zip(dependencies,self.dependencies)):
+            self.invalidate()
+            self.dependencies = dependencies
+    # }}}
+    def invalidate(self): # {{{
+        self.diagonal = None
+        self.factorization = None
+        self.matrix = None
+        self.multiply = None
+        self.operator = None
+        self.preconditioner = None
+    # }}}
+    def prepare(self,normalization_multiplier,estimated_number_of_applications,need_inverse,need_diagonal,shape,DataClass,dtype): # {{{
+        # Without dependencies nothing is known about when the normalization
+        # changes, so nothing may be kept from a previous call.
+        if self.dependencies is None:
+            self.invalidate()
+        if self.matrix is None and self.multiply is None:
+            if normalization_multiplier.isCheaperToFormMatrix(estimated_number_of_applications):
+                self.matrix = normalization_multiplier.formMatrix().toArray()
+                self.diagonal = self.matrix.diagonal().real
+            else:
+                self.multiply = lambda v: normalization_multiplier(DataClass(v.reshape(shape))).toArray().ravel()
+                self.operator = LinearOperator(matvec=self.multiply,shape=normalization_multiplier.shape,dtype=dtype)
+        if self.matrix is not None:
+            if need_inverse and self.factorization is None:
+                self.number_of_factorizations += 1
+                try:
+                    self.factorization = partial(cho_solve,cho_factor(self.matrix))
+                except LinAlgError:
+                    self.factorization = partial(lu_solve,lu_factor(self.matrix))
+        elif (need_diagonal or need_inverse) and self.diagonal is None and normalization_multiplier.formDiagonal is not None:
+            self.diagonal = normalization_multiplier.formDiagonal().toArray().ravel().real
+            if need_inverse:
+                inverse_diagonal = self.diagonal.copy()
+                inverse_diagonal[abs(inverse_diagonal) < 1e-14] = 1
+                inverse_diagonal = 1/inverse_diagonal
+                self.preconditioner = LinearOperator(matvec=lambda v: inverse_diagonal*v,shape=normalization_multiplier.shape,dtype=dtype)
+    # }}}
+    def multiplyNormalization(self,vector): # {{{
+        if self.matrix is not None:
+            return dot(self.matrix,vector)
+        else:
+            return self.multiply(vector)
+    # }}}
+# }}}
+class PlannedDataContractor: # {{{
+    # Class variables {{{
+    ids = count()
+    # }}}
+    # Properties {{{
+    source = property(lambda self: self.unplanned.source)
+    tensor_ranks = property(lambda self: self.unplanned.tensor_ranks)
+    # }}}
+    def __init__(self,joins,final_groups,tensor_ranks=None,cache=None,maximum_peak_memory=None,backend="tensordot"): # {{{
+        self.id = next(self.ids)
+        self.joins = [copy(join) for join in joins]
+        self.final_groups = [list(group) for group in final_groups]
+        self.cache = cache
+        self.maximum_peak_memory = maximum_peak_memory
+        self.backend = backend
+        self.unplanned = self.formPlan(tensor_ranks)
+    # }}}
+    def __call__(self,*tensors,**keywords): # {{{
+        tensor_shapes = tuple(tuple(tensor.shape) for tensor in tensors)
+        cache = self.cache
+        if cache is None:
+            cache = data_contractor_plan_cache
+        maximum_peak_memory = self.maximum_peak_memory
+        if maximum_peak_memory is None:
+            maximum_peak_memory = cache.maximum_peak_memory
+        return cache.lookup((self.id,tensor_shapes,maximum_peak_memory),partial(self.formPlanForShapes,tensor_shapes,maximum_peak_memory))(*tensors,**keywords)
+    # }}}
+    def formPlan(self,tensor_ranks=None,tensor_shapes=None,maximum_peak_memory=None): # {{{
+        return formDataContractor(
+            [copy(join) for join in self.joins],
+            [list(group) for group in self.final_groups],
+            tensor_ranks,
+            tensor_shapes,
+            maximum_peak_memory,
+            self.backend
+        )
+    # }}}
+    def formPlanForShapes(self,tensor_shapes,maximum_peak_memory=None): # {{{
+        if [len(shape) for shape in tensor_shapes] != self.tensor_ranks:
+            # Let the unplanned contractor report the problem with the arguments.
+            return self.unplanned
+        return self.formPlan(list(self.tensor_ranks),tensor_shapes,maximum_peak_memory)
+    # }}}
+# }}}
 # }}}
 
 # Decorators {{{
@@ -221,6 +586,9 @@ def prependContractor(*args,**keywords): # {{{
 def prependDataContractor(*args,**keywords): # {{{
     return prepend(formDataContractor(*args,**keywords))
 # }}}
+def prependPlannedDataContractor(*args,**keywords): # {{{
+    return prepend(PlannedDataContractor(*args,**keywords))
+# }}}
 # }}}
 
 # Pauli Operators {{{
@@ -247,6 +615,14 @@ def buildTensor(dimensions,components): # {{{
         tensor[index] = value
     return tensor
 # }}}
+def changePrecisionOf(dtype,single): # {{{
+    if issubdtype(dtype,complexfloating):
+        return complex64 if single else complex128
+    elif issubdtype(dtype,floating):
+        return float32 if single else float64
+    else:
+        return dtype
+# }}}
 def checkForNaNsIn(data): # {{{
     assert not data.hasNaN()
     return data
@@ -279,6 +655,8 @@ def computeCompressor(old_dimension,new_dimension,multiplier,dtype,normalize=Fal
         evals, evecs = eigh(matrix)
         evals = evals[-new_dimension:]
         evecs = evecs[:,-new_dimension:]
+    elif estimateCostOfRandomizedEigenvectors(multiplier,new_dimension) < estimateCostOfLanczosEigenvectors(multiplier,new_dimension):
+        evals, evecs = computeRandomizedEigenvectors(multiplier,new_dimension,dtype)
     else:
         operator = \
             LinearOperator(
@@ -304,21 +682,189 @@ def computeCompressor(old_dimension,new_dimension,multiplier,dtype,normalize=Fal
 def computeCompressorForMatrixTimesItsDagger(old_dimension,new_dimension,matrix,normalize=False): # {{{
     other_dimension = matrix.shape[0]
     matrix_dagger = matrix.transpose().conj()
+    multiply = lambda v: dot(matrix_dagger,dot(matrix,v))
     return \
         computeCompressor(
             old_dimension,
             new_dimension,
             Multiplier(
                 (old_dimension,)*2,
-                lambda v: dot(matrix_dagger,dot(matrix,v)),
+                multiply,
                 2 * old_dimension * other_dimension,
                 lambda: dot(matrix_dagger,matrix),
-                old_dimension**2 * other_dimension
+                old_dimension**2 * other_dimension,
+                multiplyColumns=multiply
             ),
             matrix.dtype,
             normalize
         )
 # }}}
+def computeCheapestJoinOrder(joins,tensor_shapes,maximum_number_of_tensors_for_exhaustive_search=10,maximum_peak_memory=None,final_groups=None): # {{{
+    from .data.cost_tracker import CostTracker
+    number_of_tensors = len(tensor_shapes)
+    # Label every axis of every tensor {{{
+    # Axes that are joined share a label, which is the number of the join plus
+    # the position of the axis within the join;  all other axes get a label of
+    # their own so that they survive until the end.
+    tensor_labels = [[(None,tensor_number,index) for index in range(len(shape))] for tensor_number, shape in enumerate(tensor_shapes)]
+    neighbors = [set() for _ in range(number_of_tensors)]
+    for join_number, join in enumerate(joins):
+        for position, (left_index,right_index) in enumerate(zip(join.left_tensor_indices,join.right_tensor_indices)):
+            tensor_labels[join.left_tensor_number][left_index] = (join_number,position)
+            tensor_labels[join.right_tensor_number][right_index] = (join_number,position)
+        neighbors[join.left_tensor_number].add(join.right_tensor_number)
+        neighbors[join.right_tensor_number].add(join.left_tensor_number)
+    # }}}
+    # The arguments are held by the caller for the whole contraction, so they
+    # are always live;  the memory of a plan is measured on top of them.
+    baseline_memory = sum(prod(shape,dtype=int) for shape in tensor_shapes)
+    if final_groups is None:
+        final_labels = None
+    else:
+        final_labels = [(None,tensor_number,index) for group in final_groups for (tensor_number,index) in group]
+    def joinNumberBetween(tensor_numbers_1,tensor_numbers_2): # {{{
+        return min(
+            join_number
+            for join_number, join in enumerate(joins)
+            if join.left_tensor_number in tensor_numbers_1 and join.right_tensor_number in tensor_numbers_2
+            or join.left_tensor_number in tensor_numbers_2 and join.right_tensor_number in tensor_numbers_1
+        )
+    # }}}
+    def merge(plan_1,plan_2): # {{{
+        # A plan is (tracker, labels, tensor numbers, join order, memory held by
+        # its result, peak memory while computing it);  plan_1 is executed first.
+        _, _, tensor_numbers_1, order_1, held_1, peak_1 = plan_1
+        _, _, tensor_numbers_2, order_2, held_2, peak_2 = plan_2
+        # The generated code puts the tensor with the lower number on the left;
+        # arguments are numbered before intermediates, and intermediates are
+        # numbered in the order in which they are computed.
+        if not order_2 and (order_1 or min(tensor_numbers_2) < min(tensor_numbers_1)):
+            left_plan, right_plan = plan_2, plan_1
+        else:
+            left_plan, right_plan = plan_1, plan_2
+        left_tracker, left_labels = left_plan[:2]
+        right_tracker, right_labels = right_plan[:2]
+        common_labels = set(left_labels) & set(right_labels)
+        tracker = left_tracker.contractWith(
+            right_tracker,
+            [i for i, label in enumerate(left_labels) if label in common_labels],
+            [i for i, label in enumerate(right_labels) if label in common_labels],
+        )
+        held = prod(tracker.shape,dtype=int)
+        return (
+            tracker,
+            [label for label in left_labels + right_labels if label not in common_labels],
+            tensor_numbers_1 | tensor_numbers_2,
+            order_1 + order_2 + (joinNumberBetween(tensor_numbers_1,tensor_numbers_2),),
+            held,
+            max(peak_1,held_1+peak_2,held_1+held_2+held),
+        )
+    # }}}
+    def computeTotalPeak(plan): # {{{
+        # The final join copies the result unless it leaves the axes in order.
+        if final_labels is None or plan[1] != final_labels:
+            return baseline_memory + max(plan[-1],2*plan[4])
+        else:
+            return baseline_memory + plan[-1]
+    # }}}
+    def chooseBest(plans): # {{{
+        plans_within_budget = [plan for plan in plans if maximum_peak_memory is None or computeTotalPeak(plan) <= maximum_peak_memory]
+        if plans_within_budget:
+            return min(plans_within_budget,key=lambda plan: (plan[0].cost,computeTotalPeak(plan)))
+        else:
+            return min(plans,key=lambda plan: (computeTotalPeak(plan),plan[0].cost))
+    # }}}
+    def prune(plans,computePeak=lambda plan: plan[-1]): # {{{
+        if maximum_peak_memory is None:
+            return [min(plans,key=lambda plan: plan[0].cost)]
+        # Keep every plan that is not beaten in both flops and peak memory.
+        pruned_plans = []
+        for plan in sorted(plans,key=lambda plan: (plan[0].cost,computePeak(plan))):
+            if not pruned_plans or computePeak(plan) < computePeak(pruned_plans[-1]):
+                pruned_plans.append(plan)
+        return pruned_plans
+    # }}}
+    # Split the network into connected components {{{
+    components = []
+    unvisited = set(range(number_of_tensors))
+    while unvisited:
+        frontier = [min(unvisited)]
+        component = set()
+        while frontier:
+            tensor_number = frontier.pop()
+            if tensor_number in unvisited:
+                unvisited.remove(tensor_number)
+                component.add(tensor_number)
+                frontier.extend(neighbors[tensor_number])
+        components.append(sorted(component))
+    # }}}
+    order = ()
+    for component in components:
+        plans = [
+            (CostTracker(tuple(tensor_shapes[tensor_number])),tensor_labels[tensor_number],frozenset([tensor_number]),(),0,0)
+            for tensor_number in component
+        ]
+        if len(component) <= maximum_number_of_tensors_for_exhaustive_search:
+            # Exhaustive search via dynamic programming over connected subsets {{{
+            best_plans = {1 << i: [plan] for i, plan in enumerate(plans)}
+            component_neighbors = [
+                sum(1 << component.index(neighbor) for neighbor in neighbors[tensor_number])
+                for tensor_number in component
+            ]
+            def areAdjacent(subset_1,subset_2):
+                return any(
+                    component_neighbors[i] & subset_2
+                    for i in range(len(component))
+                    if subset_1 & (1 << i)
+                )
+            for subset in range(1,1 << len(component)):
+                if subset in best_plans:
+                    continue
+                candidate_plans = []
+                subset_1 = (subset - 1) & subset
+                while subset_1:
+                    subset_2 = subset ^ subset_1
+                    if subset_1 in best_plans and subset_2 in best_plans and areAdjacent(subset_1,subset_2):
+                        for plan_1 in best_plans[subset_1]:
+                            for plan_2 in best_plans[subset_2]:
+                                candidate_plans.append(merge(plan_1,plan_2))
+                    subset_1 = (subset_1 - 1) & subset
+                if candidate_plans:
+                    if subset == (1 << len(component))-1:
+                        best_plans[subset] = prune(candidate_plans,computeTotalPeak)
+                    else:
+                        best_plans[subset] = prune(candidate_plans)
+            order += chooseBest(best_plans[(1 << len(component))-1])[3]
+            # }}}
+        else:
+            # Greedy search that always performs the cheapest available contraction next {{{
+            while len(plans) > 1:
+                held_memory = sum(plan[4] for plan in plans)
+                candidates = []
+                for i in range(len(plans)):
+                    for j in range(i+1,len(plans)):
+                        if not any(neighbors[tensor_number] & plans[j][2] for tensor_number in plans[i][2]):
+                            continue
+                        plan = merge(plans[i],plans[j])
+                        candidates.append((
+                            plan[0].cost - plans[i][0].cost - plans[j][0].cost,
+                            held_memory + plan[4],
+                            i,
+                            j,
+                            plan,
+                        ))
+                candidates_within_budget = [candidate for candidate in candidates if maximum_peak_memory is None or baseline_memory + candidate[1] <= maximum_peak_memory]
+                if candidates_within_budget:
+                    _, _, i, j, plan = min(candidates_within_budget,key=lambda candidate: candidate[:2])
+                else:
+                    _, _, i, j, plan = min(candidates,key=lambda candidate: (candidate[1],candidate[0]))
+                del plans[j]
+                del plans[i]
+                plans.append(plan)
+            order += plans[0][3]
+            # }}}
+    return [joins[join_number] for join_number in order] + [join for join_number, join in enumerate(joins) if join_number not in order]
+# }}}
 def computeLengthAndCheckForGaps(indices,error_message): # {{{
     if len(indices) == 0:
         return 0
@@ -414,6 +960,32 @@ def computePostContractionIndexMap(rank,contracted_indices,offset=0): # {{{
             new_index += 1
     return index_map
 # }}}
+def computeRandomizedEigenvectors(multiplier,number_of_eigenvectors,dtype,number_of_oversamples=10,number_of_power_iterations=2): # {{{
+    # Randomized range finder (Halko, Martinsson, and Tropp) for a Hermitian
+    # positive semi-definite multiplier;  as with eigh, the eigenvalues are
+    # returned in ascending order.
+    dimension = multiplier.shape[0]
+    number_of_samples = min(number_of_eigenvectors+number_of_oversamples,dimension)
+    basis = qr(multiplier.applyToColumns(randomSample((dimension,number_of_samples),dtype)),mode="economic")[0]
+    for _ in range(number_of_power_iterations):
+        basis = qr(multiplier.applyToColumns(basis),mode="economic")[0]
+    projected = dot(basis.transpose().conj(),multiplier.applyToColumns(basis))
+    evals, evecs = eigh((projected+projected.transpose().conj())/2)
+    return evals[-number_of_eigenvectors:], dot(basis,evecs[:,-number_of_eigenvectors:])
+# }}}
+def contractUsingWorkspace(workspace,key,left,right,left_axes,right_axes): # {{{
+    # The result is written into the buffer kept in the workspace under the
+    # given key, so that contracting tensors with the same shapes again (as
+    # happens on every iteration of an eigensolver) reuses its memory.
+    shape = \
+        tuple(dimension for axis, dimension in enumerate(left.shape) if axis not in left_axes) + \
+        tuple(dimension for axis, dimension in enumerate(right.shape) if axis not in right_axes)
+    dtype = result_type(left.dtype,right.dtype)
+    buffer = workspace.get(key)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = workspace[key] = type(left).newZeros(shape,dtype=dtype)
+    return left.contractWith(right,left_axes,right_axes,out=buffer)
+# }}}
 def dropAt(iterable,index): # {{{
     new_values = (x for i, x in enumerate(iterable) if i != index)
     try:
@@ -421,6 +993,18 @@ def dropAt(iterable,index): # {{{
     except TypeError:
         return tuple(new_values)
 # }}}
+def estimateCostOfLanczosEigenvectors(multiplier,number_of_eigenvectors): # {{{
+    # ARPACK keeps max(2k+1,20) Lanczos vectors and typically needs a few
+    # restarts before it has converged.
+    dimension = multiplier.shape[0]
+    number_of_vectors = min(max(2*number_of_eigenvectors+1,20),dimension)
+    return 3*number_of_vectors*(multiplier.cost_of_multiply+dimension*number_of_vectors)
+# }}}
+def estimateCostOfRandomizedEigenvectors(multiplier,number_of_eigenvectors,number_of_oversamples=10,number_of_power_iterations=2): # {{{
+    dimension = multiplier.shape[0]
+    number_of_samples = min(number_of_eigenvectors+number_of_oversamples,dimension)
+    return (number_of_power_iterations+2)*number_of_samples*(multiplier.cost_of_multiply+dimension*number_of_samples) + number_of_samples**3
+# }}}
 def formAbsorber(left_join_dimensions,right_join_dimensions,result_dimension_sources): # {{{
     # Compute the numbers of dimensions {{{
     number_of_join_dimensions = len(left_join_dimensions)
@@ -457,6 +1041,18 @@ def formAbsorber(left_join_dimensions,right_join_dimensions,result_dimension_sou
     # }}}
     return absorb
 # }}}
+def formBatchableDataContractor(joins,final_groups,batched_tensors=None): # {{{
+    # Forms a contractor that also carries versions of itself that contract
+    # whole stacks of the given tensors at once, either keeping the results
+    # separate (batched) or summing them (batched_sum);  by default every
+    # tensor is batched.
+    contract = formDataContractor([copy(join) for join in joins],[list(group) for group in final_groups])
+    if batched_tensors is None:
+        batched_tensors = range(len(contract.tensor_ranks))
+    contract.batched = formDataContractor([copy(join) for join in joins],[list(group) for group in final_groups],batched_tensors=batched_tensors)
+    contract.batched_sum = formDataContractor([copy(join) for join in joins],[list(group) for group in final_groups],batched_tensors=batched_tensors,sum_over_batch=True)
+    return contract
+# }}}
 def formContractor(order,joins,result_joins): # {{{
     observed_tensor_indices = {}
 
@@ -559,7 +1155,15 @@ def formContractor(order,joins,result_joins): # {{{
 
     return contract
 # }}}
-def formDataContractor(joins,final_groups,tensor_ranks=None): # {{{
+def formDataContractor(joins,final_groups,tensor_ranks=None,tensor_shapes=None,maximum_peak_memory=None,backend="tensordot",batched_tensors=(),sum_over_batch=False): # {{{
+    if backend not in ("einsum","tensordot"):
+        raise ValueError("the backend must be either 'einsum' or 'tensordot', not {!r}".format(backend))
+    # The tensors in batched_tensors have an additional leading axis that is
+    # not mentioned in the joins and final groups;  it indexes a batch of
+    # independent contractions and is kept as the leading axis of the result,
+    # unless sum_over_batch is set in which case the results are summed.
+    batched_tensors = set(batched_tensors)
+    batch_offsets = defaultdict(int,((tensor_number,1) for tensor_number in batched_tensors))
     # Tabulate all of the tensor indices to compute the number of arguments and their ranks {{{
     observed_tensor_indices = defaultdict(set)
     observed_joins = set()
@@ -600,34 +1204,70 @@ def formDataContractor(joins,final_groups,tensor_ranks=None): # {{{
         if tensor_ranks != observed_tensor_ranks:
             raise ValueError("the ranks of the arguments were specified to be {}, but inferred to be {}".format(tensor_ranks,observed_tensor_ranks))
     # }}}
+    # Reorder the joins to minimize the cost of contracting tensors with the given shapes {{{
+    if tensor_shapes is not None:
+        tensor_shapes = [tuple(shape)[batch_offsets[tensor_number]:] for tensor_number, shape in enumerate(tensor_shapes)]
+        if [len(shape) for shape in tensor_shapes] != tensor_ranks:
+            raise ValueError("the shapes of the arguments were specified to be {}, which do not agree with the inferred ranks {}".format(tensor_shapes,tensor_ranks))
+        joins = computeCheapestJoinOrder(joins,tensor_shapes,maximum_peak_memory=maximum_peak_memory,final_groups=final_groups)
+    # }}}
+    # Label the axes for the einsum backend {{{
+    if backend == "einsum":
+        axis_labels = [[None]*rank for rank in tensor_ranks]
+        labels = iter(ascii_letters)
+        batch_label = next(labels) if batched_tensors else ""
+        try:
+            for join in joins:
+                for (left_index,right_index) in zip(join.left_tensor_indices,join.right_tensor_indices):
+                    axis_labels[join.left_tensor_number][left_index] = axis_labels[join.right_tensor_number][right_index] = next(labels)
+            for tensor_axis_labels in axis_labels:
+                for index, label in enumerate(tensor_axis_labels):
+                    if label is None:
+                        tensor_axis_labels[index] = next(labels)
+        except StopIteration:
+            raise ValueError("the einsum backend can only label {} distinct axes".format(len(ascii_letters)))
+        einsum_subscripts = ",".join(
+            (batch_label if tensor_number in batched_tensors else "") + "".join(tensor_axis_labels)
+            for tensor_number, tensor_axis_labels in enumerate(axis_labels)
+        ) + "->" + ("" if sum_over_batch else batch_label) + "".join(
+            axis_labels[tensor_number][index]
+            for group in final_groups
+            for (tensor_number,index) in group
+        )
+        einsum_path = ["einsum_path"]
+        einsum_operands = list(range(number_of_tensors))
+    # }}}
     # Build the prelude for the function {{{
     function_lines = [
-        "def contract(" + ",".join(["_{}".format(tensor_number) for tensor_number in range(number_of_tensors)]) + "):",
+        "def contract(" + ",".join(["_{}".format(tensor_number) for tensor_number in range(number_of_tensors)]) + ",out=None,accumulate=False,workspace=None):",
     ]
     # Build the documentation string {{{
     function_lines.append('"""')
     for tensor_number in range(number_of_tensors):
-        function_lines.append("_{} - tensor of rank {}".format(tensor_number,tensor_ranks[tensor_number]))
+        function_lines.append("_{} - tensor of rank {}{}".format(tensor_number,tensor_ranks[tensor_number]," with a leading batch axis" if tensor_number in batched_tensors else ""))
+    function_lines.append("out - if given, the tensor into which the result is written (or added, if accumulate is set)")
+    function_lines.append("workspace - if given, a dictionary holding buffers for the intermediate results that are reused between calls")
     function_lines.append('"""')
     # }}}
     # Check that the tensors have the correct ranks {{{
     for tensor_number, expected_rank in enumerate(tensor_ranks):
-        function_lines.append("if _{tensor_number}.ndim != {expected_rank}: raise UnexpectedTensorRankError({tensor_number},{expected_rank},_{tensor_number}.ndim)".format(tensor_number=tensor_number,expected_rank=expected_rank))
+        function_lines.append("if _{tensor_number}.ndim != {expected_rank}: raise UnexpectedTensorRankError({tensor_number},{expected_rank},_{tensor_number}.ndim)".format(tensor_number=tensor_number,expected_rank=expected_rank+batch_offsets[tensor_number]))
     # }}}
     # Check that the tensors have matching dimensions {{{
     for join in joins:
         for (left_index,right_index) in zip(join.left_tensor_indices,join.right_tensor_indices):
             function_lines.append('if _{left_tensor_number}.shape[{left_index}] != _{right_tensor_number}.shape[{right_index}]: raise DimensionMismatchError({left_tensor_number},{left_index},_{left_tensor_number}.shape[{left_index}],{right_tensor_number},{right_index},_{right_tensor_number}.shape[{right_index}])'.format(
                 left_tensor_number = join.left_tensor_number,
-                left_index = left_index,
+                left_index = left_index+batch_offsets[join.left_tensor_number],
                 right_tensor_number = join.right_tensor_number,
-                right_index = right_index,
+                right_index = right_index+batch_offsets[join.right_tensor_number],
             ))
     # }}}
     # }}}
     # Build the main part of the function {{{
     next_tensor_number = number_of_tensors
     active_tensor_numbers = set(range(number_of_tensors))
+    last_contraction = None
     joins.reverse()
     while joins:
         join = joins.pop()
@@ -635,19 +1275,60 @@ def formDataContractor(joins,final_groups,tensor_ranks=None): # {{{
         left_tensor_indices = join.left_tensor_indices
         right_tensor_number = join.right_tensor_number
         right_tensor_indices = join.right_tensor_indices
+        if right_tensor_number in batched_tensors and left_tensor_number not in batched_tensors:
+            # Contract from the batched side so that the batch axis leads.
+            left_tensor_number, right_tensor_number = right_tensor_number, left_tensor_number
+            left_tensor_indices, right_tensor_indices = right_tensor_indices, left_tensor_indices
         active_tensor_numbers.remove(left_tensor_number)
         active_tensor_numbers.remove(right_tensor_number)
         active_tensor_numbers.add(next_tensor_number)
         tensor_ranks.append(tensor_ranks[left_tensor_number]+tensor_ranks[right_tensor_number]-2*len(left_tensor_indices))
         # Add the lines to the function {{{
-        function_lines.append("_{} = _{}.contractWith(_{},{},{})".format(
-            next_tensor_number,
-            left_tensor_number,
-            right_tensor_number,
-            left_tensor_indices,
-            right_tensor_indices,
-        ))
-        function_lines.append("del _{}, _{}".format(left_tensor_number,right_tensor_number))
+        if backend == "einsum":
+            einsum_path.append(tuple(sorted([einsum_operands.index(left_tensor_number),einsum_operands.index(right_tensor_number)])))
+            einsum_operands.remove(left_tensor_number)
+            einsum_operands.remove(right_tensor_number)
+            einsum_operands.append(next_tensor_number)
+        else:
+            # When summing over the batch, the batch axis is contracted as
+            # soon as the last two batched tensors meet.
+            sum_batch_now = (
+                sum_over_batch and
+                right_tensor_number in batched_tensors and
+                not any(tensor_number in batched_tensors for tensor_number in active_tensor_numbers)
+            )
+            if left_tensor_number in batched_tensors or right_tensor_number in batched_tensors:
+                function_lines.append("_{} = _{}.{}(_{},{},{})".format(
+                    next_tensor_number,
+                    left_tensor_number,
+                    "contractBatchWith" if right_tensor_number in batched_tensors and not sum_batch_now else "contractWith",
+                    right_tensor_number,
+                    [0]*sum_batch_now + [index+batch_offsets[left_tensor_number] for index in left_tensor_indices],
+                    [0]*sum_batch_now + [index+batch_offsets[right_tensor_number] for index in right_tensor_indices],
+                ))
+                last_contraction = None
+            else:
+                contraction = "_{}.contractWith(_{},{},{}".format(left_tensor_number,right_tensor_number,list(left_tensor_indices),list(right_tensor_indices))
+                function_lines.append("_{0} = {1}) if workspace is None else contractUsingWorkspace(workspace,{0},_{2},_{3},{4},{5})".format(
+                    next_tensor_number,
+                    contraction,
+                    left_tensor_number,
+                    right_tensor_number,
+                    list(left_tensor_indices),
+                    list(right_tensor_indices),
+                ))
+                # Remember this contraction in case it turns out to be the
+                # last one, as then it can write directly into out.
+                last_contraction = (len(function_lines)-1,next_tensor_number,contraction,[
+                    "_{}.shape[{}]".format(tensor_number,index)
+                    for tensor_number, tensor_indices in ((left_tensor_number,left_tensor_indices),(right_tensor_number,right_tensor_indices))
+                    for index in range(tensor_ranks[tensor_number])
+                    if index not in tensor_indices
+                ])
+            function_lines.append("del _{}, _{}".format(left_tensor_number,right_tensor_number))
+            if left_tensor_number in batched_tensors and not sum_batch_now:
+                batched_tensors.add(next_tensor_number)
+                batch_offsets[next_tensor_number] = 1
         # }}}
         # Update the remaining joins {{{
         left_index_map = computePostContractionIndexMap(tensor_ranks[left_tensor_number],left_tensor_indices)
@@ -677,36 +1358,120 @@ def formDataContractor(joins,final_groups,tensor_ranks=None): # {{{
         next_tensor_number += 1
     # }}}
     # Build the finale of the function {{{
-    # Combine any remaining tensors using outer products {{{
-    active_tensor_numbers = list(active_tensor_numbers)
-    final_tensor_number = active_tensor_numbers[0]
-    for tensor_number in active_tensor_numbers[1:]: 
-        function_lines.append("_{final_tensor_number} = _{final_tensor_number}.contractWith(_{tensor_number},[],[])".format(final_tensor_number=final_tensor_number,tensor_number=tensor_number))
-        function_lines.append("del _{}".format(tensor_number))
-    # }}}
-    if len(final_groups) > 0:
-        # Compute index map and apply the index map to the final groups {{{
-        index_offset = 0
-        index_map = {}
-        for tensor_number in active_tensor_numbers:
-            for index in range(tensor_ranks[tensor_number]):
-                index_map[(tensor_number,index)] = index+index_offset
-            index_offset += tensor_ranks[tensor_number]
-        final_groups = [applyIndexMapTo(index_map,group) for group in final_groups]
+    def appendReturnOfResult(tensor_number):
+        function_lines.extend([
+            "if out is None:",
+            "    return _{}".format(tensor_number),
+            "if accumulate:",
+            "    out += _{}".format(tensor_number),
+            "else:",
+            "    out[...] = _{}".format(tensor_number),
+            "return out",
+        ])
+    def appendReturnOfScalar(tensor_number):
+        function_lines.extend([
+            "if out is not None: raise ValueError('the result is a scalar and so cannot be written into out')",
+            "return _{}.extractScalar()".format(tensor_number),
+        ])
+    if backend == "einsum":
+        # Hand the whole network to einsum along the planned path {{{
+        if len(einsum_operands) > 1 or len(einsum_path) == 1:
+            einsum_path.append(tuple(range(len(einsum_operands))))
+        function_lines.append("_{} = _0.contractNetworkWith([{}],{!r},{!r})".format(
+            number_of_tensors,
+            ",".join("_{}".format(tensor_number) for tensor_number in range(1,number_of_tensors)),
+            einsum_subscripts,
+            einsum_path,
+        ))
+        function_lines.append("del " + ", ".join("_{}".format(tensor_number) for tensor_number in range(number_of_tensors)))
+        # The output axes are already in order, so joining them never copies.
+        keep_batch_axis = bool(batched_tensors) and not sum_over_batch
+        if len(final_groups) > 0 or keep_batch_axis:
+            index = 1 if keep_batch_axis else 0
+            output_groups = [[0]] if keep_batch_axis else []
+            for group in final_groups:
+                output_groups.append(list(range(index,index+len(group))))
+                index += len(group)
+            function_lines.append("_{0} = _{0}.join(*{1})".format(number_of_tensors,output_groups))
+            appendReturnOfResult(number_of_tensors)
+        else:
+            appendReturnOfScalar(number_of_tensors)
         # }}}
-        function_lines.append("return _{}.join(*{})".format(final_tensor_number,final_groups))
     else:
-        function_lines.append("return _{}.extractScalar()".format(final_tensor_number))
+        # Combine any remaining tensors using outer products {{{
+        # (Batched tensors go first so that the batch axis leads.)
+        active_tensor_numbers = sorted(active_tensor_numbers,key=lambda tensor_number: tensor_number not in batched_tensors)
+        final_tensor_number = active_tensor_numbers[0]
+        last_batched_tensor_number = ([None]+[tensor_number for tensor_number in active_tensor_numbers if tensor_number in batched_tensors])[-1]
+        for tensor_number in active_tensor_numbers[1:]: 
+            if sum_over_batch and tensor_number == last_batched_tensor_number:
+                function_lines.append("_{final_tensor_number} = _{final_tensor_number}.contractWith(_{tensor_number},[0],[0])".format(final_tensor_number=final_tensor_number,tensor_number=tensor_number))
+                batched_tensors.discard(final_tensor_number)
+            else:
+                function_lines.append("_{final_tensor_number} = _{final_tensor_number}.{method}(_{tensor_number},[],[])".format(final_tensor_number=final_tensor_number,tensor_number=tensor_number,method="contractBatchWith" if tensor_number in batched_tensors else "contractWith"))
+            function_lines.append("del _{}".format(tensor_number))
+        # }}}
+        if final_tensor_number in batched_tensors and sum_over_batch:
+            raise ValueError("summing over the batch requires at least two batched tensors")
+        if final_tensor_number in batched_tensors:
+            # Compute index map and apply the index map to the final groups, keeping the batch axis in front {{{
+            index_offset = 1
+            index_map = {}
+            for tensor_number in active_tensor_numbers:
+                for index in range(tensor_ranks[tensor_number]):
+                    index_map[(tensor_number,index)] = index+index_offset
+                index_offset += tensor_ranks[tensor_number]
+            final_groups = [[0]] + [applyIndexMapTo(index_map,group) for group in final_groups]
+            # }}}
+            function_lines.append("_{0} = _{0}.join(*{1})".format(final_tensor_number,final_groups))
+            appendReturnOfResult(final_tensor_number)
+        elif len(final_groups) > 0:
+            # Compute index map and apply the index map to the final groups {{{
+            index_offset = 0
+            index_map = {}
+            for tensor_number in active_tensor_numbers:
+                for index in range(tensor_ranks[tensor_number]):
+                    index_map[(tensor_number,index)] = index+index_offset
+                index_offset += tensor_ranks[tensor_number]
+            final_groups = [applyIndexMapTo(index_map,group) for group in final_groups]
+            # }}}
+            if last_contraction is not None and last_contraction[1] == final_tensor_number:
+                # Write the last contraction straight into out, viewed with
+                # the axes in the order in which the contraction forms them.
+                line_number, _, contraction, dimensions = last_contraction
+                final_order = [index for group in final_groups for index in group]
+                out_view = "out"
+                if any(len(group) > 1 for group in final_groups):
+                    out_view += ".split({})".format(",".join(dimensions[index] for index in final_order))
+                if final_order != sorted(final_order):
+                    out_view += ".transpose({})".format(invertPermutation(final_order))
+                function_lines[line_number:line_number+1] = [
+                    "if out is not None:",
+                    "    {},out={},accumulate=accumulate)".format(contraction,out_view),
+                    "    return out",
+                    "_{} = {})".format(final_tensor_number,contraction),
+                ]
+                function_lines.append("return _{}.join(*{})".format(final_tensor_number,final_groups))
+            else:
+                function_lines.append("_{0} = _{0}.join(*{1})".format(final_tensor_number,final_groups))
+                appendReturnOfResult(final_tensor_number)
+        else:
+            if last_contraction is not None and last_contraction[1] == final_tensor_number:
+                # The scalar must not be left in a buffer of the workspace.
+                line_number, _, contraction, _ = last_contraction
+                function_lines[line_number] = "_{} = {})".format(final_tensor_number,contraction)
+            appendReturnOfScalar(final_tensor_number)
     # }}}
     # Compile and return the function {{{
     function_source = "\n    ".join(function_lines)
     captured_definition = {}
-    visible_exceptions = {}
-    for exception_name in ["DimensionMismatchError","UnexpectedTensorRankError"]:
-        visible_exceptions[exception_name] = globals()[exception_name]
-    exec(function_source,visible_exceptions,captured_definition)
+    visible_names = {}
+    for name in ["DimensionMismatchError","UnexpectedTensorRankError","contractUsingWorkspace"]:
+        visible_names[name] = globals()[name]
+    exec(function_source,visible_names,captured_definition)
     contract = captured_definition["contract"]
     contract.source = function_source
+    contract.tensor_ranks = tensor_ranks[:number_of_tensors]
     return contract
     # }}}
 # }}}
@@ -795,6 +1560,12 @@ def normalizeAndDenormalize(tensor_to_normalize,index_to_normalize,tensor_to_den
 def randomComplexSample(shape): # {{{
     return random_sample(shape)*2-1+random_sample(shape)*2j-1j
 # }}}
+def randomSample(shape,dtype=complex128): # {{{
+    if issubdtype(dtype,complexfloating):
+        return randomComplexSample(shape).astype(dtype,copy=False)
+    else:
+        return (random_sample(shape)*2-1).astype(dtype,copy=False)
+# }}}
 def replaceAt(iterable,index,new_value): # {{{
     new_values = (old_value if i != index else new_value for (i,old_value) in enumerate(iterable))
     try:
@@ -802,86 +1573,77 @@ def replaceAt(iterable,index,new_value): # {{{
     except TypeError:
         return tuple(new_values)
 # }}}
-def relaxOver(initial,expectation_multiplier,normalization_multiplier=None,maximum_number_of_multiplications=None,tolerance=1e-7,dimension_of_krylov_space=None): # {{{
+def relaxOver(initial,expectation_multiplier,normalization_multiplier=None,maximum_number_of_multiplications=None,tolerance=1e-7,dimension_of_krylov_space=None,eigensolver=None,initial_subspace=None,return_subspace=False,normalization_solver=None): # {{{
     DataClass = type(initial)
     shape = initial.shape
     initial = initial.toArray().ravel()
     initial /= norm(initial)
     N = len(initial)
-    if dimension_of_krylov_space is None:
-        dimension_of_krylov_space = 3
+    if eigensolver is None:
+        eigensolver = RestartedKrylovEigensolver(3 if dimension_of_krylov_space is None else dimension_of_krylov_space)
+    expected_number_of_multiplications = eigensolver.expected_number_of_multiplications
+
+    expectation_diagonal = None
+    normalization_diagonal = None
 
     if normalization_multiplier is None:
         applyInverseNormalization = lambda x: x
-    elif normalization_multiplier.isCheaperToFormMatrix(10*2*dimension_of_krylov_space):
-        applyInverseNormalization = partial(lu_solve,lu_factor(normalization_multiplier.formMatrix().toArray()))
-        del normalization_multiplier
+        multiplyNormalization = None
     else:
-        normalization_matvec = lambda v: normalization_multiplier(DataClass(v.reshape(shape))).toArray().ravel()
-        normalization_operator = LinearOperator(matvec=normalization_matvec,shape=(N,N),dtype=initial.dtype)
-        def applyInverseNormalization(in_v):
-            out_v, info = gmres(normalization_operator,in_v)
-            assert info == 0
-            return out_v
-
-    if expectation_multiplier.isCheaperToFormMatrix(2*dimension_of_krylov_space):
+        if normalization_solver is None:
+            normalization_solver = NormalizationSolver()
+        normalization_solver.prepare(normalization_multiplier,10*expected_number_of_multiplications,eigensolver.uses_inverse_normalization,eigensolver.uses_diagonals,shape,DataClass,initial.dtype)
+        applyInverseNormalization = normalization_solver.applyInverse
+        multiplyNormalization = normalization_solver.multiplyNormalization
+        normalization_diagonal = normalization_solver.diagonal
+        del normalization_multiplier
+
+    if expectation_multiplier.isCheaperToFormMatrix(expected_number_of_multiplications):
         expectation_matrix = expectation_multiplier.formMatrix().toArray()
-        multiplyExpectation = lambda v: dot(expectation_matrix,v)
+        multiplyExpectationMatrix = lambda v: dot(expectation_matrix,v)
+        expectation_diagonal = expectation_matrix.diagonal().real
         del expectation_multiplier
     else:
-        multiplyExpectation = lambda v: expectation_multiplier(DataClass(v.reshape(shape))).toArray().ravel()
-
-    multiply = lambda v: applyInverseNormalization(multiplyExpectation(v))
-    initial_value = dot(initial.conj(),multiply(initial))
-
-    number_of_multiplications = 0
-    last_lowest_eigenvalue = None
-    space_is_complete = dimension_of_krylov_space == N
-    while True:
-        krylov_basis = zeros((dimension_of_krylov_space,N),dtype=complex128)
-        multiplied_krylov_basis = zeros((dimension_of_krylov_space,N),dtype=complex128)
-        krylov_basis[0] = initial
-        del initial
-        for i in range(0,dimension_of_krylov_space):
-            multiplied_krylov_basis[i] = multiply(krylov_basis[i])
-            if i < dimension_of_krylov_space-1:
-                # Note:  Subtracting and then normalizing is numerically unstable
-                #        when the vector is close to being an eigenvector
-                #        due to the loss of precision when taking the difference
-                #        between the original vector and the multiplied vector
-                krylov_basis[i+1] = multiplied_krylov_basis[i] - dot(dot(krylov_basis[:i+1].conj(),multiplied_krylov_basis[i]),krylov_basis[:i+1])
-                normalization = norm(krylov_basis[i+1])
-                if normalization <= 1e-14:
-                    space_is_complete = True
-                    krylov_basis = krylov_basis[:i+1]
-                    multiplied_krylov_basis = multiplied_krylov_basis[:i+1]
-                    break
-                krylov_basis[i+1] /= normalization
-        number_of_multiplications += dimension_of_krylov_space
-
-        matrix_in_krylov_subspace = dot(krylov_basis.conj(),multiplied_krylov_basis.transpose())
-        evals, evecs = eig(matrix_in_krylov_subspace)
-        mindex = argmin(evals.real)
-        mineval = evals[mindex]
-        minevec = evecs[:,mindex]
-        if space_is_complete or last_lowest_eigenvalue is not None and (abs(last_lowest_eigenvalue-mineval)<=tolerance) or maximum_number_of_multiplications is not None and number_of_multiplications >= maximum_number_of_multiplications:
-            final = dot(minevec,krylov_basis)
-            final /= norm(final)
-            final_value = dot(final.conj(),multiply(final))
-            if (final_value-initial_value)/(abs(final_value)+abs(initial_value)) > 1 + 1e-7:
-                raise RelaxFailed(initial_value,final_value)
-            return DataClass(final.reshape(shape))
-        else:
-            initial = dot(minevec,krylov_basis)
-            initial /= norm(initial)
-            last_lowest_eigenvalue = mineval
-    # }}}
+        multiplyExpectationMatrix = lambda v: expectation_multiplier(DataClass(v.reshape(shape))).toArray().ravel()
+        if eigensolver.uses_diagonals and expectation_multiplier.formDiagonal is not None:
+            expectation_diagonal = expectation_multiplier.formDiagonal().toArray().ravel().real
+
+    number_of_multiplications = [0]
+    def multiplyExpectation(v):
+        number_of_multiplications[0] += 1
+        return multiplyExpectationMatrix(v)
+
+    initial_value, final_value, final, subspace = eigensolver.solve(
+        initial,
+        multiplyExpectation,
+        multiplyNormalization,
+        applyInverseNormalization,
+        tolerance,
+        maximum_number_of_multiplications,
+        expectation_diagonal=expectation_diagonal,
+        normalization_diagonal=normalization_diagonal,
+        initial_subspace=[vector.toArray().ravel() for vector in initial_subspace or []],
+    )
+    eigensolver.recordCall(number_of_multiplications[0])
+    log.debug("{} used {} multiplications".format(eigensolver,number_of_multiplications[0]))
+    if (final_value-initial_value)/(abs(final_value)+abs(initial_value)) > 1 + 1e-7:
+        raise RelaxFailed(initial_value,final_value)
+    final /= norm(final)
+    if return_subspace:
+        return DataClass(final.reshape(shape)), [DataClass(vector.reshape(shape)) for vector in subspace]
+    else:
+        return DataClass(final.reshape(shape))
+# }}}
 def unitize(matrix): # {{{
     U, _, V = svd(matrix,full_matrices=False)
     return dot(U,V)
 # }}}
 # }}}
 
+# Caches {{{
+data_contractor_plan_cache = DataContractorPlanCache()
+# }}}
+
 # Index functions {{{
 def O(i): return (i+2)%4
 def L(i): return (i+1)%4
@@ -895,36 +1657,56 @@ def RA(i): return A(i,R(i))
 # Exports {{{
 __all__ = [
     "DimensionMismatchError",
+    "InitialVectorRejected",
     "InvariantViolatedError",
+    "NormalizationInverseFailed",
     "RelaxFailed",
     "UnexpectedTensorRankError",
 
     "FromLeft",
     "FromRight",
+    "DataContractorPlanCache",
+    "DavidsonEigensolver",
+    "Eigensolver",
     "FromBoth",
     "Join",
+    "LanczosEigensolver",
     "Multiplier",
+    "NormalizationSolver",
+    "PlannedDataContractor",
+    "RestartedKrylovEigensolver",
+    "SubspaceEigensolver",
 
     "prepend",
     "prependContractor",
     "prependDataContractor",
+    "prependPlannedDataContractor",
 
     "Pauli",
 
+    "data_contractor_plan_cache",
+
     "applyIndexMapTo",
     "applyPermutation",
     "buildProductTensor",
     "buildTensor",
+    "changePrecisionOf",
     "checkForNaNsIn",
     "computeAndCheckNewDimension",
     "computeCompressor",
+    "computeCheapestJoinOrder",
     "computeCompressorForMatrixTimesItsDagger",
     "computeAbsoluteLimitingLinearCoefficient",
     "computeNewDimension",
     "computeNormalizerAndInverse",
+    "computeRandomizedEigenvectors",
+    "contractUsingWorkspace",
     "crand",
     "dropAt",
+    "estimateCostOfLanczosEigenvectors",
+    "estimateCostOfRandomizedEigenvectors",
     "formAbsorber",
+    "formBatchableDataContractor",
     "formContractor",
     "formDataContractor",
     "invertPermutation",
@@ -934,6 +1716,7 @@ __all__ = [
     "normalizeAndReturnInverseNormalizer",
     "normalizeAndDenormalize",
     "randomComplexSample",
+    "randomSample",
     "replaceAt",
     "relaxOver",
     "unitize",
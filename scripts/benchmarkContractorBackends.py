@@ -0,0 +1,64 @@
+from __future__ import division, print_function
+import sys
+bandwidth_dimension = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+physical_dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+number_of_repetitions = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+from timeit import timeit
+
+from carcassonne.data import NDArrayData
+from carcassonne.data.cost_tracker import computeCostOfContracting, computePeakMemoryOfContracting
+from carcassonne.utils import Join, L, O, R, formDataContractor
+
+b = bandwidth_dimension
+d = physical_dimension
+m = 32*b
+
+networks = [
+    ("matrix chain",
+        [Join(i,1,i+1,0) for i in range(5)],
+        [[(0,0)],[(5,1)]],
+        [(m,b),(b,m),(m,b),(b,m),(m,b),(b,m)],
+    ),
+    ("absorb center SOS into side",
+        [
+            Join(3,0,2,4),
+            Join(3,1,1,4),
+            Join(0,6,1,0),
+            Join(0,7,2,0),
+        ],
+        [
+            [(0,0),(1,L(0))],
+            [(0,1),(2,L(0))],
+            [(0,2)],
+            [(0,3),(1,R(0))],
+            [(0,4),(2,R(0))],
+            [(0,5)],
+            [(1,O(0))],
+            [(2,O(0))],
+        ],
+        [(b,b,b,b,b,b,b,b),(b,b,b,b,d),(b,b,b,b,d),(d,d)],
+    ),
+]
+
+print("bandwidth dimension = {}, physical dimension = {}".format(bandwidth_dimension,physical_dimension))
+for name, joins, final_groups, shapes in networks:
+    tensors = [NDArrayData.newRandom(*shape) for shape in shapes]
+    results = {}
+    print(name)
+    for backend in ["tensordot","einsum"]:
+        contractor = formDataContractor(
+            [Join(join.left_tensor_number,join.left_tensor_indices,join.right_tensor_number,join.right_tensor_indices) for join in joins],
+            [list(group) for group in final_groups],
+            tensor_shapes=shapes,
+            backend=backend
+        )
+        results[backend] = contractor(*tensors)
+        print("    {:>9}: {:.3e} s per call, {} flops, peak of {} elements".format(
+            backend,
+            timeit(lambda: contractor(*tensors),number=number_of_repetitions)/number_of_repetitions,
+            computeCostOfContracting(contractor,*shapes),
+            computePeakMemoryOfContracting(contractor,*shapes),
+        ))
+    if not results["tensordot"].allcloseTo(results["einsum"]):
+        print("    WARNING: the backends disagree!")